@@ -0,0 +1,163 @@
+# app/analysis_cache.py
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from . import crud, database
+
+logger = logging.getLogger(__name__)
+
+# Tunables for the two tiers. Memory holds the hot set; the table survives restarts.
+CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "2048"))
+CACHE_TTL_SECONDS = float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "3600"))
+CACHE_DB_TTL_SECONDS = float(os.getenv("ANALYSIS_CACHE_DB_TTL_SECONDS", str(7 * 86400)))
+
+
+def make_key(kind: str, prompt: str, text: str, image_bytes: Optional[bytes] = None) -> str:
+    """
+    Builds a content address for one analysis request. The prompt template is part
+    of the key, so editing a prompt automatically invalidates old answers.
+    """
+    digest = hashlib.sha256()
+    for part in (kind.encode(), prompt.encode(), text.encode(), image_bytes or b""):
+        # Length-prefix each part so different splits can never hash the same.
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Two-tier cache for analyzer results: an in-memory LRU with a TTL in front of
+    the `analysis_cache` table. Identical requests that arrive while a model call
+    is already running wait for that call instead of starting their own.
+    """
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: float = CACHE_TTL_SECONDS,
+                 db_ttl_seconds: float = CACHE_DB_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_ttl_seconds = db_ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "coalesced": 0, "stores": 0, "evictions": 0}
+
+    def _get_memory(self, key: str) -> Optional[dict]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, result = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _put_memory(self, key: str, result: dict):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def _load_persistent(self, key: str) -> Optional[dict]:
+        async with database.AsyncSessionLocal() as db:
+            return await crud.get_cached_analysis_async(db, key, self.db_ttl_seconds)
+
+    async def _store_persistent(self, key: str, kind: str, result: dict):
+        async with database.AsyncWriteSessionLocal() as db:
+            try:
+                await crud.save_cached_analysis_async(db, key, kind, result)
+            except Exception as e:
+                # Another worker may have stored the same key first; the cache is best-effort.
+                await db.rollback()
+                logger.warning("Could not persist analysis cache entry: %s", e)
+
+    async def get_or_compute(self, key: str, kind: str,
+                             compute: Callable[[], Awaitable[Tuple[dict, bool]]]) -> dict:
+        """
+        Returns the cached result for `key`, or runs `compute` once to produce it.
+        `compute` returns (result, cacheable); fallback answers are never cached.
+        """
+        result, _ = await self.get_or_compute_status(key, kind, compute)
+        return result
+
+    async def get_or_compute_status(self, key: str, kind: str,
+                                    compute: Callable[[], Awaitable[Tuple[dict, bool]]]) -> Tuple[dict, bool]:
+        """Like get_or_compute, but returns (result, cacheable) so callers can tell a real answer from a fallback."""
+        result = self._get_memory(key)
+        if result is not None:
+            self.stats["memory_hits"] += 1
+            return dict(result), True
+
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+        else:
+            # The work runs as its own task and every caller, the first included, waits
+            # through shield: a caller that is cancelled stops waiting, but the others
+            # still get the answer and it is still cached.
+            pending = asyncio.ensure_future(self._load_or_compute(key, kind, compute))
+            self._in_flight[key] = pending
+            pending.add_done_callback(lambda task: self._finish(key, task))
+        result, cacheable = await asyncio.shield(pending)
+        return dict(result), cacheable
+
+    async def _load_or_compute(self, key: str, kind: str,
+                               compute: Callable[[], Awaitable[Tuple[dict, bool]]]) -> Tuple[dict, bool]:
+        result = await self._load_persistent(key)
+        if result is not None:
+            self.stats["db_hits"] += 1
+            self._put_memory(key, result)
+            return result, True
+        self.stats["misses"] += 1
+        result, cacheable = await compute()
+        if cacheable:
+            self._put_memory(key, result)
+            await self._store_persistent(key, kind, result)
+            self.stats["stores"] += 1
+        return result, cacheable
+
+    def _finish(self, key: str, task: asyncio.Future):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every caller had already gone.
+            task.exception()
+
+    async def lookup(self, key: str) -> Optional[dict]:
+        """The cached result for `key`, or None. Never computes, and never waits for a call in flight."""
+        result = self._get_memory(key)
+        if result is not None:
+            self.stats["memory_hits"] += 1
+            return dict(result)
+        result = await self._load_persistent(key)
+        if result is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["db_hits"] += 1
+        self._put_memory(key, result)
+        return dict(result)
+
+    async def store(self, key: str, kind: str, result: dict):
+        """Caches a result produced outside get_or_compute, e.g. a streamed answer."""
+        self._put_memory(key, result)
+        await self._store_persistent(key, kind, result)
+        self.stats["stores"] += 1
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["memory_hits"] + self.stats["db_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["db_hits"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "in_flight": len(self._in_flight),
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+
+# Create a single global cache to be shared across the application
+analysis_cache = AnalysisCache()
@@ -1,73 +1,119 @@
 import os
 import json
-import google.generativeai as genai
-from typing import Optional
+import time
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Optional, Tuple
 from dotenv import load_dotenv
 
+from .analysis_cache import analysis_cache, make_key as make_cache_key
+from . import metrics, local_triage
+from .model_scheduler import model_scheduler, ModelShed
+
+logger = logging.getLogger(__name__)
+
 # --- Setup and Initialization (No Changes Here) ---
 load_dotenv()
 CERT_PATH = os.getenv("SSL_CERT_FILE")
 if CERT_PATH and os.path.exists(CERT_PATH):
     os.environ['SSL_CERT_FILE'] = CERT_PATH
-    print("Manually set SSL_CERT_FILE environment variable for this process.")
+    logger.info("Manually set SSL_CERT_FILE environment variable for this process.")
 
-try:
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-    journal_model = genai.GenerativeModel('gemini-1.5-flash')
-    symptom_model = genai.GenerativeModel('gemini-1.5-flash')
-    print("Gemini AI clients initialized successfully.")
-except Exception as e:
-    print(f"An error occurred during Gemini initialization: {e}")
-    journal_model = None
-    symptom_model = None
+# The Gemini SDK (and the gRPC stack under it) is the slowest thing this app
+# imports, so it is loaded and the models are built on first use instead of at
+# import time. The API calls warm_up() from its startup hook.
+journal_model = None
+symptom_model = None
+_models_ready = False
+_models_lock = threading.Lock()
 
+def _get_models():
+    """Returns (journal_model, symptom_model), importing the SDK and building them on the first call."""
+    global journal_model, symptom_model, _models_ready
+    if _models_ready:
+        return journal_model, symptom_model
+    with _models_lock:
+        if not _models_ready:
+            try:
+                import google.generativeai as genai
 
-# --- Journal Analysis Function (Already Robust, No Changes) ---
-def analyze_journal_entry(text: str) -> dict:
-    if not journal_model:
-        return {"analysis": "AI model not initialized.", "sentiment_score": 0.0, "encouragement": "Could not connect."}
-    
-    # This prompt asks for a numerical score, making the AI a quantitative tool.
-    SYSTEM_PROMPT = """
+                genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+                # These two models are shared by every request. Each one creates its gRPC
+                # client on first use and then reuses it, so we never pay a reconnect per call.
+                journal_model = journal_model or genai.GenerativeModel('gemini-1.5-flash')
+                symptom_model = symptom_model or genai.GenerativeModel('gemini-1.5-flash')
+                logger.info("Gemini AI clients initialized successfully.")
+            except Exception as e:
+                logger.error("An error occurred during Gemini initialization: %s", e)
+            # A failed initialization is not retried on every request
+            _models_ready = True
+    return journal_model, symptom_model
+
+async def _get_models_async():
+    """Like _get_models, but the first call imports the SDK in a worker thread."""
+    if _models_ready:
+        return journal_model, symptom_model
+    return await asyncio.to_thread(_get_models)
+
+
+def install_models(journal=None, symptom=None):
+    """
+    Swaps in other model objects, e.g. the local stand-in used by the benchmarks.
+    Anything with generate_content / generate_content_async works.
+    """
+    global journal_model, symptom_model, _models_ready
+    with _models_lock:
+        if journal is not None:
+            journal_model = journal
+        if symptom is not None:
+            symptom_model = symptom
+        if journal is not None and symptom is not None:
+            _models_ready = True
+
+# What the API's startup hook does ahead of the first request: "off" leaves it all
+# to the first analysis, "load" (default) imports the SDK and builds the models in
+# the background, "request" also sends each model a tiny prompt so the connection
+# and auth handshake are done too.
+ANALYZER_WARM_UP = os.getenv("ANALYZER_WARM_UP", "load").lower()
+
+async def warm_up(mode: str = ANALYZER_WARM_UP):
+    """Prepares the models ahead of the first request. Failures are logged, never raised."""
+    if mode == "off":
+        return
+    started = time.perf_counter()
+    models = await _get_models_async()
+    if mode == "request":
+        for model in models:
+            if model is None:
+                continue
+            try:
+                await _generate_async(model, "Reply with {}")
+            except Exception as e:
+                logger.warning("Gemini warm-up request failed: %s", e)
+    logger.info("Analyzer warm-up (%s) took %.0f ms.", mode, (time.perf_counter() - started) * 1000)
+
+# --- Async call limits ---
+# Upper bound on a single model round-trip. How many run at once, and in what
+# order, is up to the model scheduler.
+ANALYZER_TIMEOUT_SECONDS = float(os.getenv("ANALYZER_TIMEOUT_SECONDS", "20"))
+
+
+# --- Prompts and fallbacks shared by the sync and async paths ---
+SAFETY_SETTINGS = [{"category": c, "threshold": "BLOCK_NONE"} for c in ["HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT"]]
+
+# This prompt asks for a numerical score, making the AI a quantitative tool.
+JOURNAL_PROMPT = """
     You are an expert sentiment analysis AI with a focus on empathy. Analyze the user's journal entry.
     You MUST respond ONLY with a JSON object with three keys:
     1. "analysis": A concise, one-sentence summary of the main emotion.
     2. "sentiment_score": A numerical score from -1.0 (very positive/calm/hopeful) to 1.0 (very negative/distressed/anxious). A neutral entry should be 0.0.
     3. "encouragement": A short, gentle, and uplifting message (1-2 sentences) appropriate to the sentiment.
     """
-    
-    safe_fallback_response = {
-        "analysis": "Entry saved.",
-        "sentiment_score": 0.1,
-        "encouragement": "Thank you for sharing. Remember that every step, no matter how small, is part of your journey."
-    }
-    
-    try:
-        full_prompt = f"{SYSTEM_PROMPT}\n\nUser Journal Entry:\n---\n{text}"
-        safety_settings = [{"category": c, "threshold": "BLOCK_NONE"} for c in ["HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT"]]
-        response = journal_model.generate_content(full_prompt, safety_settings=safety_settings)
-
-        if not response.parts:
-            print("WARNING: Journal analysis response was blocked, likely due to safety filters.")
-            return safe_fallback_response
-
-        cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
-        return json.loads(cleaned_response)
-    except Exception as e:
-        print(f"Error during Gemini journal analysis: {e}")
-        return safe_fallback_response
 
-
-# --- THIS IS THE UPGRADED SYMPTOM ANALYSIS FUNCTION ---
-def analyze_symptom_with_image(text_description: str, image_bytes: Optional[bytes] = None) -> dict:
-    if not symptom_model:
-         return {"severity": "Moderate", "advice": "Could not connect to the AI service."}
-    
-    # Define a safe fallback response for when the AI fails or is blocked
-    safe_fallback = {"severity": "Moderate", "advice": "Unable to analyze symptom at this time. As a precaution, please consult your care team."}
-
-    SYMPTOM_PROMPT = """
-    You are a clinical analysis AI assistant for the CareCompanion app. 
+SYMPTOM_PROMPT = """
+    You are a clinical analysis AI assistant for the CareCompanion app.
     Your role is to assess a patient's description of a symptom (and an optional photo) and provide a severity level and clear, safe advice.
     Analyze the user's input and determine:
     1.  **Severity**: Classify as "Mild", "Moderate", or "Severe".
@@ -78,32 +124,394 @@ def analyze_symptom_with_image(text_description: str, image_bytes: Optional[byte
     - NEVER diagnose a specific condition.
     - Respond ONLY with a JSON object with two keys: "severity" and "advice".
     """
-    
+
+JOURNAL_FALLBACK = {
+    "analysis": "Entry saved.",
+    "sentiment_score": 0.1,
+    "encouragement": "Thank you for sharing. Remember that every step, no matter how small, is part of your journey."
+}
+
+# Define a safe fallback response for when the AI fails or is blocked
+SYMPTOM_FALLBACK = {"severity": "Moderate", "advice": "Unable to analyze symptom at this time. As a precaution, please consult your care team."}
+
+
+def _journal_prompt(text: str) -> str:
+    return f"{JOURNAL_PROMPT}\n\nUser Journal Entry:\n---\n{text}"
+
+def _symptom_prompt_parts(text_description: str, image_bytes: Optional[bytes], mime_type: str = "image/jpeg") -> list:
     prompt_parts = [SYMPTOM_PROMPT, "\n\n--- USER'S REPORT ---\n", text_description]
     if image_bytes:
-        image_part = {"mime_type": "image/jpeg", "data": image_bytes}
+        image_part = {"mime_type": mime_type, "data": image_bytes}
         prompt_parts.insert(1, image_part)
-        
+    return prompt_parts
+
+def _parse_response(response, kind: str) -> Optional[dict]:
+    """Extracts the JSON payload from a model response, or None if it was blocked."""
+    # We check for a blocked response before trying to parse the text
+    if not response.parts:
+        logger.warning("%s analysis response was blocked, likely due to safety filters.", kind)
+        return None
+    cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
+    return json.loads(cleaned_response)
+
+
+def _record_call(kind: str, outcome: str, started: float):
+    """Records one model round-trip under its outcome: ok, blocked, parse_error, timeout, shed or fallback."""
+    model = kind.lower()
+    metrics.ANALYZER_LATENCY.labels(model, outcome).observe(time.perf_counter() - started)
+    metrics.ANALYZER_REQUESTS.labels(model, outcome).inc()
+
+
+def _analyze_sync(model, contents, kind: str, fallback: dict) -> dict:
+    started = time.perf_counter()
+    try:
+        response = model.generate_content(contents, safety_settings=SAFETY_SETTINGS)
+        result = _parse_response(response, kind)
+    except json.JSONDecodeError as e:
+        _record_call(kind, "parse_error", started)
+        logger.warning("Gemini %s analysis returned invalid JSON: %s", kind.lower(), e)
+        return dict(fallback)
+    except Exception as e:
+        _record_call(kind, "fallback", started)
+        logger.error("Error during Gemini %s analysis: %s", kind.lower(), e)
+        return dict(fallback)
+    if result is None:
+        _record_call(kind, "blocked", started)
+        return dict(fallback)
+    _record_call(kind, "ok", started)
+    return {**result, "analysis_source": "model"}
+
+
+def _reconcile_symptom(model_result: dict, provisional: dict) -> Optional[dict]:
+    """The model's symptom answer, unless it rates a red-flagged description below Severe."""
+    if provisional["red_flags"] and model_result.get("severity") != "Severe":
+        logger.warning("Model rated a symptom with red flags (%s) as %s; keeping Severe.",
+                       ", ".join(provisional["red_flags"]), model_result.get("severity"))
+        return None
+    return model_result
+
+
+# --- Journal Analysis Function ---
+# When the model is unavailable, fails or is blocked, the local triage answers instead of a fixed fallback.
+def analyze_journal_entry(text: str) -> dict:
+    journal_model, _ = _get_models()
+    provisional = local_triage.analyze_journal(text)
+    if not journal_model:
+        return provisional
+    return _analyze_sync(journal_model, _journal_prompt(text), "Journal", provisional)
+
+
+# --- THIS IS THE UPGRADED SYMPTOM ANALYSIS FUNCTION ---
+def analyze_symptom_with_image(text_description: str, image_bytes: Optional[bytes] = None, mime_type: str = "image/jpeg") -> dict:
+    _, symptom_model = _get_models()
+    provisional = local_triage.triage_symptom(text_description)
+    if not symptom_model:
+        return provisional
+    result = _analyze_sync(symptom_model, _symptom_prompt_parts(text_description, image_bytes, mime_type), "Symptom", provisional)
+    return _reconcile_symptom(result, provisional) or provisional
+
+
+# --- Async variants for the API: they never block the event loop ---
+async def _generate_async(model, contents, kind: str = "Journal", priority: str = "background",
+                          user_id: Optional[int] = None):
+    """Runs one model call once the scheduler admits it, each attempt bounded by the timeout."""
+    return await model_scheduler.run(
+        lambda: asyncio.wait_for(
+            model.generate_content_async(
+                contents,
+                safety_settings=SAFETY_SETTINGS,
+                request_options={"timeout": ANALYZER_TIMEOUT_SECONDS},
+            ),
+            timeout=ANALYZER_TIMEOUT_SECONDS,
+        ),
+        priority=priority, user_id=user_id, model=kind.lower(),
+    )
+
+async def _analyze_async(model, contents, kind: str, fallback: dict, priority: str = "background",
+                         user_id: Optional[int] = None) -> Tuple[dict, bool]:
+    """Returns (result, cacheable). Only a parsed model answer is cacheable."""
+    started = time.perf_counter()
+    try:
+        response = await _generate_async(model, contents, kind, priority, user_id)
+        result = _parse_response(response, kind)
+    except ModelShed as e:
+        _record_call(kind, "shed", started)
+        logger.warning("Gemini %s analysis was not attempted: %s", kind.lower(), e)
+        return dict(fallback), False
+    except asyncio.TimeoutError:
+        _record_call(kind, "timeout", started)
+        logger.warning("Gemini %s analysis timed out after %ss.", kind.lower(), ANALYZER_TIMEOUT_SECONDS)
+        return dict(fallback), False
+    except json.JSONDecodeError as e:
+        _record_call(kind, "parse_error", started)
+        logger.warning("Gemini %s analysis returned invalid JSON: %s", kind.lower(), e)
+        return dict(fallback), False
+    except Exception as e:
+        _record_call(kind, "fallback", started)
+        logger.error("Error during Gemini %s analysis: %s", kind.lower(), e)
+        return dict(fallback), False
+    if result is None:
+        _record_call(kind, "blocked", started)
+        return dict(fallback), False
+    _record_call(kind, "ok", started)
+    return result, True
+
+# --- Hedged analysis: a local answer now, the model's answer when it arrives ---
+# How long a request waits for the model before answering with the local triage
+# result instead. The model call keeps running, and its answer replaces the
+# provisional one. 0 waits for the model (up to ANALYZER_TIMEOUT_SECONDS) and
+# uses the local result only if the model fails.
+ANALYZER_HEDGE_BUDGET_SECONDS = float(os.getenv("ANALYZER_HEDGE_BUDGET_MS", "2000")) / 1000
+
+@dataclass
+class HedgedAnalysis:
+    """
+    `result` is the answer to use now; its "analysis_source" says whether it came
+    from the model or the local triage. If the model missed the budget, `pending`
+    resolves to the model's answer later, or to None if it failed or was
+    overruled, in which case the local result stands.
+    """
+    result: dict
+    pending: Optional["asyncio.Task[Optional[dict]]"] = None
+
+async def _model_answer(kind: str, call: Awaitable[Optional[dict]]) -> Optional[dict]:
     try:
-        # We now apply the same safety settings as the journal to prevent blocking
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-        ]
-        
-        response = symptom_model.generate_content(prompt_parts, safety_settings=safety_settings)
-        
-        # --- THE FIX ---
-        # We now check for a blocked response before trying to parse the text
-        if not response.parts:
-            print("WARNING: Symptom analysis response was blocked by safety filters.")
-            return safe_fallback
-
-        cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
-        return json.loads(cleaned_response)
-        
+        return await call
     except Exception as e:
-        print(f"Error in Gemini symptom analysis: {e}")
-        return safe_fallback
\ No newline at end of file
+        # e.g. the cache's database read failed; the local result stands
+        logger.error("Error while waiting for the %s model answer: %s", kind, e)
+        return None
+
+async def _hedge(kind: str, provisional: dict, call: Awaitable[Optional[dict]], budget: float) -> HedgedAnalysis:
+    task = asyncio.ensure_future(_model_answer(kind, call))
+    try:
+        await asyncio.wait({task}, timeout=budget if budget > 0 else None)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if not task.done():
+        metrics.ANALYZER_HEDGES.labels(kind, "provisional").inc()
+        return HedgedAnalysis(provisional, pending=task)
+    answer = task.result()
+    metrics.ANALYZER_HEDGES.labels(kind, "model" if answer else "local").inc()
+    return HedgedAnalysis(answer or provisional)
+
+async def _journal_from_model(text: str, priority: str, user_id: Optional[int]) -> Optional[dict]:
+    journal_model, _ = await _get_models_async()
+    if not journal_model:
+        return None
+    key = make_cache_key("journal", JOURNAL_PROMPT, text)
+    result, ok = await analysis_cache.get_or_compute_status(
+        key, "journal", lambda: _analyze_async(journal_model, _journal_prompt(text), "Journal", JOURNAL_FALLBACK, priority, user_id)
+    )
+    return {**result, "analysis_source": "model"} if ok else None
+
+async def _symptom_from_model(text_description: str, image_bytes: Optional[bytes], mime_type: str,
+                              provisional: dict, user_id: Optional[int]) -> Optional[dict]:
+    _, symptom_model = await _get_models_async()
+    if not symptom_model:
+        return None
+    key = make_cache_key("symptom", SYMPTOM_PROMPT, text_description, image_bytes)
+    result, ok = await analysis_cache.get_or_compute_status(
+        key, "symptom",
+        lambda: _analyze_async(symptom_model, _symptom_prompt_parts(text_description, image_bytes, mime_type), "Symptom", SYMPTOM_FALLBACK,
+                               # A red flag jumps the queue and is never shed for the user's rate
+                               "urgent" if provisional["red_flags"] else "symptom", user_id)
+    )
+    return _reconcile_symptom({**result, "analysis_source": "model"}, provisional) if ok else None
+
+async def analyze_journal_entry_hedged(text: str, budget: float = ANALYZER_HEDGE_BUDGET_SECONDS,
+                                      user_id: Optional[int] = None, priority: str = "journal") -> HedgedAnalysis:
+    """Answers from the model if it responds within `budget` seconds, otherwise from the local triage."""
+    provisional = local_triage.analyze_journal(text)
+    return await _hedge("journal", provisional, _journal_from_model(text, priority, user_id), budget)
+
+async def analyze_symptom_with_image_hedged(text_description: str, image_bytes: Optional[bytes] = None,
+                                            mime_type: str = "image/jpeg",
+                                            budget: float = ANALYZER_HEDGE_BUDGET_SECONDS,
+                                            user_id: Optional[int] = None) -> HedgedAnalysis:
+    """Symptom counterpart of analyze_journal_entry_hedged. A red flag is never rated below Severe."""
+    provisional = local_triage.triage_symptom(text_description)
+    return await _hedge("symptom", provisional,
+                        _symptom_from_model(text_description, image_bytes, mime_type, provisional, user_id), budget)
+
+async def analyze_journal_entry_async(text: str, user_id: Optional[int] = None, priority: str = "journal") -> dict:
+    """Async equivalent of analyze_journal_entry, bounded by ANALYZER_TIMEOUT_SECONDS and cached by content."""
+    return (await analyze_journal_entry_hedged(text, budget=0, user_id=user_id, priority=priority)).result
+
+async def analyze_symptom_with_image_async(text_description: str, image_bytes: Optional[bytes] = None, mime_type: str = "image/jpeg",
+                                           user_id: Optional[int] = None) -> dict:
+    """Async equivalent of analyze_symptom_with_image, bounded by ANALYZER_TIMEOUT_SECONDS and cached by content."""
+    return (await analyze_symptom_with_image_hedged(text_description, image_bytes, mime_type, budget=0, user_id=user_id)).result
+
+
+# --- Streamed journal feedback: the encouragement as it is written, then the analysis ---
+# The streaming prompt puts the encouragement first, as plain text, so it can be
+# shown while the model is still writing; the structured part follows the delimiter.
+JOURNAL_STREAM_DELIMITER = "###"
+
+JOURNAL_STREAM_PROMPT = f"""
+    You are an expert sentiment analysis AI with a focus on empathy. Analyze the user's journal entry.
+    First write a short, gentle, and uplifting message (1-2 sentences) to the user, appropriate to the sentiment, as plain text.
+    Then write a line containing only {JOURNAL_STREAM_DELIMITER} followed by a JSON object with two keys:
+    1. "analysis": A concise, one-sentence summary of the main emotion.
+    2. "sentiment_score": A numerical score from -1.0 (very positive/calm/hopeful) to 1.0 (very negative/distressed/anxious). A neutral entry should be 0.0.
+    """
+
+def _journal_stream_prompt(text: str) -> str:
+    return f"{JOURNAL_STREAM_PROMPT}\n\nUser Journal Entry:\n---\n{text}"
+
+
+class _EncouragementSplitter:
+    """
+    Splits streamed model text at the delimiter. Text before it is released as it
+    arrives, except for trailing whitespace and anything that could be the start
+    of the delimiter, which wait for the next chunk.
+    """
+    def __init__(self, delimiter: str = JOURNAL_STREAM_DELIMITER):
+        self.delimiter = delimiter
+        self.encouragement = ""
+        self.tail: Optional[str] = None # everything after the delimiter, once it was seen
+        self._held = ""
+
+    def feed(self, chunk: str) -> str:
+        """Returns the encouragement text this chunk releases, possibly empty."""
+        if self.tail is not None:
+            self.tail += chunk
+            return ""
+        self._held += chunk
+        at = self._held.find(self.delimiter)
+        if at >= 0:
+            self.tail = self._held[at + len(self.delimiter):]
+            return self._release(self._held[:at].rstrip())
+        keep = next((n for n in range(min(len(self.delimiter) - 1, len(self._held)), 0, -1)
+                     if self.delimiter.startswith(self._held[-n:])), 0)
+        return self._release(self._held[:len(self._held) - keep].rstrip())
+
+    def _release(self, text: str) -> str:
+        self._held = self._held[len(text):]
+        if not self.encouragement:
+            text = text.lstrip()
+        self.encouragement += text
+        return text
+
+
+class StreamInterrupted(Exception):
+    """A streamed model call failed after some of its text was sent on."""
+
+async def _stream_journal_model(model, text: str, queue: asyncio.Queue) -> bool:
+    """Puts the model's text chunks on `queue`. Returns False if the answer was blocked."""
+    response = await model.generate_content_async(
+        _journal_stream_prompt(text),
+        safety_settings=SAFETY_SETTINGS,
+        stream=True,
+        request_options={"timeout": ANALYZER_TIMEOUT_SECONDS},
+    )
+    sent = False
+    try:
+        async for chunk in response:
+            if not chunk.parts:
+                return False
+            queue.put_nowait(chunk.text)
+            sent = True
+    except Exception as e:
+        if sent:
+            # Not a rate-limit error any more, so the scheduler does not retry it:
+            # a second attempt would stream the same text to the reader again
+            raise StreamInterrupted(str(e)) from e
+        raise
+    return True
+
+async def stream_journal_entry(text: str, user_id: Optional[int] = None,
+                               priority: str = "journal") -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Yields ("encouragement", text) pieces as the model writes them, then a single
+    ("result", analysis) with the same keys as analyze_journal_entry. A cached
+    answer comes in one piece. If the model is unavailable, blocked, slow or
+    malformed, the local triage fills in whatever was not streamed yet.
+    """
+    started = time.perf_counter()
+    provisional = local_triage.analyze_journal(text)
+    splitter = _EncouragementSplitter()
+    # Shared with the non-streaming path: both produce analysis, sentiment_score and encouragement
+    key = make_cache_key("journal", JOURNAL_PROMPT, text)
+
+    async def fallback(outcome: str):
+        _record_call("Journal", outcome, started)
+        if not splitter.encouragement:
+            metrics.ANALYZER_FIRST_TEXT.labels("local").observe(time.perf_counter() - started)
+            yield "encouragement", provisional["encouragement"]
+            yield "result", provisional
+        else:
+            # Keep the words the user has already read
+            yield "result", {**provisional, "encouragement": splitter.encouragement}
+
+    journal_model, _ = await _get_models_async()
+    cached = await analysis_cache.lookup(key) if journal_model else None
+    if cached is not None:
+        metrics.ANALYZER_FIRST_TEXT.labels("cache").observe(time.perf_counter() - started)
+        yield "encouragement", cached.get("encouragement", "")
+        yield "result", {**cached, "analysis_source": "model"}
+        return
+    if not journal_model:
+        async for event in fallback("fallback"):
+            yield event
+        return
+
+    queue: asyncio.Queue = asyncio.Queue()
+    call = asyncio.ensure_future(model_scheduler.run(
+        lambda: asyncio.wait_for(_stream_journal_model(journal_model, text, queue), timeout=ANALYZER_TIMEOUT_SECONDS),
+        priority=priority, user_id=user_id, model="journal",
+    ))
+    call.add_done_callback(lambda _: queue.put_nowait(None))
+    outcome = None
+    try:
+        while (chunk := await queue.get()) is not None:
+            first = not splitter.encouragement
+            piece = splitter.feed(chunk)
+            if piece:
+                if first:
+                    metrics.ANALYZER_FIRST_TEXT.labels("model").observe(time.perf_counter() - started)
+                yield "encouragement", piece
+        completed = call.result()
+        result = None
+        if completed and splitter.tail is not None:
+            result = json.loads(splitter.tail.strip().replace("```json", "").replace("```", ""))
+            if not isinstance(result, dict):
+                raise json.JSONDecodeError("Expected a JSON object", splitter.tail, 0)
+    except ModelShed as e:
+        logger.warning("Gemini journal stream was not attempted: %s", e)
+        outcome = "shed"
+    except asyncio.TimeoutError:
+        logger.warning("Gemini journal stream timed out after %ss.", ANALYZER_TIMEOUT_SECONDS)
+        outcome = "timeout"
+    except json.JSONDecodeError as e:
+        logger.warning("Gemini journal stream returned invalid JSON: %s", e)
+        outcome = "parse_error"
+    except Exception as e:
+        logger.error("Error during Gemini journal stream: %s", e)
+        outcome = "fallback"
+    finally:
+        # Only still running if the caller stopped iterating early; nobody would read the rest
+        call.cancel()
+
+    if outcome is None and not completed:
+        logger.warning("Journal stream response was blocked, likely due to safety filters.")
+        outcome = "blocked"
+    elif outcome is None and (result is None or not splitter.encouragement):
+        logger.warning("Gemini journal stream did not follow the streaming format.")
+        outcome = "parse_error"
+    if outcome is not None:
+        async for event in fallback(outcome):
+            yield event
+        return
+
+    _record_call("Journal", "ok", started)
+    result = {"analysis": result.get("analysis"), "sentiment_score": result.get("sentiment_score"),
+              "encouragement": splitter.encouragement}
+    try:
+        await analysis_cache.store(key, "journal", result)
+    except Exception as e:
+        logger.warning("Could not cache the streamed journal analysis: %s", e)
+    yield "result", {**result, "analysis_source": "model"}
+
@@ -1,12 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, Form, UploadFile, File
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Form, UploadFile, File, Query, Response
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+import os
+import json
+import asyncio
+import logging
+import datetime
+from typing import List, Literal, Optional
 from pydantic import BaseModel
 
 # Correctly import all necessary modules
-from . import crud, models, analyzer, database
-from .state_manager import patient_state # The critical import
+from . import crud, models, analyzer, database, insight_engine, timeseries, media, group_commit, export, daily_summary
+from .analysis_cache import analysis_cache
+from .model_scheduler import model_scheduler
+from .journal_worker import journal_queue, PendingJournalEntry
+from .state_manager import patient_registry # The critical import
+from .ws_manager import manager
+from .score_history import score_history, SCORE_METRICS
 
+logger = logging.getLogger(__name__)
 router = APIRouter()
 
 # --- Helper function to get a database session ---
@@ -17,66 +29,386 @@ def get_db():
     finally:
         db.close()
 
+# --- Async sessions for async endpoints, so DB round-trips never block the event loop ---
+async def get_async_db():
+    """A read session. On SQLite it draws from the reader pool."""
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_write_db():
+    """A session for endpoints that write. On SQLite all writers share one connection."""
+    async with database.AsyncWriteSessionLocal() as db:
+        yield db
+
 # --- Endpoint for manually entering clinical lab results ---
 class ClinicalData(BaseModel):
     biomarker_level: float
+    user_id: int = 1
 
 @router.post("/clinical-data")
 def update_clinical_data(data: ClinicalData):
     """Allows a user or clinician to manually enter new lab test results."""
-    patient_state.update_clinical_biomarker(data.biomarker_level)
-    print(f"Received new clinical biomarker level: {data.biomarker_level}")
+    patient_registry.get(data.user_id).update_clinical_biomarker(data.biomarker_level)
+    logger.info("Received new clinical biomarker level for user %s: %s", data.user_id, data.biomarker_level)
     return {"status": "clinical data updated"}
 
 
+# --- Model answers that arrive after a provisional (local triage) result was returned ---
+# Also runs streamed journal entries. Kept referenced until they finish, so they
+# are not garbage collected mid-flight.
+_late_results = set()
+
+def _run_late(coro):
+    task = asyncio.create_task(coro)
+    _late_results.add(task)
+    task.add_done_callback(_late_results.discard)
+
+async def _apply_late_journal_analysis(entry_id: int, user_id: int, provisional: dict, pending):
+    """Replaces a journal entry's provisional analysis with the model's and tells the dashboard."""
+    final = await pending
+    if final is None:
+        return
+    try:
+        async with database.AsyncWriteSessionLocal() as db:
+            await crud.update_journal_analyses_async(db, [(entry_id, final)])
+        state = await patient_registry.get_async(user_id)
+        state.revise_journal_sentiment(provisional.get("sentiment_score"), final.get("sentiment_score"))
+        await manager.send_to_user(user_id, {
+            "type": "journal_analysis",
+            "entry_id": entry_id,
+            "ai_analysis": final.get("analysis"),
+            "ai_encouragement": final.get("encouragement"),
+            "sentiment_score": final.get("sentiment_score"),
+            "analysis_source": final.get("analysis_source"),
+        })
+    except Exception:
+        logger.exception("Could not apply the late analysis of journal entry %s", entry_id)
+
+async def _apply_late_symptom_analysis(report_id: int, user_id: int, provisional_severity: str,
+                                       timestamp: datetime.datetime, pending):
+    """Replaces a symptom report's provisional triage with the model's and tells the dashboard."""
+    final = await pending
+    if final is None:
+        return
+    try:
+        async with database.AsyncWriteSessionLocal() as db:
+            await crud.update_symptom_analysis_async(db, report_id, final)
+        state = await patient_registry.get_async(user_id)
+        state.revise_symptom_report(provisional_severity, final.get("severity"), timestamp)
+        await manager.send_to_user(user_id, {
+            "type": "symptom_analysis",
+            "report_id": report_id,
+            "severity": final.get("severity"),
+            "advice": final.get("advice"),
+            "analysis_source": final.get("analysis_source"),
+        })
+    except Exception:
+        logger.exception("Could not apply the late analysis of symptom report %s", report_id)
+
+
 # --- Journal endpoint that correctly updates patient state ---
-@router.post("/journal", response_model=models.JournalEntryResponse)
-def create_new_journal_entry(entry: models.JournalEntryCreate, db: Session = Depends(get_db)):
-    # 1. Analyze the journal entry to get the sentiment score
-    analysis_result = analyzer.analyze_journal_entry(entry.content)
+@router.post("/journal", response_model=models.JournalEntryResponse,
+             responses={202: {"model": models.JournalEntryAccepted}})
+async def create_new_journal_entry(entry: models.JournalEntryCreate, background: bool = False, db: AsyncSession = Depends(get_async_write_db)):
+    # In background mode the entry is stored right away and analyzed by the worker
+    # pool; the result is pushed to the patient's dashboard over the WebSocket.
+    if background:
+        if not journal_queue.has_capacity():
+            raise HTTPException(status_code=503, detail="Journal analysis queue is full. Please retry shortly.")
+        db_entry = await group_commit.create_journal_entry_async(db=db, entry=entry, analysis_result={})
+        journal_queue.submit(PendingJournalEntry(entry_id=db_entry.id, user_id=db_entry.user_id, content=db_entry.content))
+        accepted = models.JournalEntryAccepted(id=db_entry.id, user_id=db_entry.user_id)
+        return JSONResponse(status_code=202, content=accepted.model_dump())
+
+    # 1. Analyze the journal entry to get the sentiment score (without blocking the event loop).
+    # If the model is slow, the local triage answers now and the model's answer follows.
+    hedged = await analyzer.analyze_journal_entry_hedged(entry.content, user_id=entry.user_id)
+    analysis_result = hedged.result
     
     # 2. Update the central patient state with the new score
     if analysis_result and analysis_result.get("sentiment_score") is not None:
-        patient_state.update_from_journal(analysis_result["sentiment_score"])
+        (await patient_registry.get_async(entry.user_id)).update_from_journal(analysis_result["sentiment_score"])
 
     # 3. Save the full result to the database
-    db_entry = crud.create_journal_entry(db=db, entry=entry, analysis_result=analysis_result)
-    
+    db_entry = await group_commit.create_journal_entry_async(db=db, entry=entry, analysis_result=analysis_result)
+
+    if hedged.pending is not None:
+        _run_late(_apply_late_journal_analysis(db_entry.id, db_entry.user_id, analysis_result, hedged.pending))
     return db_entry
 
 
+
+# --- Streamed journal feedback over server-sent events ---
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _stream_journal_entry(entry: models.JournalEntryCreate, events: asyncio.Queue):
+    """
+    Streams the analysis of `entry` onto `events` as SSE messages, then stores it
+    and updates the patient state. Ends with None. It runs as its own task, so an
+    entry is saved even if the client disconnects half-way through.
+    """
+    try:
+        result = None
+        async for kind, value in analyzer.stream_journal_entry(entry.content, user_id=entry.user_id):
+            if kind == "encouragement":
+                events.put_nowait(_sse("encouragement", {"text": value}))
+            else:
+                result = value
+
+        if result.get("sentiment_score") is not None:
+            (await patient_registry.get_async(entry.user_id)).update_from_journal(result["sentiment_score"])
+        # Not a request-scoped session: those are closed before a streamed body is sent
+        async with database.AsyncWriteSessionLocal() as db:
+            db_entry = await group_commit.create_journal_entry_async(db=db, entry=entry, analysis_result=result)
+        saved = models.JournalEntryListItem.model_validate(db_entry, from_attributes=True)
+        events.put_nowait(_sse("result", saved.model_dump(mode="json")))
+    except Exception:
+        logger.exception("Could not complete the streamed journal entry for user %s", entry.user_id)
+        events.put_nowait(_sse("error", {"detail": "Could not save your journal entry. Please try again."}))
+    finally:
+        events.put_nowait(None)
+
+@router.post("/journal/stream")
+async def stream_new_journal_entry(entry: models.JournalEntryCreate):
+    """
+    Like POST /journal, but answers with server-sent events as soon as the model
+    starts writing: "encouragement" events carry the message piece by piece, then
+    one "result" event carries the saved entry with its sentiment_score and
+    analysis_source ("error" instead if it could not be saved).
+    """
+    events: asyncio.Queue = asyncio.Queue()
+    _run_late(_stream_journal_entry(entry, events))
+
+    async def messages():
+        while (message := await events.get()) is not None:
+            yield message
+
+    # X-Accel-Buffering stops nginx-style proxies from holding the events back
+    return StreamingResponse(messages(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # --- THIS IS THE FINAL, UPGRADED SYMPTOM TRACKER ENDPOINT ---
 @router.post("/symptom-analysis", response_model=models.SymptomAnalysisResponse)
-async def analyze_symptom(description: str = Form(...), photo: Optional[UploadFile] = File(None), db: Session = Depends(get_db)):
+async def analyze_symptom(description: str = Form(...), photo: Optional[UploadFile] = File(None), user_id: int = Form(1), db: AsyncSession = Depends(get_async_write_db)):
     """
     Orchestrates the entire symptom tracking process:
     1. Gets an AI analysis of the symptom.
     2. Saves the new symptom to the database history.
-    3. Fetches the full recent history.
-    4. Triggers a recalculation of the patient's overall symptom score.
+    3. Updates the patient's running symptom score incrementally.
     """
-    # In a real app, you would handle the file upload properly. For now, we'll just
-    # get the filename as a placeholder for the database.
-    photo_path_placeholder = photo.filename if photo else None
-    image_bytes = await photo.read() if photo else None
+    # Stream the photo to content-addressed storage and load only its downscaled copy
+    stored_photo = None
+    image_bytes = None
+    if photo is not None and photo.filename:
+        try:
+            stored_photo = await media.store_upload(photo)
+        except media.UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except media.UnsupportedImageType as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        image_bytes = await media.read_model_image(stored_photo)
     
-    # 1. Get the AI analysis (severity and advice)
-    result = analyzer.analyze_symptom_with_image(text_description=description, image_bytes=image_bytes)
+    # 1. Get the AI analysis (severity and advice), from the local triage if the model is slow
+    hedged = await analyzer.analyze_symptom_with_image_hedged(
+        text_description=description, image_bytes=image_bytes,
+        mime_type=stored_photo.model_mime_type if stored_photo else "image/jpeg", user_id=user_id
+    )
+    result = hedged.result
     
     if result and result.get("severity"):
-        # 2. Save the new symptom report to our history database
-        crud.create_symptom_report(db=db, description=description, result=result, photo_path=photo_path_placeholder)
-        
-        # 3. Fetch all symptoms from the last 7 days
-        recent_symptoms = crud.get_recent_symptoms(db=db, days=7)
+        # 2. Load the patient's state first, so a rebuild from history cannot count the new report twice
+        state = await patient_registry.get_async(user_id)
+
+        # 3. Save the new symptom report to our history database
+        report = await group_commit.create_symptom_report_async(db=db, description=description, result=result,
+                                                         photo_path=stored_photo.path if stored_photo else None, user_id=user_id)
         
-        # 4. Trigger the state manager to recalculate the score based on this full history
-        patient_state.recalculate_symptom_score(recent_symptoms)
+        # 4. Fold the report into the patient's running symptom score in constant time
+        state.add_symptom_report(report.severity, report.timestamp)
+        result["report_id"] = report.id
+
+        if hedged.pending is not None:
+            _run_late(_apply_late_symptom_analysis(report.id, user_id, report.severity, report.timestamp, hedged.pending))
         
+    if stored_photo and stored_photo.thumbnail_path:
+        result["photo_thumbnail_url"] = f"/api/media/{stored_photo.digest}/thumbnail"
     return models.SymptomAnalysisResponse(**result)
 
 
-# --- This endpoint for fetching all entries remains the same ---
-@router.get("/journal", response_model=List[models.JournalEntryResponse])
-def read_all_journal_entries(db: Session = Depends(get_db)):
-    return crud.get_all_journal_entries(db=db)
\ No newline at end of file
+# --- Thumbnails of uploaded symptom photos, for the UI ---
+@router.get("/media/{digest}/thumbnail")
+async def read_photo_thumbnail(digest: str):
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        raise HTTPException(status_code=404, detail="Photo not found.")
+    path = media.absolute_path(media.thumbnail_relative_path(digest))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Photo not found.")
+    # Content-addressed, so the file behind a URL never changes.
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+# --- Paginated journal listing for one user ---
+@router.get("/journal", response_model=List[models.JournalEntryListItem], response_model_exclude_unset=True)
+async def read_journal_entries(response: Response, user_id: int = 1, limit: int = Query(50, ge=1, le=200),
+                               cursor: Optional[str] = None, fields: Literal["full", "summary"] = "full",
+                               db: AsyncSession = Depends(get_async_db)):
+    """
+    Returns a page of the user's entries, newest first. When more entries exist the
+    cursor for the next page is sent in the X-Next-Cursor header; pass it back as
+    ?cursor= to continue. fields=summary leaves out the entry text.
+    """
+    try:
+        entries, next_cursor = await crud.list_journal_entries_async(db, user_id=user_id, limit=limit, cursor=cursor,
+                                                                     include_content=(fields == "full"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return entries
+
+
+# --- Analyzer cache statistics, used to size the cache ---
+@router.get("/analysis-cache/stats")
+def read_analysis_cache_stats():
+    return analysis_cache.get_stats()
+
+
+# --- Model scheduler statistics: admissions, sheds, retries and current queue ---
+@router.get("/model-scheduler/stats")
+def read_model_scheduler_stats():
+    return model_scheduler.get_stats()
+
+
+# --- Cohort scoring: progress scores for many patients in one call ---
+METRIC_COLUMNS = ("hrv", "sentiment", "symptoms", "clinical_biomarker")
+
+@router.post("/cohort/progress-scores", response_model=models.CohortScoreResponse)
+async def score_cohort(request: models.CohortScoreRequest):
+    """
+    Scores a whole cohort at once with the vectorized insight engine. Supports
+    what-if sweeps by overriding a metric for every patient.
+    """
+    if request.user_ids is not None:
+        states = [(await patient_registry.get_async(user_id)).get_current_state() for user_id in request.user_ids]
+        columns = {name: [state[name] for state in states] for name in METRIC_COLUMNS}
+    else:
+        columns = {name: getattr(request, name) for name in METRIC_COLUMNS}
+        missing = [name for name, values in columns.items() if values is None and name not in request.what_if]
+        if missing:
+            raise HTTPException(status_code=422, detail=f"Provide user_ids or these metric columns: {', '.join(missing)}")
+        lengths = {len(values) for values in columns.values() if values is not None}
+        if len(lengths) != 1:
+            raise HTTPException(status_code=422, detail="All metric columns must have the same length.")
+
+    row_count = len(request.user_ids) if request.user_ids is not None else lengths.pop()
+    for name, value in request.what_if.items():
+        columns[name] = [value] * row_count
+
+    result = insight_engine.calculate_progress_scores(**columns)
+    return models.CohortScoreResponse(
+        user_ids=request.user_ids,
+        progress_scores=result["progress_score"].tolist(),
+        insight_buckets=result["insight_bucket"].tolist(),
+        insights=insight_engine.INSIGHTS,
+    )
+
+
+# --- Wearable history for dashboard charts, served from the rollup tables ---
+@router.get("/wearables/{metric}", response_model=models.TimeSeriesResponse)
+async def read_wearable_series(metric: str, user_id: int = 1,
+                               start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None,
+                               resolution: str = "auto", db: AsyncSession = Depends(get_async_db)):
+    """
+    Returns count/avg/min/max per bucket for a time range (default: the last 24 hours).
+    With resolution=auto the finest rollup that fits in 1000 points is used.
+    """
+    if metric not in timeseries.METRICS:
+        raise HTTPException(status_code=404, detail=f"Unknown metric '{metric}'.")
+    end = timeseries.to_naive_utc(end) if end else datetime.datetime.utcnow()
+    start = timeseries.to_naive_utc(start) if start else end - datetime.timedelta(days=1)
+    if resolution == "auto":
+        resolution = timeseries.choose_resolution(start, end)
+    elif resolution not in timeseries.RESOLUTIONS:
+        raise HTTPException(status_code=422, detail=f"resolution must be one of: auto, {', '.join(timeseries.RESOLUTIONS)}")
+
+    rows = await crud.get_timeseries_rollups_async(db, user_id, metric, resolution, start, end)
+    return models.TimeSeriesResponse(metric=metric, resolution=resolution, points=[
+        models.RollupPoint(bucket_start=row.bucket_start, count=row.count, avg=row.sum / row.count, min=row.min, max=row.max)
+        for row in rows
+    ])
+
+
+# --- Progress score history, from the rollups plus the live trend statistics ---
+@router.get("/progress-score/history", response_model=models.ScoreHistoryResponse)
+async def read_progress_score_history(user_id: int = 1, metric: str = "progress_score",
+                                      start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None,
+                                      resolution: str = "auto", db: AsyncSession = Depends(get_async_db)):
+    """
+    Returns the progress score (or one of its score_* components) per bucket for a
+    time range, default the last 24 hours. resolution=raw returns the most recent
+    scoring ticks held in memory instead of rollup buckets.
+    """
+    if metric not in SCORE_METRICS:
+        raise HTTPException(status_code=404, detail=f"Unknown metric '{metric}'.")
+    end = timeseries.to_naive_utc(end) if end else datetime.datetime.utcnow()
+    start = timeseries.to_naive_utc(start) if start else end - datetime.timedelta(days=1)
+    tracker = score_history.get_tracker(user_id)
+
+    if resolution == "raw":
+        series = tracker.series(metric) if tracker else []
+        points = [models.RollupPoint(bucket_start=timestamp, count=1, avg=value, min=value, max=value)
+                  for timestamp, value in series if start <= timestamp < end]
+    else:
+        if resolution == "auto":
+            resolution = timeseries.choose_resolution(start, end)
+        elif resolution not in timeseries.RESOLUTIONS:
+            raise HTTPException(status_code=422, detail=f"resolution must be one of: auto, raw, {', '.join(timeseries.RESOLUTIONS)}")
+        rows = await crud.get_timeseries_rollups_async(db, user_id, metric, resolution, start, end)
+        points = [models.RollupPoint(bucket_start=row.bucket_start, count=row.count, avg=row.sum / row.count, min=row.min, max=row.max)
+                  for row in rows]
+
+    trend = tracker.trend() if tracker and metric == "progress_score" else None
+    return models.ScoreHistoryResponse(metric=metric, resolution=resolution, points=points, trend=trend)
+
+
+# --- Daily and weekly summaries for dashboards, from the daily_summaries table ---
+@router.get("/summaries", response_model=models.SummaryResponse)
+async def read_summaries(user_id: int = 1, period: Literal["day", "week"] = "day",
+                         start: Optional[datetime.date] = None, end: Optional[datetime.date] = None,
+                         db: AsyncSession = Depends(get_async_db)):
+    """
+    Journal sentiment and symptom counts by severity per day or ISO week, for the
+    days in [start, end) in UTC. Defaults to the last 30 days, or the last 12 weeks.
+    Periods without any entries are left out.
+    """
+    end = end or datetime.datetime.utcnow().date() + datetime.timedelta(days=1)
+    start = start or end - datetime.timedelta(days=30 if period == "day" else 12 * 7)
+    start = daily_summary.period_start(start, period)
+    if start >= end:
+        raise HTTPException(status_code=422, detail="start must be before end.")
+    rows = await crud.get_daily_summaries_async(db, user_id, start, end)
+    return models.SummaryResponse(user_id=user_id, period=period, points=daily_summary.summarize(rows, period))
+
+
+# --- Streaming bulk export of patient history, for clinician review ---
+@router.get("/export/{dataset}")
+async def export_history(dataset: str, format: Literal["ndjson", "csv"] = "ndjson",
+                         user_id: Optional[List[int]] = Query(None),
+                         start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None):
+    """
+    Streams a history table (journal, symptoms, biomarkers, events or wearables) as NDJSON
+    or CSV, oldest first per patient. Repeat user_id to export several patients;
+    leave it out to export everyone. start/end bound the timestamps as [start, end).
+    """
+    if dataset not in crud.EXPORT_DATASETS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset '{dataset}'. Use one of: {', '.join(crud.EXPORT_DATASETS)}.")
+    start = timeseries.to_naive_utc(start) if start else None
+    end = timeseries.to_naive_utc(end) if end else None
+    if start and end and start >= end:
+        raise HTTPException(status_code=422, detail="start must be before end.")
+    return StreamingResponse(
+        export.stream_export(dataset, format, user_id, start, end),
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{export.filename(dataset, format, user_id)}"'},
+    )
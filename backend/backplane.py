@@ -0,0 +1,386 @@
+# app/backplane.py
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Leave BACKPLANE_URL empty for a single process. With `uvicorn --workers N`, point every
+# worker at the same Redis (e.g. redis://localhost:6379/0) so they act as one service.
+BACKPLANE_URL = os.getenv("BACKPLANE_URL", "")
+# The scoring loop runs only on the worker holding this lease. A crashed leader is
+# replaced within one lease period.
+LEADER_LEASE_MS = int(os.getenv("LEADER_LEASE_MS", "5000"))
+# How often each worker tells the leader which patients its dashboards follow
+BACKPLANE_ANNOUNCE_SECONDS = float(os.getenv("BACKPLANE_ANNOUNCE_SECONDS", "5"))
+
+LEADER_KEY = "care:leader"
+EVENTS_CHANNEL = "care:events"
+
+
+# --- Interfaces ---
+
+class StateStore(ABC):
+    """Shared key/value state with expiry, for coordination between workers."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl_ms: Optional[int] = None): ...
+
+    @abstractmethod
+    async def set_if_absent(self, key: str, value: str, ttl_ms: int) -> bool:
+        """Sets the key only if it does not exist. Returns True if it was set."""
+
+    @abstractmethod
+    async def renew_if_owner(self, key: str, value: str, ttl_ms: int) -> bool:
+        """Extends the key's expiry only if it still holds `value`. Returns True if renewed."""
+
+    @abstractmethod
+    async def delete_if_owner(self, key: str, value: str) -> bool: ...
+
+    async def close(self):
+        pass
+
+
+class PubSub(ABC):
+    """Fire-and-forget messaging between workers. Handlers receive the message text."""
+
+    @abstractmethod
+    async def publish(self, channel: str, message: str): ...
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: Callable[[str], None]): ...
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str): ...
+
+    async def close(self):
+        pass
+
+
+# --- In-process implementation (one worker) ---
+
+class InProcessStateStore(StateStore):
+    def __init__(self):
+        self._data: Dict[str, Tuple[str, Optional[float]]] = {}
+
+    def _live(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    @staticmethod
+    def _expiry(ttl_ms: Optional[int]) -> Optional[float]:
+        return time.monotonic() + ttl_ms / 1000 if ttl_ms else None
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+
+    async def set(self, key: str, value: str, ttl_ms: Optional[int] = None):
+        self._data[key] = (value, self._expiry(ttl_ms))
+
+    async def set_if_absent(self, key: str, value: str, ttl_ms: int) -> bool:
+        if self._live(key) is not None:
+            return False
+        self._data[key] = (value, self._expiry(ttl_ms))
+        return True
+
+    async def renew_if_owner(self, key: str, value: str, ttl_ms: int) -> bool:
+        if self._live(key) != value:
+            return False
+        self._data[key] = (value, self._expiry(ttl_ms))
+        return True
+
+    async def delete_if_owner(self, key: str, value: str) -> bool:
+        if self._live(key) != value:
+            return False
+        del self._data[key]
+        return True
+
+
+class InProcessPubSub(PubSub):
+    """Delivers each message synchronously to the handler in this process."""
+    def __init__(self):
+        self._handlers: Dict[str, Callable[[str], None]] = {}
+
+    async def publish(self, channel: str, message: str):
+        handler = self._handlers.get(channel)
+        if handler is not None:
+            handler(message)
+
+    async def subscribe(self, channel: str, handler: Callable[[str], None]):
+        self._handlers[channel] = handler
+
+    async def unsubscribe(self, channel: str):
+        self._handlers.pop(channel, None)
+
+
+# --- Redis implementation (any number of workers) ---
+
+class RedisStateStore(StateStore):
+    # Compare-and-act has to happen inside Redis, or a worker whose lease just expired
+    # could extend or delete the new leader's key.
+    _RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, client):
+        self._client = client
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: str, ttl_ms: Optional[int] = None):
+        await self._client.set(key, value, px=ttl_ms)
+
+    async def set_if_absent(self, key: str, value: str, ttl_ms: int) -> bool:
+        return bool(await self._client.set(key, value, nx=True, px=ttl_ms))
+
+    async def renew_if_owner(self, key: str, value: str, ttl_ms: int) -> bool:
+        # The scripts are tiny and run once per lease period, so EVAL is simpler than
+        # EVALSHA and survives a Redis restart that empties the script cache.
+        return bool(await self._client.eval(self._RENEW, 1, key, value, ttl_ms))
+
+    async def delete_if_owner(self, key: str, value: str) -> bool:
+        return bool(await self._client.eval(self._RELEASE, 1, key, value))
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class RedisPubSub(PubSub):
+    """One subscriber connection per worker; a reader task hands messages to their channel's handler."""
+    def __init__(self, client):
+        self._client = client
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._handlers: Dict[str, Callable[[str], None]] = {}
+        self._reader: Optional[asyncio.Task] = None
+
+    async def publish(self, channel: str, message: str):
+        await self._client.publish(channel, message)
+
+    async def subscribe(self, channel: str, handler: Callable[[str], None]):
+        self._handlers[channel] = handler
+        await self._pubsub.subscribe(channel)
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read())
+
+    async def unsubscribe(self, channel: str):
+        self._handlers.pop(channel, None)
+        await self._pubsub.unsubscribe(channel)
+
+    async def _read(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Backplane subscriber connection failed; reconnecting")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None:
+                continue
+            handler = self._handlers.get(message["channel"])
+            if handler is not None:
+                try:
+                    handler(message["data"])
+                except Exception:
+                    logger.exception("Backplane handler for %s failed", message["channel"])
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+        await self._pubsub.aclose()
+
+
+# --- The backplane used by the app ---
+
+class Backplane:
+    """
+    Connects the workers of one deployment.
+
+    - Dashboard messages are published to the patient's topic and delivered by
+      whichever workers have a dashboard subscribed to it.
+    - State changes made on any worker are published as events, so the leader (and
+      any worker that has the patient loaded) applies them too.
+    - One worker holds the leader lease and runs the scoring loop; the others tell it
+      which patients their dashboards follow.
+
+    With the in-process store and pub/sub this is a single always-leader worker and
+    messages are delivered with a plain function call.
+    """
+    def __init__(self, store: StateStore, pubsub: PubSub, worker_id: Optional[str] = None,
+                 lease_ms: int = LEADER_LEASE_MS, announce_seconds: float = BACKPLANE_ANNOUNCE_SECONDS):
+        self.store = store
+        self.pubsub = pubsub
+        self.worker_id = worker_id or uuid.uuid4().hex[:12]
+        self.lease_ms = lease_ms
+        self.announce_seconds = announce_seconds
+        self.is_leader = False
+        self.multi_worker = not isinstance(pubsub, InProcessPubSub)
+        # Set by the app before start()
+        self.on_event: Optional[Callable[[dict], Awaitable[None]]] = None
+        self.on_leadership: Optional[Callable[[bool], None]] = None
+        self.local_user_ids: Callable[[], Iterable[int]] = list
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._outbox: Optional[asyncio.Queue] = None
+        self._inbox: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # worker_id -> (patients its dashboards follow, when that report expires)
+        self._remote_subscriptions: Dict[str, Tuple[Set[int], float]] = {}
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._outbox = asyncio.Queue()
+        self._inbox = asyncio.Queue()
+        if self.multi_worker:
+            await self.pubsub.subscribe(EVENTS_CHANNEL, self._receive_event)
+            self._tasks += [asyncio.create_task(self._send_events()), asyncio.create_task(self._handle_events()),
+                            asyncio.create_task(self._announce_loop())]
+        self._tasks.append(asyncio.create_task(self._leader_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.is_leader:
+            # Hand over right away instead of making the others wait out the lease
+            try:
+                await self.store.delete_if_owner(LEADER_KEY, self.worker_id)
+            except Exception as e:
+                logger.warning("Could not release the leader lease: %s", e)
+            self._set_leader(False)
+        await self.pubsub.close()
+        await self.store.close()
+
+    # Dashboard topics
+    async def publish(self, topic: str, payload: str):
+        await self.pubsub.publish(topic, payload)
+
+    def watch(self, topic: str, handler: Callable[[str], None]):
+        """Starts delivering `topic` to this worker. Called when its first local dashboard subscribes."""
+        self._schedule(self.pubsub.subscribe(topic, handler))
+        if self.multi_worker:
+            # Let the leader know right away rather than at the next announcement
+            self.publish_event({"type": "subscriptions", "user_ids": list(self.local_user_ids())})
+
+    def unwatch(self, topic: str):
+        self._schedule(self.pubsub.unsubscribe(topic))
+
+    def subscribed_user_ids(self, local: Iterable[int]) -> List[int]:
+        """Patients with a dashboard on any worker: this worker's plus what the others last announced."""
+        user_ids = set(local)
+        now = time.monotonic()
+        for worker_id, (remote, expires_at) in list(self._remote_subscriptions.items()):
+            if expires_at < now:
+                del self._remote_subscriptions[worker_id]
+            else:
+                user_ids |= remote
+        return list(user_ids)
+
+    # State events
+    def publish_event(self, event: dict):
+        """Sends an event to the other workers. Non-blocking and safe to call from any thread."""
+        if not self.multi_worker or self._loop is None:
+            return
+        message = {**event, "origin": self.worker_id}
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._outbox.put_nowait(message)
+        else:
+            self._loop.call_soon_threadsafe(self._outbox.put_nowait, message)
+
+    def _schedule(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        task.add_done_callback(_log_failure)
+
+    def _receive_event(self, message: str):
+        event = json.loads(message)
+        if event.get("origin") != self.worker_id:
+            self._inbox.put_nowait(event)
+
+    async def _send_events(self):
+        while True:
+            message = await self._outbox.get()
+            try:
+                await self.pubsub.publish(EVENTS_CHANNEL, json.dumps(message, separators=(",", ":")))
+            except Exception:
+                logger.exception("Could not publish backplane event")
+
+    async def _handle_events(self):
+        # One at a time, in arrival order, so each patient's events apply in the order they were made
+        while True:
+            event = await self._inbox.get()
+            try:
+                if event.get("type") == "subscriptions":
+                    self._remote_subscriptions[event["origin"]] = (
+                        set(event["user_ids"]), time.monotonic() + 3 * self.announce_seconds)
+                elif self.on_event is not None:
+                    await self.on_event(event)
+            except Exception:
+                logger.exception("Could not apply backplane event %s", event.get("type"))
+
+    async def _announce_loop(self):
+        while True:
+            self.publish_event({"type": "subscriptions", "user_ids": list(self.local_user_ids())})
+            await asyncio.sleep(self.announce_seconds)
+
+    # Leader election
+    async def _leader_loop(self):
+        while True:
+            try:
+                if self.is_leader:
+                    held = await self.store.renew_if_owner(LEADER_KEY, self.worker_id, self.lease_ms)
+                else:
+                    held = await self.store.set_if_absent(LEADER_KEY, self.worker_id, self.lease_ms)
+            except Exception:
+                # Without the store we cannot prove we still hold the lease, so step down
+                logger.exception("Leader lease check failed")
+                held = False
+            self._set_leader(held)
+            await asyncio.sleep(self.lease_ms / 3000)
+
+    def _set_leader(self, held: bool):
+        if held == self.is_leader:
+            return
+        self.is_leader = held
+        logger.info("Worker %s %s the scoring leader.", self.worker_id, "is now" if held else "is no longer")
+        if self.on_leadership is not None:
+            self.on_leadership(held)
+
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Backplane subscription change failed: %s", task.exception())
+
+
+def create_backplane(url: str = BACKPLANE_URL) -> Backplane:
+    if not url:
+        return Backplane(InProcessStateStore(), InProcessPubSub())
+    # Only needed for multi-worker deployments, so it is imported on demand.
+    import redis.asyncio as redis
+
+    return Backplane(RedisStateStore(redis.from_url(url, decode_responses=True)),
+                     RedisPubSub(redis.from_url(url, decode_responses=True)))
+
+
+# Create a single global backplane to be shared across the application
+backplane = create_backplane()
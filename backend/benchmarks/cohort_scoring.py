@@ -0,0 +1,67 @@
+# backend/benchmarks/cohort_scoring.py
+"""
+Throughput of the vectorized cohort scorer against the per-patient function.
+
+    python -m backend.benchmarks.cohort_scoring --rows 1000000
+
+Prints one JSON object so results can be compared between runs.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from backend.insight_engine import calculate_progress_score, calculate_progress_scores, INSIGHTS
+
+
+def make_cohort(rows: int, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    return {
+        "hrv": rng.uniform(10, 100, rows),
+        "sentiment": rng.uniform(-1, 1, rows),
+        "symptoms": rng.uniform(0, 10, rows),
+        "clinical_biomarker": rng.uniform(0, 15, rows),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--scalar-rows", type=int, default=100_000,
+                        help="rows scored with the scalar function (also checked for identical results)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cohort = make_cohort(args.rows)
+
+    vector_times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        result = calculate_progress_scores(**cohort)
+        vector_times.append(time.perf_counter() - start)
+    vector_best = min(vector_times)
+
+    scalar_rows = min(args.scalar_rows, args.rows)
+    mismatches = 0
+    start = time.perf_counter()
+    for i in range(scalar_rows):
+        scalar = calculate_progress_score({name: float(column[i]) for name, column in cohort.items()})
+        if scalar["progress_score"] != result["progress_score"][i] or scalar["insight"] != INSIGHTS[result["insight_bucket"][i]]:
+            mismatches += 1
+    scalar_elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        "benchmark": "cohort_scoring",
+        "rows": args.rows,
+        "vectorized_seconds": vector_best,
+        "vectorized_rows_per_second": args.rows / vector_best,
+        "scalar_rows": scalar_rows,
+        "scalar_rows_per_second": scalar_rows / scalar_elapsed,
+        "speedup": (args.rows / vector_best) / (scalar_rows / scalar_elapsed),
+        "mismatches": mismatches,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# backend/benchmarks/fake_genai.py
+"""
+A local stand-in for the Gemini models, so the service can be load-tested without
+network access or API quota. Latency, error rate and blocked-response rate are
+configurable, as is a provider quota that answers 429 when exceeded; answers are
+valid JSON in the shape the real prompts ask for. Streamed calls (stream=True)
+deliver the answer word by word, the first words after a fraction of the latency.
+"""
+import json
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Optional
+
+
+class FakeResponse:
+    """Mimics the parts of a genai response the analyzer reads."""
+    def __init__(self, text: Optional[str]):
+        # A blocked response has no parts, exactly like the real client
+        self.parts = [text] if text is not None else []
+        self._text = text
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            raise ValueError("Response was blocked.")
+        return self._text
+
+
+class FakeStreamResponse:
+    """Mimics an async streamed genai response: iterating it yields chunks with .parts and .text."""
+    def __init__(self, chunks: list, delays: list, error: Optional[Exception] = None):
+        self._chunks = chunks
+        self._delays = delays
+        self._error = error
+
+    async def __aiter__(self):
+        for chunk, delay in zip(self._chunks, self._delays):
+            await asyncio.sleep(delay)
+            yield chunk
+        if self._error is not None:
+            raise self._error
+
+
+class FakeModelError(Exception):
+    pass
+
+
+class FakeRateLimited(Exception):
+    """Like google.api_core.exceptions.ResourceExhausted: HTTP 429."""
+    code = 429
+
+
+class FakeGenerativeModel:
+    """
+    Drop-in for genai.GenerativeModel. Each call sleeps for a latency drawn around
+    `latency_ms` (± `jitter_ms`), then fails with probability `error_rate`, returns
+    a blocked response with probability `blocked_rate`, and otherwise answers.
+    With `quota_rps`, calls beyond that many in any one second fail with a 429.
+    """
+    def __init__(self, kind: str, latency_ms: float = 300, jitter_ms: float = 100,
+                 error_rate: float = 0.0, blocked_rate: float = 0.0, seed: Optional[int] = None,
+                 quota_rps: float = 0.0):
+        self.kind = kind
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.blocked_rate = blocked_rate
+        self.quota_rps = quota_rps
+        self._rng = random.Random(seed)
+        self._recent_calls = deque()
+        self.stats = {"calls": 0, "errors": 0, "blocked": 0, "rate_limited": 0}
+
+    # Share of the latency before a streamed answer's first words
+    FIRST_CHUNK_SHARE = 0.15
+
+    def _check_quota(self):
+        if self.quota_rps <= 0:
+            return
+        now = time.monotonic()
+        while self._recent_calls and self._recent_calls[0] <= now - 1.0:
+            self._recent_calls.popleft()
+        if len(self._recent_calls) >= self.quota_rps:
+            self.stats["rate_limited"] += 1
+            raise FakeRateLimited("Simulated quota exceeded.")
+        self._recent_calls.append(now)
+
+    def _latency_seconds(self) -> float:
+        return max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+    def _roll(self) -> Optional[str]:
+        """Counts a call and decides its fate: "error", "blocked", or None to answer."""
+        self.stats["calls"] += 1
+        roll = self._rng.random()
+        if roll < self.error_rate:
+            self.stats["errors"] += 1
+            return "error"
+        if roll < self.error_rate + self.blocked_rate:
+            self.stats["blocked"] += 1
+            return "blocked"
+        return None
+
+    def _payload(self) -> dict:
+        if self.kind == "journal":
+            return {
+                "analysis": "The writer sounds steady.",
+                "sentiment_score": round(self._rng.uniform(-1, 1), 2),
+                "encouragement": "Thank you for writing today. Keep going.",
+            }
+        return {
+            "severity": self._rng.choice(["Mild", "Moderate", "Severe"]),
+            "advice": "Keep an eye on it and contact your care team if it gets worse.",
+        }
+
+    def _answer(self, contents) -> FakeResponse:
+        fate = self._roll()
+        if fate == "error":
+            raise FakeModelError("Simulated model failure.")
+        if fate == "blocked":
+            return FakeResponse(None)
+        return FakeResponse("```json\n" + json.dumps(self._payload()) + "\n```")
+
+    def _stream(self, contents) -> FakeStreamResponse:
+        from backend.analyzer import JOURNAL_STREAM_DELIMITER
+
+        latency = self._latency_seconds()
+        fate = self._roll()
+        if fate == "blocked":
+            return FakeStreamResponse([FakeResponse(None)], [latency])
+        payload = self._payload()
+        if self.kind == "journal":
+            # The streaming prompt's layout: encouragement, delimiter line, then the rest as JSON
+            encouragement = payload.pop("encouragement")
+            text = f"{encouragement}\n{JOURNAL_STREAM_DELIMITER}\n{json.dumps(payload)}"
+        else:
+            text = json.dumps(payload)
+        words = text.split(" ")
+        chunks = [FakeResponse(word + " ") for word in words[:-1]] + [FakeResponse(words[-1])]
+        first = latency * self.FIRST_CHUNK_SHARE
+        rest = (latency - first) / max(1, len(chunks) - 1)
+        delays = [first] + [rest] * (len(chunks) - 1)
+        if fate == "error":
+            # Fails part-way through, after some text was already sent
+            cut = len(chunks) // 2
+            return FakeStreamResponse(chunks[:cut], delays[:cut], FakeModelError("Simulated model failure."))
+        return FakeStreamResponse(chunks, delays)
+
+    def generate_content(self, contents, **kwargs) -> FakeResponse:
+        self._check_quota()
+        time.sleep(self._latency_seconds())
+        return self._answer(contents)
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        self._check_quota()
+        if stream:
+            return self._stream(contents)
+        await asyncio.sleep(self._latency_seconds())
+        return self._answer(contents)
+
+
+def install(latency_ms: float = 300, jitter_ms: float = 100, error_rate: float = 0.0,
+            blocked_rate: float = 0.0, seed: Optional[int] = None, quota_rps: float = 0.0) -> dict:
+    """Replaces the analyzer's models with fakes. Returns them by kind so their stats can be read."""
+    from backend import analyzer
+
+    models = {
+        kind: FakeGenerativeModel(kind, latency_ms, jitter_ms, error_rate, blocked_rate,
+                                  seed=None if seed is None else seed + i, quota_rps=quota_rps)
+        for i, kind in enumerate(("journal", "symptom"))
+    }
+    analyzer.install_models(journal=models["journal"], symptom=models["symptom"])
+    return models
@@ -0,0 +1,122 @@
+# backend/benchmarks/group_commit.py
+"""
+Write throughput and latency of journal/symptom inserts: one commit per row (the
+default path) against the group-commit writer.
+
+    python -m backend.benchmarks.group_commit --rows 5000 --concurrency 64
+
+Each of `concurrency` tasks inserts rows back to back, like that many requests
+arriving at once during a check-in peak. Runs against a throwaway SQLite database
+unless DATABASE_URL is set. Prints one JSON object so results can be compared
+between runs.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='care-companion-gc-'), 'bench.db')}"
+
+from backend import crud, database, models
+from backend.group_commit import GroupCommitWriter
+
+ANALYSIS = {"analysis": "The entry sounds fairly neutral.", "sentiment_score": 0.1,
+            "encouragement": "Thank you for sharing.", "analysis_source": "local"}
+SYMPTOM = {"severity": "Mild", "analysis_source": "local"}
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def per_row_insert(i: int):
+    async with database.AsyncWriteSessionLocal() as db:
+        if i % 2:
+            return await crud.create_symptom_report_async(db, f"slight headache {i}", SYMPTOM, user_id=i % 100)
+        entry = models.JournalEntryCreate(user_id=i % 100, content=f"Benchmark entry {i}")
+        return await crud.create_journal_entry_async(db, entry, ANALYSIS)
+
+
+def group_insert(writer: GroupCommitWriter):
+    async def insert(i: int):
+        if i % 2:
+            return await writer.add(crud.build_symptom_report(f"slight headache {i}", SYMPTOM, user_id=i % 100))
+        entry = models.JournalEntryCreate(user_id=i % 100, content=f"Benchmark entry {i}")
+        return await writer.add(crud.build_journal_entry(entry, ANALYSIS))
+    return insert
+
+
+async def run(insert, rows: int, concurrency: int) -> dict:
+    counter = iter(range(rows))
+    latencies = []
+    ids = []
+
+    async def client():
+        for i in counter:
+            started = time.perf_counter()
+            row = await insert(i)
+            latencies.append(time.perf_counter() - started)
+            ids.append(row.id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "rows_per_second": rows / elapsed,
+        "latency_ms": {
+            "p50": statistics.median(latencies) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": max(latencies) * 1000,
+        },
+        "all_ids_returned": None not in ids and len(ids) == rows,
+    }
+
+
+async def main_async(args) -> dict:
+    await asyncio.to_thread(database.create_db_and_tables)
+    # Warm the connection pool and statement caches
+    await run(per_row_insert, 50, 5)
+
+    per_row = await run(per_row_insert, args.rows, args.concurrency)
+
+    writer = GroupCommitWriter(window=args.window_ms / 1000, max_rows=args.max_rows)
+    writer.start()
+    group = await run(group_insert(writer), args.rows, args.concurrency)
+    await writer.stop()
+
+    return {
+        "benchmark": "group_commit",
+        "database": database.engine.url.render_as_string(hide_password=True),
+        "rows": args.rows,
+        "concurrency": args.concurrency,
+        "window_ms": args.window_ms,
+        "max_rows": args.max_rows,
+        "per_row_commit": per_row,
+        "group_commit": group,
+        "speedup": group["rows_per_second"] / per_row["rows_per_second"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--window-ms", type=float, default=2.0)
+    parser.add_argument("--max-rows", type=int, default=64)
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    print(json.dumps(report, indent=2))
+    ok = report["per_row_commit"]["all_ids_returned"] and report["group_commit"]["all_ids_returned"]
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# backend/benchmarks/import_budget.py
+"""
+Import-time budget check. Imports the app in fresh interpreters, reports how long
+it took and which modules cost the most, and exits nonzero if the median import
+goes over budget or if a module that should only load on first use was imported.
+
+    python -m backend.benchmarks.import_budget --budget-ms 1500 --runs 5
+
+Every uvicorn worker, test run and CLI tool pays this on start, so it is worth
+guarding. The wall-clock budget depends on the machine; the list of modules that
+must stay lazy does not, so that part is the reliable regression check.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+from typing import Dict, List
+
+# Heavy dependencies the app loads on first use, never at import
+LAZY_MODULES = ("google.generativeai", "grpc", "numpy", "PIL", "redis")
+
+# Runs in the child interpreter: time the import, then list which lazy modules got pulled in
+CHILD_SCRIPT = """
+import sys, json, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"import_ms": elapsed * 1000, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """Maps module name -> cumulative import time in microseconds from `-X importtime` output."""
+    cumulative: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue # the header line
+        name = parts[2].strip()
+        cumulative[name] = max(cumulative.get(name, 0), int(parts[1]))
+    return cumulative
+
+
+def measure_once(module: str, env: dict) -> dict:
+    code = CHILD_SCRIPT.format(module=module, lazy=LAZY_MODULES)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["cumulative_us"] = parse_importtime(proc.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="backend.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1500")))
+    parser.add_argument("--top", type=int, default=15, help="how many of the slowest modules to list")
+    parser.add_argument("--output", default=None, help="also write the report to this file")
+    args = parser.parse_args()
+
+    # Import against a throwaway database so the check never touches real data
+    workdir = tempfile.mkdtemp(prefix="care-companion-import-")
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'import.db')}"
+    env.setdefault("MEDIA_ROOT", os.path.join(workdir, "media"))
+    env["LOG_LEVEL"] = "WARNING"
+
+    # The first run warms the OS file cache and writes bytecode; it is not counted
+    measure_once(args.module, env)
+    runs: List[dict] = [measure_once(args.module, env) for _ in range(args.runs)]
+
+    timings = [run["import_ms"] for run in runs]
+    median_ms = statistics.median(timings)
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+    # Slowest modules by their median cumulative time, ignoring the target itself
+    names = set().union(*(run["cumulative_us"] for run in runs)) - {args.module}
+    slowest = sorted(
+        ((name, statistics.median(run["cumulative_us"].get(name, 0) for run in runs) / 1000) for name in names),
+        key=lambda item: item[1], reverse=True,
+    )[:args.top]
+
+    report = {
+        "benchmark": "import_budget",
+        "module": args.module,
+        "runs": args.runs,
+        "import_ms": {"median": median_ms, "min": min(timings), "max": max(timings)},
+        "budget_ms": args.budget_ms,
+        "within_budget": median_ms <= args.budget_ms,
+        "lazy_modules_loaded": loaded,
+        "slowest_modules_ms": dict(slowest),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+    if loaded:
+        print(f"FAIL: importing {args.module} loaded {', '.join(loaded)}; these must be imported on first use.",
+              file=sys.stderr)
+    if not report["within_budget"]:
+        print(f"FAIL: median import took {median_ms:.0f} ms, over the {args.budget_ms:.0f} ms budget.",
+              file=sys.stderr)
+    sys.exit(1 if loaded or not report["within_budget"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# backend/benchmarks/loadtest.py
+"""
+End-to-end load test. Starts the app in-process under uvicorn with the fake Gemini
+models, drives the journal, symptom and health-data endpoints at a fixed request
+rate while WebSocket dashboards listen, and prints one JSON report.
+
+    python -m backend.benchmarks.loadtest --rps 200 --duration 30 --ws-clients 50
+
+Requests are scheduled open-loop (the next one starts on time even if earlier ones
+are still running), so a slow server shows up as latency instead of a lower rate.
+Broadcast lag is measured by sending every HRV reading with a unique value and
+timing how long it takes to reach a dashboard subscribed to that patient.
+The load generator shares the process with the server, so numbers are best read
+relative to other runs on the same machine. The app logs to stderr, so stdout
+carries only the report.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+from typing import Dict, List, Tuple
+
+ENDPOINTS = ("journal", "symptom", "health")
+
+
+def percentiles(samples: List[float]) -> dict:
+    """Nearest-rank p50/p95/p99 plus mean and max, in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": rank(50),
+        "p95_ms": rank(95),
+        "p99_ms": rank(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def memory_usage() -> dict:
+    """Current and peak resident set size of this process, in MB."""
+    usage = {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    usage["rss_mb"] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return usage
+
+
+class LoadTest:
+    def __init__(self, args, base_url: str):
+        self.args = args
+        self.base_url = base_url
+        self.rng = random.Random(args.seed)
+        self.latencies: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.statuses: Dict[str, Dict[str, int]] = {name: {} for name in ENDPOINTS}
+        # (user_id, hrv) -> when it was sent, for matching against dashboard packets
+        self.hrv_sent_at: Dict[Tuple[int, int], float] = {}
+        self.broadcast_lags: List[float] = []
+        self.ws_messages = 0
+        self.ws_errors = 0
+        self._next_hrv: Dict[int, int] = {}
+        self._counter = 0
+
+    def _pick_endpoint(self) -> str:
+        weights = (self.args.journal_weight, self.args.symptom_weight, self.args.health_weight)
+        return self.rng.choices(ENDPOINTS, weights=weights)[0]
+
+    async def _request(self, client, endpoint: str):
+        user_id = self.rng.randint(1, self.args.patients)
+        self._counter += 1
+        started = time.perf_counter()
+        try:
+            if endpoint == "journal":
+                # Unique text, so the analysis cache does not hide the model's latency
+                content = f"Load test entry {self._counter}: a fairly ordinary day."
+                response = await client.post("/api/journal", params={"background": self.args.journal_background},
+                                             json={"content": content, "user_id": user_id})
+            elif endpoint == "symptom":
+                response = await client.post("/api/symptom-analysis",
+                                             data={"description": f"Mild headache, report {self._counter}", "user_id": str(user_id)})
+            else:
+                # Strictly increasing per patient, so each value identifies one request
+                hrv = self._next_hrv.get(user_id, 1000) + 1
+                self._next_hrv[user_id] = hrv
+                self.hrv_sent_at[(user_id, hrv)] = time.perf_counter()
+                response = await client.post("/api/health-connect-data", json={"hrv": hrv, "user_id": user_id})
+            status = str(response.status_code)
+        except Exception as e:
+            status = type(e).__name__
+        self.latencies[endpoint].append(time.perf_counter() - started)
+        self.statuses[endpoint][status] = self.statuses[endpoint].get(status, 0) + 1
+
+    async def _dashboard(self, user_id: int, stop: asyncio.Event):
+        import websockets
+
+        url = self.base_url.replace("http://", "ws://") + f"/api/ws/health-data?user_id={user_id}"
+        try:
+            async with websockets.connect(url, max_size=None) as ws:
+                while not stop.is_set():
+                    try:
+                        message = await asyncio.wait_for(ws.recv(), timeout=0.5)
+                    except asyncio.TimeoutError:
+                        continue
+                    received = time.perf_counter()
+                    self.ws_messages += 1
+                    packet = json.loads(message)
+                    sent = self.hrv_sent_at.get((user_id, packet.get("hrv")))
+                    if sent is not None:
+                        self.broadcast_lags.append(received - sent)
+        except Exception:
+            self.ws_errors += 1
+
+    async def run(self) -> dict:
+        import httpx
+
+        stop = asyncio.Event()
+        # Dashboards are spread over the patients the requests target
+        dashboards = [asyncio.create_task(self._dashboard(i % self.args.patients + 1, stop))
+                      for i in range(self.args.ws_clients)]
+        await asyncio.sleep(0.5)
+
+        limits = httpx.Limits(max_connections=self.args.connections, max_keepalive_connections=self.args.connections)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=self.args.request_timeout) as client:
+            total = int(self.args.rps * self.args.duration)
+            interval = 1 / self.args.rps
+            requests = []
+            late = 0
+            started = time.perf_counter()
+            for i in range(total):
+                delay = started + i * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif delay < -interval:
+                    late += 1
+                requests.append(asyncio.create_task(self._request(client, self._pick_endpoint())))
+            await asyncio.gather(*requests)
+            elapsed = time.perf_counter() - started
+
+        # Give the last broadcasts time to arrive
+        await asyncio.sleep(self.args.drain_seconds)
+        stop.set()
+        await asyncio.gather(*dashboards)
+
+        completed = sum(len(samples) for samples in self.latencies.values())
+        return {
+            "requests": completed,
+            "elapsed_seconds": elapsed,
+            "throughput_rps": completed / elapsed if elapsed else 0.0,
+            "late_starts": late,
+            "endpoints": {
+                name: {**percentiles(self.latencies[name]), "status": self.statuses[name]} for name in ENDPOINTS
+            },
+            "websocket": {
+                "clients": self.args.ws_clients,
+                "messages": self.ws_messages,
+                "errors": self.ws_errors,
+                "broadcast_lag": percentiles(self.broadcast_lags),
+            },
+        }
+
+
+async def serve_and_run(args) -> dict:
+    import uvicorn
+    from backend.benchmarks import fake_genai
+
+    fakes = fake_genai.install(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                               blocked_rate=args.blocked_rate, seed=args.seed, quota_rps=args.quota_rps)
+    from backend.main import app
+    from backend.analysis_cache import analysis_cache
+    from backend.model_scheduler import model_scheduler
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning", ws_max_queue=1024)
+    server = uvicorn.Server(config)
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server_task.done():
+            server_task.result()
+        await asyncio.sleep(0.05)
+
+    memory_before = memory_usage()
+    try:
+        report = await LoadTest(args, f"http://127.0.0.1:{args.port}").run()
+    finally:
+        server.should_exit = True
+        await server_task
+
+    report.update({
+        "benchmark": "loadtest",
+        "config": {key: value for key, value in vars(args).items() if key != "database"},
+        "fake_model": {kind: model.stats for kind, model in fakes.items()},
+        "analysis_cache": analysis_cache.get_stats(),
+        "model_scheduler": model_scheduler.get_stats(),
+        "memory": {"before": memory_before, "after": memory_usage()},
+    })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=50)
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--ws-clients", type=int, default=20)
+    parser.add_argument("--patients", type=int, default=20)
+    parser.add_argument("--journal-weight", type=float, default=1)
+    parser.add_argument("--symptom-weight", type=float, default=1)
+    parser.add_argument("--health-weight", type=float, default=8)
+    parser.add_argument("--journal-background", action="store_true", help="submit journal entries with ?background=true")
+    parser.add_argument("--latency-ms", type=float, default=300, help="fake model latency")
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--blocked-rate", type=float, default=0.0)
+    parser.add_argument("--quota-rps", type=float, default=0.0, help="fake provider quota per model (0: none)")
+    parser.add_argument("--connections", type=int, default=200, help="HTTP connection pool size")
+    parser.add_argument("--request-timeout", type=float, default=30)
+    parser.add_argument("--drain-seconds", type=float, default=1.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", default=None, help="database URL (default: a fresh SQLite file)")
+    parser.add_argument("--output", default=None, help="also write the report to this file")
+    args = parser.parse_args()
+
+    # The app reads its configuration at import time, so this has to happen first.
+    workdir = tempfile.mkdtemp(prefix="care-companion-loadtest-")
+    os.environ["DATABASE_URL"] = args.database or f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    os.environ.setdefault("MEDIA_ROOT", os.path.join(workdir, "media"))
+
+    report = asyncio.run(serve_and_run(args))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    failed = sum(count for endpoint in report["endpoints"].values()
+                 for status, count in endpoint["status"].items() if not status.startswith("2"))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,120 @@
+from sqlalchemy import and_, case, delete, func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from . import models, database
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, database, timeseries, daily_summary
+from .metrics import timed_query # Records each query's duration for /metrics
 import datetime # <-- Import the datetime library for date calculations
 
-# This import is not strictly needed anymore but is harmless
-import json 
+import json # Used to (de)serialize cached analyzer results
+import base64 # Used to build opaque pagination cursors
 
 # ===================================================================
 # --- Journal-Related Functions (No Changes Here) ---
 # ===================================================================
 
+def build_journal_entry(entry: models.JournalEntryCreate, analysis_result: dict) -> database.JournalEntry:
+    """The (unsaved) row for a journal entry and its AI analysis."""
+    return database.JournalEntry(
+        user_id=entry.user_id,
+        timestamp=datetime.datetime.utcnow(),
+        content=entry.content,
+        ai_analysis=analysis_result.get("analysis"),
+        ai_encouragement=analysis_result.get("encouragement"),
+        sentiment_score=analysis_result.get("sentiment_score"),
+        analysis_source=analysis_result.get("analysis_source")
+    )
+
+@timed_query
 def create_journal_entry(db: Session, entry: models.JournalEntryCreate, analysis_result: dict):
     """
     Creates a new journal entry and saves all parts of the AI analysis 
     (summary, score, and encouragement) to the database.
     """
-    db_entry = database.JournalEntry(
-        content=entry.content,
-        ai_analysis=analysis_result.get("analysis"),
-        ai_encouragement=analysis_result.get("encouragement"),
-        sentiment_score=analysis_result.get("sentiment_score")
-    )
+    db_entry = build_journal_entry(entry, analysis_result)
     db.add(db_entry)
+    _merge_daily_summaries(db, daily_summary.aggregate([db_entry]))
     db.commit()
     db.refresh(db_entry)
     return db_entry
 
+@timed_query
+def update_journal_analyses(db: Session, results: list, only_pending: bool = False) -> list:
+    """
+    Fills in the AI fields of journal entries that were stored before their analysis
+    finished. `results` is a list of (entry_id, analysis_result) pairs, written in
+    a single transaction. With `only_pending`, entries that already have an analysis
+    are left alone. Returns the ids that were updated.
+    """
+    updated = []
+    for entry_id, analysis_result in results:
+        query = db.query(database.JournalEntry).filter(database.JournalEntry.id == entry_id)
+        if only_pending:
+            query = query.filter(database.JournalEntry.ai_analysis.is_(None))
+        if query.update({
+            database.JournalEntry.ai_analysis: analysis_result.get("analysis"),
+            database.JournalEntry.ai_encouragement: analysis_result.get("encouragement"),
+            database.JournalEntry.sentiment_score: analysis_result.get("sentiment_score"),
+            database.JournalEntry.analysis_source: analysis_result.get("analysis_source"),
+        }, synchronize_session=False):
+            updated.append(entry_id)
+    if updated:
+        _refresh_daily_summaries(db, database.JournalEntry, updated)
+    db.commit()
+    return updated
+
+@timed_query
+def get_pending_journal_entries(db: Session, before: datetime.datetime, after_id: int = 0, limit: int = 100) -> list:
+    """
+    (id, user_id, content) of entries stored before `before` that still have no
+    analysis, oldest first, starting after `after_id`.
+    """
+    entry = database.JournalEntry
+    return [tuple(row) for row in db.execute(
+        select(entry.id, entry.user_id, entry.content)
+        .where(entry.ai_analysis.is_(None), entry.timestamp < before, entry.id > after_id)
+        .order_by(entry.id).limit(limit)
+    )]
+
+def encode_cursor(timestamp: datetime.datetime, entry_id: int) -> str:
+    """Turns the (timestamp, id) of the last row on a page into an opaque cursor."""
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{entry_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor. Raises ValueError for a malformed cursor."""
+    try:
+        timestamp, entry_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(timestamp), int(entry_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+@timed_query
+def list_journal_entries(db: Session, user_id: int, limit: int = 50, cursor: str = None, include_content: bool = True):
+    """
+    Returns one page of a user's journal, newest first, plus the cursor for the
+    next page (None on the last page). Uses keyset pagination on
+    (user_id, timestamp, id), so every page is an index range scan no matter how
+    deep it is. With include_content=False the large `content` column is not read.
+    """
+    entry = database.JournalEntry
+    if include_content:
+        query = db.query(entry)
+    else:
+        query = db.query(entry.id, entry.user_id, entry.timestamp, entry.ai_analysis,
+                         entry.ai_encouragement, entry.sentiment_score, entry.analysis_source)
+    query = query.filter(entry.user_id == user_id)
+    if cursor:
+        last_timestamp, last_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            entry.timestamp < last_timestamp,
+            and_(entry.timestamp == last_timestamp, entry.id < last_id)
+        ))
+    # Fetch one extra row to learn whether there is another page.
+    rows = query.order_by(entry.timestamp.desc(), entry.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1].timestamp, rows[limit - 1].id) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+@timed_query
 def get_all_journal_entries(db: Session):
     """
     Retrieves all journal entries from the database, ordering them so the newest
@@ -32,16 +122,44 @@ def get_all_journal_entries(db: Session):
     """
     return db.query(database.JournalEntry).order_by(database.JournalEntry.timestamp.desc()).all()
 
+@timed_query
 def get_journal_entry(db: Session, entry_id: int):
     """Retrieves a single journal entry by its unique ID."""
     return db.query(database.JournalEntry).filter(database.JournalEntry.id == entry_id).first()
 
+@timed_query
+def get_recent_sentiment_scores(db: Session, user_id: int, limit: int = 50):
+    """
+    Returns a user's most recent journal sentiment scores, oldest first, so they
+    can be replayed into the moving average kept by PatientState.
+    """
+    rows = (
+        db.query(database.JournalEntry.sentiment_score)
+        .filter(database.JournalEntry.user_id == user_id, database.JournalEntry.sentiment_score.isnot(None))
+        .order_by(database.JournalEntry.timestamp.desc())
+        .limit(limit)
+        .all()
+    )
+    return [row.sentiment_score for row in reversed(rows)]
+
 
 # ===================================================================
 # --- NEW: Symptom History Functions ---
 # ===================================================================
 
-def create_symptom_report(db: Session, description: str, result: dict, photo_path: str = None):
+def build_symptom_report(description: str, result: dict, photo_path: str = None, user_id: int = 1) -> database.SymptomReport:
+    """The (unsaved) row for a symptom report."""
+    return database.SymptomReport(
+        user_id=user_id,
+        timestamp=datetime.datetime.utcnow(),
+        description=description,
+        severity=result.get("severity"),
+        photo_path=photo_path,
+        analysis_source=result.get("analysis_source")
+    )
+
+@timed_query
+def create_symptom_report(db: Session, description: str, result: dict, photo_path: str = None, user_id: int = 1):
     """
     Saves a new symptom report to the database's history table.
     
@@ -50,28 +168,442 @@ def create_symptom_report(db: Session, description: str, result: dict, photo_pat
         description (str): The user's text description of the symptom.
         result (dict): The dictionary from the AI containing the 'severity'.
         photo_path (str, optional): A placeholder for the path to a saved image.
+        user_id (int): The patient the report belongs to.
     """
-    db_symptom = database.SymptomReport(
-        description=description,
-        severity=result.get("severity"),
-        photo_path=photo_path
-    )
+    db_symptom = build_symptom_report(description, result, photo_path, user_id)
     db.add(db_symptom)
+    _merge_daily_summaries(db, daily_summary.aggregate([db_symptom]))
     db.commit()
     db.refresh(db_symptom)
     return db_symptom
 
-def get_recent_symptoms(db: Session, days: int = 7):
+@timed_query
+def update_symptom_analysis(db: Session, report_id: int, result: dict):
+    """Replaces a report's provisional severity once the model's answer arrives."""
+    db.query(database.SymptomReport).filter(database.SymptomReport.id == report_id).update({
+        database.SymptomReport.severity: result.get("severity"),
+        database.SymptomReport.analysis_source: result.get("analysis_source"),
+    }, synchronize_session=False)
+    _refresh_daily_summaries(db, database.SymptomReport, [report_id])
+    db.commit()
+
+@timed_query
+def get_recent_symptoms(db: Session, user_id: int = 1, days: int = 7):
     """
-    Fetches all symptom reports from the last N days. This history is used
+    Fetches a user's symptom reports from the last N days. This history is used
     to calculate the dynamic symptom severity score.
     
     Args:
         db (Session): The active database session.
+        user_id (int): The patient whose history is needed.
         days (int): The number of days into the past to look for symptoms.
     """
     # Calculate the cutoff date (e.g., 7 days ago from now)
     cutoff_date = datetime.datetime.utcnow() - datetime.timedelta(days=days)
     
-    # Query the SymptomReport table for all entries more recent than the cutoff date
-    return db.query(database.SymptomReport).filter(database.SymptomReport.timestamp >= cutoff_date).all()
\ No newline at end of file
+    # Query the SymptomReport table for this user's entries more recent than the cutoff date
+    return db.query(database.SymptomReport).filter(
+        database.SymptomReport.user_id == user_id,
+        database.SymptomReport.timestamp >= cutoff_date
+    ).all()
+
+# ===================================================================
+# --- Analyzer Result Cache (persistent tier) ---
+# ===================================================================
+
+@timed_query
+def get_cached_analysis(db: Session, key: str, max_age_seconds: float):
+    """Returns a cached analyzer result if one exists and is younger than max_age_seconds."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=max_age_seconds)
+    row = db.query(database.AnalysisCacheEntry).filter(
+        database.AnalysisCacheEntry.key == key,
+        database.AnalysisCacheEntry.created_at >= cutoff
+    ).first()
+    return json.loads(row.result) if row else None
+
+@timed_query
+def save_cached_analysis(db: Session, key: str, kind: str, result: dict):
+    """Stores (or refreshes) an analyzer result in the persistent cache table."""
+    db.merge(database.AnalysisCacheEntry(
+        key=key,
+        kind=kind,
+        result=json.dumps(result),
+        created_at=datetime.datetime.utcnow()
+    ))
+    db.commit()
+
+
+# ===================================================================
+# --- Wearable Time-Series Functions ---
+# ===================================================================
+
+def _merge_rollups(db: Session, user_id: int, rollups: dict):
+    """
+    Adds freshly aggregated buckets into the rollup table with a single
+    INSERT ... ON CONFLICT DO UPDATE, so concurrent batches for the same
+    bucket combine correctly instead of overwriting each other.
+    """
+    if not rollups:
+        return
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+    table = database.TimeSeriesRollup.__table__
+    rows = [
+        {"user_id": user_id, "metric": metric, "resolution": resolution, "bucket_start": bucket_start, **bucket}
+        for (metric, resolution, bucket_start), bucket in rollups.items()
+    ]
+    # Chunked to stay well under SQLite's bound-parameter limit.
+    for i in range(0, len(rows), 500):
+        stmt = dialect_insert(table).values(rows[i:i + 500])
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.metric, table.c.resolution, table.c.bucket_start],
+            set_={
+                "count": table.c.count + excluded.count,
+                "sum": table.c.sum + excluded.sum,
+                "min": case((excluded.min < table.c.min, excluded.min), else_=table.c.min),
+                "max": case((excluded.max > table.c.max, excluded.max), else_=table.c.max),
+            },
+        )
+        db.execute(stmt)
+
+@timed_query
+def ingest_timeseries_samples(db: Session, user_id: int, samples: list, idempotency_key: str = None, store_raw: bool = True):
+    """
+    Stores a batch of (metric, timestamp, value) samples and folds them into the
+    1-minute, 1-hour and 1-day rollups, all in one transaction.
+
+    Returns (accepted, sample_count). When the idempotency key has been seen before
+    nothing is written and the original batch's sample count is returned.
+    """
+    if idempotency_key:
+        previous = db.get(database.IngestBatch, (user_id, idempotency_key))
+        if previous is not None:
+            return False, previous.sample_count
+        db.add(database.IngestBatch(user_id=user_id, idempotency_key=idempotency_key, sample_count=len(samples)))
+
+    if store_raw and samples:
+        db.execute(insert(database.TimeSeriesSample), [
+            {"user_id": user_id, "metric": metric, "timestamp": timestamp, "value": value}
+            for metric, timestamp, value in samples
+        ])
+    _merge_rollups(db, user_id, timeseries.aggregate(samples))
+
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent retry with the same idempotency key won the race.
+        db.rollback()
+        previous = db.get(database.IngestBatch, (user_id, idempotency_key)) if idempotency_key else None
+        if previous is None:
+            raise
+        return False, previous.sample_count
+    return True, len(samples)
+
+@timed_query
+def merge_timeseries_rollups(db: Session, rollups_by_user: dict):
+    """Merges pre-aggregated buckets for many patients in one transaction (see timeseries.aggregate)."""
+    for user_id, rollups in rollups_by_user.items():
+        _merge_rollups(db, user_id, rollups)
+    db.commit()
+
+@timed_query
+def get_timeseries_rollups(db: Session, user_id: int, metric: str, resolution: str,
+                           start: datetime.datetime, end: datetime.datetime):
+    """Reads pre-aggregated buckets for a dashboard range query, oldest first."""
+    rollup = database.TimeSeriesRollup
+    return db.query(rollup).filter(
+        rollup.user_id == user_id,
+        rollup.metric == metric,
+        rollup.resolution == resolution,
+        rollup.bucket_start >= timeseries.bucket_start(start, resolution),
+        rollup.bucket_start < end
+    ).order_by(rollup.bucket_start).all()
+
+
+# ===================================================================
+# --- Daily Summaries ---
+# ===================================================================
+
+def _merge_daily_summaries(db: Session, summaries: dict):
+    """
+    Adds per-day totals (see daily_summary.aggregate) into daily_summaries with
+    INSERT ... ON CONFLICT DO UPDATE, in the caller's transaction.
+    """
+    if not summaries:
+        return
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+    table = database.DailySummary.__table__
+    rows = [{"user_id": user_id, "day": day, **summary} for (user_id, day), summary in summaries.items()]
+    for i in range(0, len(rows), 500):
+        stmt = dialect_insert(table).values(rows[i:i + 500])
+        excluded = stmt.excluded
+        set_ = {column: table.c[column] + excluded[column] for column in daily_summary.COUNT_COLUMNS}
+        set_["sentiment_min"] = case((table.c.sentiment_min.is_(None), excluded.sentiment_min),
+                                     (excluded.sentiment_min < table.c.sentiment_min, excluded.sentiment_min),
+                                     else_=table.c.sentiment_min)
+        set_["sentiment_max"] = case((table.c.sentiment_max.is_(None), excluded.sentiment_max),
+                                     (excluded.sentiment_max > table.c.sentiment_max, excluded.sentiment_max),
+                                     else_=table.c.sentiment_max)
+        db.execute(stmt.on_conflict_do_update(index_elements=[table.c.user_id, table.c.day], set_=set_))
+
+def _rebuild_daily_summaries(db: Session, user_ids: list, start: datetime.date = None, end: datetime.date = None) -> int:
+    """
+    Recomputes the summaries of `user_ids` for the days in [start, end) (default:
+    all days) from the raw tables, in the caller's transaction. The old rows are
+    deleted first, which on SQLite takes the write lock, so no insert can land
+    between the delete and the recount.
+    """
+    summary, journal, symptom = database.DailySummary, database.JournalEntry, database.SymptomReport
+    clear = delete(summary).where(summary.user_id.in_(user_ids))
+    if start is not None:
+        clear = clear.where(summary.day >= start)
+    if end is not None:
+        clear = clear.where(summary.day < end)
+    db.execute(clear)
+
+    def scoped(query, table):
+        query = query.where(table.user_id.in_(user_ids))
+        if start is not None:
+            query = query.where(table.timestamp >= datetime.datetime.combine(start, datetime.time()))
+        if end is not None:
+            query = query.where(table.timestamp < datetime.datetime.combine(end, datetime.time()))
+        return query
+
+    summaries = {}
+    def summary_for(user_id, day):
+        # func.date returns a string on SQLite and a date elsewhere
+        key = (user_id, datetime.date.fromisoformat(str(day)))
+        return summaries.setdefault(key, daily_summary.empty_summary())
+
+    day = func.date(journal.timestamp)
+    for row in db.execute(scoped(select(
+        journal.user_id, day, func.count(journal.id), func.count(journal.sentiment_score),
+        func.coalesce(func.sum(journal.sentiment_score), 0.0), func.min(journal.sentiment_score), func.max(journal.sentiment_score),
+    ), journal).group_by(journal.user_id, day)):
+        summary_for(row[0], row[1]).update(journal_count=row[2], sentiment_count=row[3], sentiment_sum=row[4],
+                                           sentiment_min=row[5], sentiment_max=row[6])
+
+    day = func.date(symptom.timestamp)
+    for row in db.execute(scoped(select(
+        symptom.user_id, day, symptom.severity, func.count(symptom.id),
+    ), symptom).group_by(symptom.user_id, day, symptom.severity)):
+        daily_summary.add_symptom(summary_for(row[0], row[1]), row[2], row[3])
+
+    _merge_daily_summaries(db, summaries)
+    return len(summaries)
+
+def _refresh_daily_summaries(db: Session, table, row_ids: list):
+    """Recounts the days of rows whose sentiment or severity just changed (a min or max cannot be taken back)."""
+    keys = {(row.user_id, row.timestamp.date())
+            for row in db.execute(select(table.user_id, table.timestamp).where(table.id.in_(row_ids)))}
+    for user_id, day in keys:
+        _rebuild_daily_summaries(db, [user_id], day, day + datetime.timedelta(days=1))
+
+@timed_query
+def rebuild_daily_summaries(db: Session, user_ids: list) -> int:
+    """Recomputes all of these patients' summaries in one transaction (the backfill). Returns the rows written."""
+    written = _rebuild_daily_summaries(db, user_ids)
+    db.commit()
+    return written
+
+@timed_query
+def get_user_ids_with_history(db: Session) -> list:
+    journal = select(database.JournalEntry.user_id)
+    symptoms = select(database.SymptomReport.user_id)
+    return sorted(row[0] for row in db.execute(journal.union(symptoms)))
+
+@timed_query
+def get_daily_summaries(db: Session, user_id: int, start: datetime.date, end: datetime.date):
+    """A patient's summaries for the days in [start, end), oldest first. Days without activity have no row."""
+    summary = database.DailySummary
+    return db.query(summary).filter(
+        summary.user_id == user_id, summary.day >= start, summary.day < end
+    ).order_by(summary.day).all()
+
+
+# ===================================================================
+# --- Group Commit ---
+# ===================================================================
+
+@timed_query
+def insert_rows(db: Session, rows: list):
+    """
+    Inserts new journal entries and symptom reports from many requests in one
+    transaction. The ids come back from the INSERTs themselves (lastrowid, or a
+    batched RETURNING where the dialect supports it), and with expire_on_commit=False
+    the rows stay readable, so there is no refresh.
+    """
+    db.add_all(rows)
+    _merge_daily_summaries(db, daily_summary.aggregate(rows))
+    db.commit()
+    return rows
+
+
+# ===================================================================
+# --- Patient State Event Log and Snapshots ---
+# ===================================================================
+
+@timed_query
+def append_patient_events(db: Session, events: list):
+    """
+    Appends (user_id, kind, value, severity, timestamp, event_key) tuples to the event
+    log in one transaction. Returns the stored rows, whose ids give the log order.
+    """
+    rows = [
+        database.PatientEvent(user_id=user_id, kind=kind, value=value, severity=severity, timestamp=timestamp,
+                              event_key=event_key)
+        for user_id, kind, value, severity, timestamp, event_key in events
+    ]
+    db.add_all(rows)
+    db.commit()
+    return rows
+
+@timed_query
+def get_patient_event_id(db: Session, user_id: int, event_key: str):
+    """The id of the logged event with this key, or None if it has not been written (yet)."""
+    return db.execute(select(database.PatientEvent.id).where(
+        database.PatientEvent.event_key == event_key, database.PatientEvent.user_id == user_id)).scalar()
+
+@timed_query
+def get_patient_snapshot(db: Session, user_id: int):
+    return db.get(database.PatientSnapshot, user_id)
+
+@timed_query
+def get_patient_events_after(db: Session, user_id: int, after_id: int):
+    """Returns the patient's events newer than `after_id`, oldest first."""
+    event = database.PatientEvent
+    return db.query(event).filter(event.user_id == user_id, event.id > after_id).order_by(event.id).all()
+
+@timed_query
+def save_patient_snapshot(db: Session, user_id: int, last_event_id: int, hrv: float, avg_sentiment: float,
+                          clinical_biomarker: float, symptoms: list) -> bool:
+    """Stores a snapshot unless a newer one is already there. Returns True if it was written."""
+    existing = db.get(database.PatientSnapshot, user_id)
+    if existing is not None and existing.last_event_id >= last_event_id:
+        return False
+    db.merge(database.PatientSnapshot(
+        user_id=user_id,
+        last_event_id=last_event_id,
+        hrv=hrv,
+        avg_sentiment=avg_sentiment,
+        clinical_biomarker=clinical_biomarker,
+        symptoms=json.dumps(symptoms),
+        taken_at=datetime.datetime.utcnow()
+    ))
+    db.commit()
+    return True
+
+@timed_query
+def get_recently_snapshotted_user_ids(db: Session, limit: int):
+    """The patients whose snapshots were taken most recently, i.e. the recently active ones."""
+    snapshot = database.PatientSnapshot
+    return [row.user_id for row in db.query(snapshot.user_id).order_by(snapshot.taken_at.desc()).limit(limit)]
+
+
+# ===================================================================
+# --- Bulk Export ---
+# ===================================================================
+
+def _export_dataset(table, columns: tuple, order_by: tuple) -> dict:
+    return {"table": table, "columns": [getattr(table, name) for name in columns],
+            "order_by": [getattr(table, name) for name in order_by]}
+
+# What each export returns, in column order. Rows are ordered along each table's
+# composite index, so the database streams them without sorting the whole result first.
+EXPORT_DATASETS = {
+    "journal": _export_dataset(database.JournalEntry, (
+        "id", "user_id", "timestamp", "content", "sentiment_score", "ai_analysis", "ai_encouragement", "analysis_source",
+    ), order_by=("user_id", "timestamp", "id")),
+    "symptoms": _export_dataset(database.SymptomReport, (
+        "id", "user_id", "timestamp", "description", "severity", "photo_path", "analysis_source",
+    ), order_by=("user_id", "timestamp", "id")),
+    # Clinical biomarker levels entered by the care team, from the patient event log
+    "biomarkers": _export_dataset(database.PatientEvent, (
+        "id", "user_id", "timestamp", "value",
+    ), order_by=("user_id", "id")),
+    # The whole patient state event log, which backend.replay can play back
+    "events": _export_dataset(database.PatientEvent, (
+        "id", "user_id", "timestamp", "kind", "value", "severity",
+    ), order_by=("user_id", "id")),
+    # Raw wearable samples (hrv, heart_rate, sleep_hours)
+    "wearables": _export_dataset(database.TimeSeriesSample, (
+        "id", "user_id", "timestamp", "metric", "value",
+    ), order_by=("user_id", "metric", "timestamp")),
+}
+
+def export_query(dataset: str, user_ids: list = None, start: datetime.datetime = None, end: datetime.datetime = None):
+    """The SELECT behind an export, optionally limited to some patients and a [start, end) time range."""
+    spec = EXPORT_DATASETS[dataset]
+    table = spec["table"]
+    query = select(*spec["columns"])
+    if dataset == "biomarkers":
+        query = query.where(table.kind == "biomarker")
+    if user_ids:
+        query = query.where(table.user_id.in_(user_ids))
+    if start is not None:
+        query = query.where(table.timestamp >= start)
+    if end is not None:
+        query = query.where(table.timestamp < end)
+    return query.order_by(*spec["order_by"])
+
+
+# ===================================================================
+# --- Async Versions (for AsyncSession in the FastAPI endpoints) ---
+# ===================================================================
+# Each wrapper runs the sync function above on the AsyncSession's connection via
+# run_sync, so the query logic lives in one place and the event loop is never
+# blocked on database I/O.
+
+async def create_journal_entry_async(db: AsyncSession, entry: models.JournalEntryCreate, analysis_result: dict):
+    return await db.run_sync(create_journal_entry, entry, analysis_result)
+
+async def update_journal_analyses_async(db: AsyncSession, results: list, only_pending: bool = False):
+    return await db.run_sync(update_journal_analyses, results, only_pending)
+
+async def get_pending_journal_entries_async(db: AsyncSession, before: datetime.datetime, after_id: int = 0, limit: int = 100):
+    return await db.run_sync(get_pending_journal_entries, before, after_id, limit)
+
+async def list_journal_entries_async(db: AsyncSession, user_id: int, limit: int = 50, cursor: str = None, include_content: bool = True):
+    return await db.run_sync(list_journal_entries, user_id, limit, cursor, include_content)
+
+async def get_all_journal_entries_async(db: AsyncSession):
+    return await db.run_sync(get_all_journal_entries)
+
+async def get_journal_entry_async(db: AsyncSession, entry_id: int):
+    return await db.run_sync(get_journal_entry, entry_id)
+
+async def get_recent_sentiment_scores_async(db: AsyncSession, user_id: int, limit: int = 50):
+    return await db.run_sync(get_recent_sentiment_scores, user_id, limit)
+
+async def create_symptom_report_async(db: AsyncSession, description: str, result: dict, photo_path: str = None, user_id: int = 1):
+    return await db.run_sync(create_symptom_report, description, result, photo_path, user_id)
+
+async def update_symptom_analysis_async(db: AsyncSession, report_id: int, result: dict):
+    return await db.run_sync(update_symptom_analysis, report_id, result)
+
+async def get_recent_symptoms_async(db: AsyncSession, user_id: int = 1, days: int = 7):
+    return await db.run_sync(get_recent_symptoms, user_id, days)
+
+async def get_cached_analysis_async(db: AsyncSession, key: str, max_age_seconds: float):
+    return await db.run_sync(get_cached_analysis, key, max_age_seconds)
+
+async def save_cached_analysis_async(db: AsyncSession, key: str, kind: str, result: dict):
+    return await db.run_sync(save_cached_analysis, key, kind, result)
+
+async def ingest_timeseries_samples_async(db: AsyncSession, user_id: int, samples: list, idempotency_key: str = None, store_raw: bool = True):
+    return await db.run_sync(ingest_timeseries_samples, user_id, samples, idempotency_key, store_raw)
+
+async def get_timeseries_rollups_async(db: AsyncSession, user_id: int, metric: str, resolution: str,
+                                       start: datetime.datetime, end: datetime.datetime):
+    return await db.run_sync(get_timeseries_rollups, user_id, metric, resolution, start, end)
+
+async def get_daily_summaries_async(db: AsyncSession, user_id: int, start: datetime.date, end: datetime.date):
+    return await db.run_sync(get_daily_summaries, user_id, start, end)
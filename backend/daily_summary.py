@@ -0,0 +1,138 @@
+# app/daily_summary.py
+"""
+Per-patient daily totals of journal sentiment and symptom severities.
+
+The daily_summaries table is maintained by crud in the same transaction as each
+journal entry and symptom report, so dashboards read a handful of rows instead of
+aggregating raw history. Rows written before the table existed are folded in with
+the backfill command:
+
+    python -m backend.daily_summary --backfill [--user-id 7 ...]
+"""
+import sys
+import logging
+import argparse
+import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# Severities with their own counter; any other value only counts toward symptom_count
+SEVERITY_COLUMNS = {"Mild": "mild_count", "Moderate": "moderate_count", "Severe": "severe_count"}
+COUNT_COLUMNS = ("journal_count", "sentiment_count", "sentiment_sum", "symptom_count",
+                 "mild_count", "moderate_count", "severe_count")
+# Patients rebuilt per transaction by the backfill
+BACKFILL_BATCH_USERS = 500
+
+SummaryKey = Tuple[int, datetime.date] # (user_id, day)
+
+
+def empty_summary() -> dict:
+    summary = {column: 0 for column in COUNT_COLUMNS}
+    summary.update(sentiment_sum=0.0, sentiment_min=None, sentiment_max=None)
+    return summary
+
+
+def add_sentiment(summary: dict, score: Optional[float]):
+    if score is None:
+        return
+    summary["sentiment_count"] += 1
+    summary["sentiment_sum"] += score
+    summary["sentiment_min"] = score if summary["sentiment_min"] is None else min(summary["sentiment_min"], score)
+    summary["sentiment_max"] = score if summary["sentiment_max"] is None else max(summary["sentiment_max"], score)
+
+
+def add_symptom(summary: dict, severity: Optional[str], count: int = 1):
+    summary["symptom_count"] += count
+    column = SEVERITY_COLUMNS.get(severity)
+    if column:
+        summary[column] += count
+
+
+def aggregate(rows: Iterable) -> Dict[SummaryKey, dict]:
+    """Folds new JournalEntry / SymptomReport rows into per-(user, UTC day) totals, ready to be merged."""
+    summaries: Dict[SummaryKey, dict] = {}
+    for row in rows:
+        key = (row.user_id, row.timestamp.date())
+        summary = summaries.get(key)
+        if summary is None:
+            summary = summaries[key] = empty_summary()
+        if isinstance(row, database.JournalEntry):
+            summary["journal_count"] += 1
+            add_sentiment(summary, row.sentiment_score)
+        else:
+            add_symptom(summary, row.severity)
+    return summaries
+
+
+def period_start(day: datetime.date, period: str) -> datetime.date:
+    """The day itself, or the Monday of its ISO week."""
+    return day - datetime.timedelta(days=day.weekday()) if period == "week" else day
+
+
+def summarize(rows: Iterable, period: str = "day") -> List[dict]:
+    """Combines DailySummary rows (oldest first) into one point per day or week, with averages filled in."""
+    points: Dict[datetime.date, dict] = {}
+    for row in rows:
+        start = period_start(row.day, period)
+        point = points.get(start)
+        if point is None:
+            point = points[start] = empty_summary()
+        for column in COUNT_COLUMNS:
+            point[column] += getattr(row, column)
+        for column, pick in (("sentiment_min", min), ("sentiment_max", max)):
+            value = getattr(row, column)
+            if value is not None:
+                point[column] = value if point[column] is None else pick(point[column], value)
+    return [{
+        "day": start,
+        "journal_count": point["journal_count"],
+        "avg_sentiment": point["sentiment_sum"] / point["sentiment_count"] if point["sentiment_count"] else None,
+        "min_sentiment": point["sentiment_min"],
+        "max_sentiment": point["sentiment_max"],
+        "symptom_count": point["symptom_count"],
+        "symptoms_by_severity": {severity: point[column] for severity, column in SEVERITY_COLUMNS.items()},
+    } for start, point in points.items()]
+
+
+def backfill(user_ids=None, batch_users: int = BACKFILL_BATCH_USERS) -> int:
+    """
+    Rebuilds the summaries of the given patients (default: everyone with history)
+    from the raw tables, `batch_users` patients per transaction. Safe to run while
+    the app is up and to run again. Returns the number of summary rows written.
+    """
+    from . import crud # crud depends on this module
+    if user_ids is None:
+        db = database.SessionLocal()
+        try:
+            user_ids = crud.get_user_ids_with_history(db)
+        finally:
+            db.close()
+    written = 0
+    for i in range(0, len(user_ids), batch_users):
+        written += database.run_write(crud.rebuild_daily_summaries, user_ids[i:i + batch_users])
+        logger.info("Backfilled daily summaries for %d of %d patients.", min(i + batch_users, len(user_ids)), len(user_ids))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backfill", action="store_true", help="rebuild the summaries from journal_entries and symptom_reports")
+    parser.add_argument("--user-id", type=int, action="append", help="only these patients (repeatable)")
+    parser.add_argument("--batch-users", type=int, default=BACKFILL_BATCH_USERS)
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.print_help()
+        sys.exit(2)
+
+    from .logging_config import configure_logging
+    configure_logging()
+    database.create_db_and_tables()
+    written = backfill(args.user_id, args.batch_users)
+    logger.info("Wrote %d daily summary rows.", written)
+
+
+if __name__ == "__main__":
+    main()
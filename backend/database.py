@@ -1,7 +1,11 @@
 # backend/app/database.py
 
 import os # <-- Must be imported
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float
+import asyncio
+from typing import Optional
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Text, Date, DateTime, Float, Index
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 import datetime
@@ -20,17 +24,125 @@ SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./care_companion.
 if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
     SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+# Connection pool sizing for Postgres. Each worker process gets its own pool, so
+# keep DB_POOL_SIZE + DB_MAX_OVERFLOW times the worker count under the server's max_connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Memory-mapped I/O window for SQLite reads (default 256 MB).
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+
+def _sqlite_profile(dbapi_connection, connection_record):
+    """
+    Per-connection SQLite settings: WAL lets readers run alongside the single
+    writer, synchronous=NORMAL is durable in WAL mode with far fewer fsyncs, and
+    mmap serves reads straight from the page cache.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+def _pool_options() -> dict:
+    if IS_SQLITE:
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
 # The `connect_args` are only for SQLite. We remove them for production.
 # The engine will be created based on the URL provided.
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+if IS_SQLITE:
     engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", _sqlite_profile)
 else:
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, **_pool_options())
 
 # --- The rest of the file is unchanged, as it's already perfect ---
 
+# The synchronous session stays available for scripts and the threadpool endpoints.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# ==============================================================================
+# --- ASYNC ENGINE FOR THE FASTAPI ENDPOINTS ---
+# ==============================================================================
+
+def _async_url(url: str) -> str:
+    """Swaps in the asyncio driver for the configured database."""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:"):
+        return url.replace("postgresql:", "postgresql+asyncpg:", 1)
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(SQLALCHEMY_DATABASE_URL))
+
+if IS_SQLITE:
+    # SQLite allows one writer at a time. Funnelling every write through a single
+    # pooled connection makes writers queue in the pool instead of failing with
+    # "database is locked", while reads use their own pool and run concurrently.
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=0)
+    async_write_engine = create_async_engine(ASYNC_DATABASE_URL, pool_size=1, max_overflow=0,
+                                             pool_timeout=DB_POOL_TIMEOUT)
+    event.listen(async_engine.sync_engine, "connect", _sqlite_profile)
+    event.listen(async_write_engine.sync_engine, "connect", _sqlite_profile)
+else:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **_pool_options())
+    async_write_engine = async_engine
+
+# expire_on_commit=False: returned rows stay readable after commit without another round-trip.
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+AsyncWriteSessionLocal = async_sessionmaker(async_write_engine, autoflush=False, expire_on_commit=False)
+
+# ==============================================================================
+# --- SYNC WRITES ON THE SINGLE WRITER ---
+# ==============================================================================
+
+# The event loop the app runs on, set by the lifespan. The background writers (event
+# log, snapshots, score rollups, backfills) are sync code in worker threads; they hand
+# their writes to this loop, so on SQLite the async writer is the only connection that
+# ever writes.
+_write_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def bind_write_loop(loop: Optional[asyncio.AbstractEventLoop]):
+    global _write_loop
+    _write_loop = loop
+
+async def _run_write_async(fn, *args, **kwargs):
+    async with AsyncWriteSessionLocal() as db:
+        return await db.run_sync(fn, *args, **kwargs)
+
+def run_write(fn, *args, **kwargs):
+    """
+    Runs fn(session, *args, **kwargs) on the writer connection and returns its result.
+    Blocking: call it from a worker thread, never from the event loop, and never while
+    holding a write session, which it would wait for. Without a bound loop (scripts,
+    the replay tool) nothing else in the process writes, so it uses a plain session.
+    """
+    loop = _write_loop
+    if loop is None or loop.is_closed():
+        db = SessionLocal()
+        try:
+            return fn(db, *args, **kwargs)
+        finally:
+            db.close()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("run_write blocks until the write is done; call it from a worker thread")
+    return asyncio.run_coroutine_threadsafe(_run_write_async(fn, *args, **kwargs), loop).result()
+
 Base = declarative_base()
 
 class JournalEntry(Base):
@@ -42,6 +154,9 @@ class JournalEntry(Base):
     ai_analysis = Column(Text, nullable=True)
     ai_encouragement = Column(Text, nullable=True)
     sentiment_score = Column(Float, nullable=True)
+    analysis_source = Column(String, nullable=True) # "model" or "local" (the fast local triage)
+    # Serves per-user listings newest-first and keyset pagination on (timestamp, id)
+    __table_args__ = (Index("ix_journal_entries_user_ts_id", "user_id", "timestamp", "id"),)
 
 class SymptomReport(Base):
     __tablename__ = "symptom_reports"
@@ -51,8 +166,132 @@ class SymptomReport(Base):
     description = Column(Text, nullable=False)
     severity = Column(String, nullable=False) 
     photo_path = Column(String, nullable=True)
+    analysis_source = Column(String, nullable=True) # "model" or "local" (the fast local triage)
+    # Serves the per-user 7-day window query behind the symptom score
+    __table_args__ = (Index("ix_symptom_reports_user_ts_id", "user_id", "timestamp", "id"),)
+
+class AnalysisCacheEntry(Base):
+    """Persistent tier of the analyzer result cache, keyed by a content hash."""
+    __tablename__ = "analysis_cache"
+    key = Column(String(64), primary_key=True)
+    kind = Column(String, nullable=False)
+    result = Column(Text, nullable=False) # The model's JSON answer
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+class TimeSeriesSample(Base):
+    """Raw timestamped wearable samples (HRV, heart rate, sleep, ...)."""
+    __tablename__ = "timeseries_samples"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    metric = Column(String, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+    value = Column(Float, nullable=False)
+    __table_args__ = (Index("ix_timeseries_samples_user_metric_ts", "user_id", "metric", "timestamp"),)
+
+class TimeSeriesRollup(Base):
+    """Per-bucket aggregates of TimeSeriesSample at 1-minute, 1-hour and 1-day resolution."""
+    __tablename__ = "timeseries_rollups"
+    user_id = Column(Integer, primary_key=True)
+    metric = Column(String, primary_key=True)
+    resolution = Column(String, primary_key=True) # "1m", "1h" or "1d"
+    bucket_start = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False)
+    sum = Column(Float, nullable=False)
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+
+class DailySummary(Base):
+    """
+    Per-patient, per-day (UTC) totals of journal sentiment and symptom severities,
+    kept up to date in the same transaction as the rows they summarize.
+    """
+    __tablename__ = "daily_summaries"
+    user_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    journal_count = Column(Integer, nullable=False, default=0)
+    # Only entries with a sentiment score; background-mode entries get theirs later
+    sentiment_count = Column(Integer, nullable=False, default=0)
+    sentiment_sum = Column(Float, nullable=False, default=0.0)
+    sentiment_min = Column(Float, nullable=True)
+    sentiment_max = Column(Float, nullable=True)
+    symptom_count = Column(Integer, nullable=False, default=0)
+    mild_count = Column(Integer, nullable=False, default=0)
+    moderate_count = Column(Integer, nullable=False, default=0)
+    severe_count = Column(Integer, nullable=False, default=0)
+
+class IngestBatch(Base):
+    """Remembers idempotency keys so a retried upload from the phone is not stored twice."""
+    __tablename__ = "ingest_batches"
+    user_id = Column(Integer, primary_key=True)
+    idempotency_key = Column(String(128), primary_key=True)
+    sample_count = Column(Integer, nullable=False)
+    received_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class PatientEvent(Base):
+    """Append-only log of every change to a patient's live state. Rows are never updated."""
+    __tablename__ = "patient_events"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    # "hrv", "sentiment", "biomarker" or "symptom", plus "sentiment_revision" and
+    # "symptom_retraction" when a late model answer replaces a provisional one
+    kind = Column(String, nullable=False)
+    value = Column(Float, nullable=True)
+    severity = Column(String, nullable=True) # Only for "symptom" events
+    timestamp = Column(DateTime, nullable=False)
+    # "<worker id>:<sequence>", set when several workers share state over the backplane,
+    # so the scoring leader can tell whether a patient it loaded already has a remote event
+    event_key = Column(String, nullable=True)
+    # Serves the "events after the snapshot" tail read
+    __table_args__ = (Index("ix_patient_events_user_id", "user_id", "id"),
+                      Index("ix_patient_events_event_key", "event_key"))
+
+class PatientSnapshot(Base):
+    """A patient's state folded up to and including event `last_event_id`."""
+    __tablename__ = "patient_snapshots"
+    user_id = Column(Integer, primary_key=True)
+    last_event_id = Column(Integer, nullable=False)
+    hrv = Column(Float, nullable=False)
+    avg_sentiment = Column(Float, nullable=False)
+    clinical_biomarker = Column(Float, nullable=False)
+    symptoms = Column(Text, nullable=False) # JSON list of [timestamp_us, half_weight] still in the window
+    taken_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+def add_missing_columns():
+    """
+    create_all never alters a table that already exists, so columns added to a model
+    later are missing from older databases. This adds any nullable column that is
+    declared but not present, with a plain ALTER TABLE ... ADD COLUMN, which SQLite
+    and PostgreSQL both support. Anything needing more (NOT NULL, type changes)
+    still needs a real migration.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
 
 def create_db_and_tables():
     # This single command works for both SQLite and PostgreSQL.
     # It will create the tables in whichever database the `engine` is connected to.
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    try:
+        Base.metadata.create_all(bind=engine)
+    except (OperationalError, ProgrammingError):
+        # Another worker starting at the same moment created a table between our
+        # existence check and our CREATE; a second pass finds everything in place.
+        Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    # create_all skips tables that already exist, including any index added to them
+    # later, so make sure every declared index is present on existing databases too.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except (OperationalError, ProgrammingError):
+                index.create(bind=engine, checkfirst=True)
\ No newline at end of file
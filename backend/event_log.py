@@ -0,0 +1,115 @@
+# app/event_log.py
+import os
+import asyncio
+import logging
+import datetime
+import threading
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from . import crud, database, metrics
+
+logger = logging.getLogger(__name__)
+
+# Changes are buffered in memory and written in one transaction per interval, so a
+# burst of HRV readings costs one commit instead of one each. A crash can lose at
+# most this much state.
+PATIENT_EVENT_FLUSH_SECONDS = float(os.getenv("PATIENT_EVENT_FLUSH_MS", "250")) / 1000
+
+# (user_id, kind, value, severity, timestamp, event_key)
+PendingEvent = Tuple[int, str, Optional[float], Optional[str], datetime.datetime, Optional[str]]
+
+
+class PatientEventLog:
+    """
+    Write-behind buffer in front of the append-only `patient_events` table.
+
+    Readers that rebuild a patient call read_tail(), which returns the committed
+    events plus the ones still buffered. A flush holds the write lock from taking
+    the buffer until its commit, so read_tail() never sees an event twice or misses
+    one that is in flight.
+    """
+    def __init__(self, flush_interval: float = PATIENT_EVENT_FLUSH_SECONDS):
+        self.flush_interval = flush_interval
+        self._buffer: List[PendingEvent] = []
+        # Appends come from the event loop and the sync endpoint threadpool.
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # Events written since each patient's last snapshot, as far as this process knows
+        self._unsnapshotted: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+
+    def append(self, user_id: int, kind: str, value: Optional[float] = None,
+               severity: Optional[str] = None, timestamp: Optional[datetime.datetime] = None,
+               event_key: Optional[str] = None):
+        event = (user_id, kind, value, severity, timestamp or datetime.datetime.utcnow(), event_key)
+        with self._buffer_lock:
+            self._buffer.append(event)
+
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    def flush(self) -> int:
+        """Writes everything buffered in one transaction. Blocking; returns the number of events written."""
+        with self._write_lock:
+            with self._buffer_lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            try:
+                database.run_write(crud.append_patient_events, batch)
+            except Exception:
+                # Put the batch back in front of anything appended meanwhile; the next flush retries it.
+                with self._buffer_lock:
+                    self._buffer[:0] = batch
+                raise
+        with self._buffer_lock:
+            self._unsnapshotted.update(event[0] for event in batch)
+        return len(batch)
+
+    def read_tail(self, db, user_id: int, after_id: int) -> Tuple[list, List[PendingEvent]]:
+        """Returns (stored events after `after_id`, events still buffered) for one patient, both oldest first."""
+        with self._write_lock:
+            stored = crud.get_patient_events_after(db, user_id, after_id)
+            with self._buffer_lock:
+                pending = [event for event in self._buffer if event[0] == user_id]
+        return stored, pending
+
+    def note_unsnapshotted(self, user_id: int, count: int):
+        """Records events found behind a snapshot (e.g. after a restart) so the next pass compacts them."""
+        with self._buffer_lock:
+            self._unsnapshotted[user_id] += count
+
+    def take_snapshot_candidates(self, min_events: int) -> List[int]:
+        """Returns and forgets the patients with at least `min_events` events since their snapshot."""
+        with self._buffer_lock:
+            user_ids = [user_id for user_id, count in self._unsnapshotted.items() if count >= min_events]
+            for user_id in user_ids:
+                del self._unsnapshotted[user_id]
+        return user_ids
+
+    def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stops the background flush and writes whatever is still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if not self._buffer:
+                continue
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception:
+                logger.exception("Could not write patient events; will retry")
+
+
+# Create a single global event log to be shared across the application
+event_log = PatientEventLog()
+metrics.PATIENT_EVENTS_BUFFERED.set_function(event_log.buffered)
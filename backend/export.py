@@ -0,0 +1,62 @@
+# app/export.py
+import io
+import os
+import csv
+import json
+import logging
+import datetime
+from typing import AsyncIterator, List, Optional
+
+from . import crud, database, metrics
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched from the cursor, and written out, per chunk. Memory use depends on
+# this and not on how much history a patient has.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _json_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def _ndjson_chunk(columns: List[str], rows) -> str:
+    return "".join(json.dumps(dict(zip(columns, map(_json_value, row)))) + "\n" for row in rows)
+
+
+def _csv_chunk(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_json_value(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+async def stream_export(dataset: str, fmt: str, user_ids: Optional[List[int]] = None,
+                        start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None,
+                        batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[str]:
+    """
+    Yields an export as text chunks of `batch_size` rows. The query runs on a
+    server-side cursor (yield_per), so rows are fetched as the client reads them
+    and never all held at once. The session is opened here rather than by the
+    endpoint because the generator outlives the request handler.
+    """
+    query = crud.export_query(dataset, user_ids, start, end).execution_options(yield_per=batch_size)
+    columns = [column.name for column in crud.EXPORT_DATASETS[dataset]["columns"]]
+    if fmt == "csv":
+        yield _csv_chunk([columns])
+    rows_sent = 0
+    async with database.AsyncSessionLocal() as db:
+        result = await db.stream(query)
+        async for partition in result.partitions():
+            yield _ndjson_chunk(columns, partition) if fmt == "ndjson" else _csv_chunk(partition)
+            rows_sent += len(partition)
+            metrics.EXPORT_ROWS.labels(dataset, fmt).inc(len(partition))
+    logger.info("Exported %d %s rows as %s.", rows_sent, dataset, fmt)
+
+
+def filename(dataset: str, fmt: str, user_ids: Optional[List[int]]) -> str:
+    patients = "-".join(map(str, user_ids)) if user_ids and len(user_ids) <= 5 else "cohort"
+    return f"{dataset}-{patients}-{datetime.datetime.utcnow():%Y%m%d}.{fmt}"
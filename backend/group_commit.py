@@ -0,0 +1,163 @@
+# app/group_commit.py
+import os
+import time
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient
+
+from . import crud, database, metrics, models
+
+logger = logging.getLogger(__name__)
+
+# Off by default: every insert commits on its own, as before. When on, journal
+# entries and symptom reports from concurrent requests share one transaction.
+GROUP_COMMIT_ENABLED = os.getenv("DB_GROUP_COMMIT", "0").lower() in ("1", "true", "yes", "on")
+# How long the first row of a group waits for others to join it, and the most rows per transaction
+GROUP_COMMIT_WINDOW_SECONDS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2")) / 1000
+GROUP_COMMIT_MAX_ROWS = int(os.getenv("GROUP_COMMIT_MAX_ROWS", "64"))
+
+# (row, the caller's future, when it was handed over)
+PendingRow = Tuple[database.Base, asyncio.Future, float]
+
+
+class GroupCommitWriter:
+    """
+    Collects new rows from concurrent requests and writes them in one transaction.
+
+    The first row of a group waits up to `window` seconds (or until `max_rows` are
+    waiting) for others, then the group is inserted with a single commit. Ids come
+    back from the INSERTs, without a refresh, and each caller's future resolves to
+    its own row. Rows that arrive while a commit is running form the next group.
+    If a group fails, its rows are retried one by one so a single bad row only
+    fails its own request.
+    """
+    def __init__(self, window: float = GROUP_COMMIT_WINDOW_SECONDS, max_rows: int = GROUP_COMMIT_MAX_ROWS):
+        self.window = window
+        self.max_rows = max_rows
+        self._pending: List[PendingRow] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._stopping
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def add(self, row):
+        """Queues `row` for the next group commit and returns it once committed, with its id set."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((row, future, time.perf_counter()))
+        self._wakeup.set()
+        if len(self._pending) >= self.max_rows:
+            self._full.set()
+        return await future
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Commits whatever is still queued, then stops."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if not self._pending:
+                if self._stopping:
+                    return
+                self._wakeup.clear()
+                continue
+            # Let concurrent requests join, unless the group is full or has already waited long enough
+            delay = self.window - (time.perf_counter() - self._pending[0][2])
+            if delay > 0 and len(self._pending) < self.max_rows and not self._stopping:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            batch, self._pending = self._pending[:self.max_rows], self._pending[self.max_rows:]
+            if len(self._pending) < self.max_rows:
+                self._full.clear()
+            try:
+                await self._commit(batch)
+            except Exception:
+                logger.exception("Group commit of %d rows failed", len(batch))
+
+    async def _commit(self, batch: List[PendingRow]):
+        try:
+            await self._insert([row for row, _, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                self._resolve(batch, error=e)
+                return
+            logger.warning("Group commit of %d rows failed; retrying them one at a time", len(batch), exc_info=True)
+            for pending in batch:
+                try:
+                    await self._insert([self._fresh(pending[0])])
+                except Exception as row_error:
+                    self._resolve([pending], error=row_error)
+                else:
+                    self._resolve([pending])
+            return
+        metrics.GROUP_COMMIT_ROWS.observe(len(batch))
+        self._resolve(batch)
+
+    @staticmethod
+    def _fresh(row):
+        """
+        `row` as it was before the failed group: transient, with no id. An id that a
+        rolled-back INSERT handed out may since have gone to someone else's row.
+        """
+        make_transient(row)
+        for column in inspect(row).mapper.primary_key:
+            setattr(row, column.key, None)
+        return row
+
+    @staticmethod
+    async def _insert(rows: list):
+        async with database.AsyncWriteSessionLocal() as db:
+            await db.run_sync(crud.insert_rows, rows)
+
+    @staticmethod
+    def _resolve(batch: List[PendingRow], error: Optional[BaseException] = None):
+        now = time.perf_counter()
+        for row, future, enqueued_at in batch:
+            if future.done():
+                continue # the request went away; the row is stored all the same
+            if error is not None:
+                future.set_exception(error)
+            else:
+                metrics.GROUP_COMMIT_WAIT.observe(now - enqueued_at)
+                future.set_result(row)
+
+
+# Create a single global writer to be shared across the application
+group_commit_writer = GroupCommitWriter()
+metrics.GROUP_COMMIT_PENDING.set_function(group_commit_writer.pending)
+
+
+# --- Drop-in replacements for the crud inserts, used by the endpoints ---
+async def create_journal_entry_async(db, entry: models.JournalEntryCreate, analysis_result: dict):
+    if not group_commit_writer.running:
+        return await crud.create_journal_entry_async(db, entry, analysis_result)
+    return await group_commit_writer.add(crud.build_journal_entry(entry, analysis_result))
+
+async def create_symptom_report_async(db, description: str, result: dict, photo_path: str = None, user_id: int = 1):
+    if not group_commit_writer.running:
+        return await crud.create_symptom_report_async(db, description, result, photo_path, user_id)
+    return await group_commit_writer.add(crud.build_symptom_report(description, result, photo_path, user_id))
@@ -1,3 +1,22 @@
+# --- Weights for Each Health Pillar ---
+# This reflects the clinical importance of each data point.
+WEIGHTS = {
+    "hrv": 0.20,           # 20% contribution from physiological stress
+    "sentiment": 0.15,     # 15% contribution from emotional state
+    "symptoms": 0.25,      # 25% contribution from reported physical symptoms
+    "clinical": 0.40       # 40% contribution from hard clinical data
+}
+
+# --- Plain-English insights, from best to worst ---
+# A score above 85 maps to bucket 0, above 65 to bucket 1, above 40 to bucket 2, otherwise bucket 3.
+INSIGHTS = [
+    "Showing excellent signs of positive progress. All metrics are trending strongly in the right direction.",
+    "Steady positive progress. Your physiological and emotional well-being are well-aligned with recovery.",
+    "Maintaining a stable condition. Focus on consistency in self-care and symptom management.",
+    "Multiple metrics indicate a high level of body and mind stress. This is a key time to focus on rest and consult your care team.",
+]
+
+
 def calculate_progress_score(state: dict) -> dict:
     """
     Calculates a "Treatment Progress Score" (from 0 to 100) by analyzing a 
@@ -30,34 +49,87 @@ def calculate_progress_score(state: dict) -> dict:
     else:
         biomarker_score = 100
 
-    # --- Step 2: Define Weights for Each Health Pillar ---
-    # This reflects the clinical importance of each data point.
-    weights = {
-        "hrv": 0.20,           # 20% contribution from physiological stress
-        "sentiment": 0.15,     # 15% contribution from emotional state
-        "symptoms": 0.25,      # 25% contribution from reported physical symptoms
-        "clinical": 0.40       # 40% contribution from hard clinical data
-    }
-    
-    # --- Step 3: Calculate the Final Weighted "Treatment Progress Score" ---
+    # --- Step 2: Calculate the Final Weighted "Treatment Progress Score" ---
     final_score = (
-        hrv_score * weights["hrv"] +
-        sentiment_score * weights["sentiment"] +
-        symptom_score * weights["symptoms"] +
-        biomarker_score * weights["clinical"]
+        hrv_score * WEIGHTS["hrv"] +
+        sentiment_score * WEIGHTS["sentiment"] +
+        symptom_score * WEIGHTS["symptoms"] +
+        biomarker_score * WEIGHTS["clinical"]
     )
     # Ensure the final score is always between 0 and 100.
     final_score = max(0, min(100, final_score))
     
-    # --- Step 4: Generate a Plain-English Insight Based on the Score ---
+    # --- Step 3: Generate a Plain-English Insight Based on the Score ---
     insight = ""
     if final_score > 85:
-        insight = "Showing excellent signs of positive progress. All metrics are trending strongly in the right direction."
+        insight = INSIGHTS[0]
     elif final_score > 65:
-        insight = "Steady positive progress. Your physiological and emotional well-being are well-aligned with recovery."
+        insight = INSIGHTS[1]
     elif final_score > 40:
-        insight = "Maintaining a stable condition. Focus on consistency in self-care and symptom management."
+        insight = INSIGHTS[2]
     else:
-        insight = "Multiple metrics indicate a high level of body and mind stress. This is a key time to focus on rest and consult your care team."
+        insight = INSIGHTS[3]
         
-    return {"progress_score": final_score, "insight": insight}
\ No newline at end of file
+    return {
+        "progress_score": final_score,
+        "insight": insight,
+        # The normalized pillar scores, kept for the score history
+        "components": {"hrv": hrv_score, "sentiment": sentiment_score,
+                       "symptoms": symptom_score, "clinical": biomarker_score},
+    }
+
+
+def calculate_progress_scores(hrv, sentiment, symptoms, clinical_biomarker) -> dict:
+    """
+    Vectorized version of calculate_progress_score for whole cohorts.
+
+    Takes four equal-length columns (anything NumPy can turn into a float array)
+    and returns a "progress_score" array plus an "insight_bucket" array of indexes
+    into INSIGHTS. Every step mirrors the scalar function operation for operation,
+    so the results are bit-for-bit identical to calling it once per row. A None
+    entry counts as a missing key and takes the scalar function's default; NaN
+    follows the builtin min() and max() the scalar function uses.
+    """
+    # NumPy is only needed for cohort scoring, so the per-patient path never imports it.
+    import numpy as np
+
+    hrv = _column(hrv, 40)
+    sentiment = _column(sentiment, 0.0)
+    symptoms = _column(symptoms, 0.0)
+    clinical_biomarker = _column(clinical_biomarker, 10.0)
+
+    # Python float arithmetic does not warn about inf - inf or overflow, so neither does this.
+    with np.errstate(all="ignore"):
+        # --- Step 1: Normalize Each Metric to a 0-100 Scale ---
+        # fmin/fmax rather than minimum/maximum: like the builtin min(100, x), they
+        # return the bound when x is NaN, where minimum would give NaN.
+        hrv_score = np.fmin(100, (hrv / 50.0) * 100)
+        sentiment_score = (1 - sentiment) * 50
+        symptom_score = 100 - (symptoms * 10)
+        # Safe division: rows with a non-positive biomarker score 100, exactly as in the scalar path.
+        positive = clinical_biomarker > 0
+        ratio = np.divide(2.5, clinical_biomarker, out=np.zeros_like(clinical_biomarker), where=positive)
+        biomarker_score = np.where(positive, np.fmin(100, ratio * 100), 100.0)
+
+        # --- Step 2: Weighted sum, in the same order as the scalar function ---
+        final_score = (
+            hrv_score * WEIGHTS["hrv"] +
+            sentiment_score * WEIGHTS["sentiment"] +
+            symptom_score * WEIGHTS["symptoms"] +
+            biomarker_score * WEIGHTS["clinical"]
+        )
+        final_score = np.fmax(0, np.fmin(100, final_score))
+
+    # --- Step 3: Bucket each score into its insight ---
+    insight_bucket = 3 - (final_score > 40).astype(np.int8) - (final_score > 65) - (final_score > 85)
+
+    return {"progress_score": final_score, "insight_bucket": insight_bucket.astype(np.int8)}
+
+
+def _column(values, default: float):
+    """One input column as float64, with None entries replaced by `default`."""
+    import numpy as np
+    if not isinstance(values, np.ndarray) or values.dtype == object:
+        values = [default if value is None else value for value in values]
+    return np.asarray(values, dtype=np.float64)
+
@@ -0,0 +1,195 @@
+# app/journal_worker.py
+import os
+import asyncio
+import logging
+import datetime
+from dataclasses import dataclass
+from typing import List, Optional
+
+from . import analyzer, crud, database, metrics
+from .state_manager import patient_registry
+from .ws_manager import manager
+
+logger = logging.getLogger(__name__)
+
+# How many workers drain the queue, and how they group entries into micro-batches.
+JOURNAL_WORKERS = int(os.getenv("JOURNAL_WORKERS", "4"))
+JOURNAL_QUEUE_MAX = int(os.getenv("JOURNAL_QUEUE_MAX", "1000"))
+JOURNAL_BATCH_SIZE = int(os.getenv("JOURNAL_BATCH_SIZE", "8"))
+JOURNAL_BATCH_WINDOW_SECONDS = float(os.getenv("JOURNAL_BATCH_WINDOW_MS", "50")) / 1000
+# A failed batch is retried with exponential backoff; after the last attempt its
+# entries stay unanalyzed until the next start picks them up again.
+JOURNAL_RETRY_ATTEMPTS = int(os.getenv("JOURNAL_RETRY_ATTEMPTS", "3"))
+JOURNAL_RETRY_BASE_SECONDS = float(os.getenv("JOURNAL_RETRY_BASE_MS", "500")) / 1000
+# How long shutdown waits for the queue to empty before stopping the workers
+JOURNAL_DRAIN_SECONDS = float(os.getenv("JOURNAL_DRAIN_SECONDS", "10"))
+
+
+@dataclass
+class PendingJournalEntry:
+    entry_id: int
+    user_id: int
+    content: str
+
+
+class JournalAnalysisQueue:
+    """
+    Runs journal analysis off the request path. Entries are stored first and queued
+    here; workers pull them in small batches, analyze each batch concurrently (still
+    bounded by the analyzer's own concurrency limit), write all results in one
+    transaction, and push each result to the patient's dashboard.
+
+    The queue only lives in memory, so the database is the record of what is
+    still pending: an entry without an analysis. Shutdown drains the queue, and
+    start() queues whatever a previous run left unanalyzed. Writing an analysis
+    only fills in entries that are still pending, so an entry that ends up queued
+    twice is counted once.
+    """
+    def __init__(self, workers: int = JOURNAL_WORKERS, max_queued: int = JOURNAL_QUEUE_MAX,
+                 batch_size: int = JOURNAL_BATCH_SIZE, batch_window: float = JOURNAL_BATCH_WINDOW_SECONDS,
+                 retry_attempts: int = JOURNAL_RETRY_ATTEMPTS, retry_base: float = JOURNAL_RETRY_BASE_SECONDS):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.retry_attempts = max(1, retry_attempts)
+        self.retry_base = retry_base
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._recovery: Optional[asyncio.Task] = None
+
+    def start(self, recover: bool = True):
+        """Creates the queue and worker tasks on the running event loop, and requeues unfinished entries."""
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if recover:
+            self._recovery = asyncio.create_task(self.recover(datetime.datetime.utcnow()))
+        logger.info("Journal analysis workers started: %d workers, batches of up to %d.", self.workers, self.batch_size)
+
+    async def stop(self, drain_timeout: float = JOURNAL_DRAIN_SECONDS):
+        """Finishes the queued entries (waiting at most `drain_timeout` seconds), then stops the workers."""
+        if self._recovery is not None:
+            self._recovery.cancel()
+            await asyncio.gather(self._recovery, return_exceptions=True)
+            self._recovery = None
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("%d journal entries were still queued at shutdown; they will be analyzed after the next start.",
+                               self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def recover(self, before: datetime.datetime, page_size: int = 100) -> int:
+        """
+        Queues entries stored before `before` that never got an analysis, e.g.
+        because the process stopped first or their batch kept failing. Keeps half
+        the queue free for new requests. Returns how many were queued.
+        """
+        queued, after_id = 0, 0
+        while True:
+            async with database.AsyncSessionLocal() as db:
+                pending = await crud.get_pending_journal_entries_async(db, before, after_id, page_size)
+            if not pending:
+                break
+            for entry_id, user_id, content in pending:
+                while self._queue.qsize() >= self.max_queued // 2:
+                    await asyncio.sleep(max(self.batch_window, 0.05))
+                self._queue.put_nowait(PendingJournalEntry(entry_id=entry_id, user_id=user_id, content=content))
+            queued += len(pending)
+            after_id = pending[-1][0]
+        if queued:
+            metrics.JOURNAL_RECOVERED.inc(queued)
+            logger.info("Queued %d journal entries left unanalyzed by a previous run.", queued)
+        return queued
+
+    def has_capacity(self) -> bool:
+        return self._queue is not None and not self._queue.full()
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, item: PendingJournalEntry):
+        """Queues an already-stored entry for analysis. Raises asyncio.QueueFull when saturated."""
+        self._queue.put_nowait(item)
+
+    async def _next_batch(self) -> List[PendingJournalEntry]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._process_with_retry(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _process_with_retry(self, batch: List[PendingJournalEntry]):
+        for attempt in range(1, self.retry_attempts + 1):
+            try:
+                await self._process(batch)
+                return
+            except Exception:
+                if attempt == self.retry_attempts:
+                    metrics.JOURNAL_BATCH_FAILURES.labels("abandoned").inc()
+                    logger.exception("Journal analysis batch failed %d times; entries %s stay pending until the next start",
+                                     attempt, [item.entry_id for item in batch])
+                    return
+                metrics.JOURNAL_BATCH_FAILURES.labels("retried").inc()
+                delay = self.retry_base * 2 ** (attempt - 1)
+                logger.warning("Journal analysis batch failed; retry %d in %.2fs", attempt, delay, exc_info=True)
+                await asyncio.sleep(delay)
+
+    async def _process(self, batch: List[PendingJournalEntry]):
+        results = await asyncio.gather(*(analyzer.analyze_journal_entry_async(item.content, item.user_id, priority="background")
+                                       for item in batch))
+        results = [_with_analysis(result) for result in results]
+        # Load each patient before the scores are written, so a rebuild from the
+        # database cannot count the new score a second time.
+        states = [await patient_registry.get_async(item.user_id) for item in batch]
+        async with database.AsyncWriteSessionLocal() as db:
+            updated = set(await crud.update_journal_analyses_async(
+                db, [(item.entry_id, result) for item, result in zip(batch, results)], only_pending=True))
+
+        for item, state, result in zip(batch, states, results):
+            if item.entry_id not in updated:
+                continue # already analyzed, e.g. by an earlier attempt or another worker process
+            state.update_from_journal(result.get("sentiment_score"))
+            await manager.send_to_user(item.user_id, {
+                "type": "journal_analysis",
+                "entry_id": item.entry_id,
+                "ai_analysis": result.get("analysis"),
+                "ai_encouragement": result.get("encouragement"),
+                "sentiment_score": result.get("sentiment_score"),
+                "analysis_source": result.get("analysis_source"),
+            })
+
+
+def _with_analysis(result: dict) -> dict:
+    """
+    Fills in the fallback summary when a model answer has none. An entry without
+    an analysis counts as pending, so writing NULL would requeue it on every start.
+    """
+    if result.get("analysis"):
+        return result
+    return {**result, "analysis": analyzer.JOURNAL_FALLBACK["analysis"]}
+
+
+# Create a single global queue to be shared across the application
+journal_queue = JournalAnalysisQueue()
+metrics.JOURNAL_QUEUE_DEPTH.set_function(journal_queue.depth)
@@ -0,0 +1,145 @@
+# app/local_triage.py
+import re
+import math
+from typing import List, Optional
+
+# A fast, dependency-free first opinion for when Gemini is slow, blocked or down.
+# It answers in well under a millisecond with the same keys the model returns,
+# so callers can use it as a provisional result and swap in the model's answer
+# when (if) it arrives. It is deliberately conservative: it never calls a symptom
+# Mild unless the patient said so, and any red flag makes it Severe.
+
+# --- Journal sentiment ---
+# Word weights on a -4 (distressed) .. +4 (calm/hopeful) scale, VADER style.
+LEXICON = {
+    # Positive / calm / hopeful
+    "hopeful": 2.5, "hope": 1.5, "calm": 2.0, "peaceful": 2.5, "relaxed": 2.0, "rested": 1.5,
+    "grateful": 2.5, "thankful": 2.5, "happy": 2.5, "glad": 2.0, "good": 1.5, "great": 2.5,
+    "better": 1.5, "improving": 2.0, "improved": 2.0, "progress": 1.5, "strong": 1.5, "stronger": 2.0,
+    "energized": 2.0, "energetic": 2.0, "optimistic": 2.5, "confident": 2.0, "proud": 2.0,
+    "relieved": 2.0, "comfortable": 1.5, "enjoyed": 2.0, "enjoy": 1.5, "love": 2.5, "loved": 2.5,
+    "laughed": 2.0, "fine": 0.8, "okay": 0.5, "ok": 0.5, "encouraged": 2.0, "supported": 1.5,
+    # Negative / anxious / distressed
+    "anxious": -2.5, "anxiety": -2.5, "worried": -2.0, "worry": -2.0, "scared": -2.5, "afraid": -2.5,
+    "fear": -2.5, "panic": -3.0, "sad": -2.0, "depressed": -3.0, "hopeless": -3.5, "lonely": -2.0,
+    "tired": -1.5, "exhausted": -2.5, "fatigue": -1.5, "weak": -1.5, "pain": -2.0, "painful": -2.5,
+    "hurt": -2.0, "hurts": -2.0, "sick": -2.0, "nausea": -2.0, "nauseous": -2.0, "worse": -2.0,
+    "bad": -1.5, "terrible": -3.0, "awful": -3.0, "horrible": -3.0, "miserable": -3.0,
+    "overwhelmed": -2.5, "stressed": -2.0, "stress": -1.5, "angry": -2.0, "frustrated": -2.0,
+    "cry": -2.0, "cried": -2.0, "crying": -2.0, "struggling": -2.0, "struggle": -1.5, "dread": -2.5,
+    "insomnia": -1.5, "sleepless": -1.5, "alone": -1.5, "numb": -1.5, "upset": -2.0, "down": -1.0,
+}
+NEGATIONS = {"not", "no", "never", "nothing", "without", "hardly", "barely", "isn't", "wasn't", "don't",
+             "didn't", "doesn't", "can't", "cannot", "couldn't", "won't", "aren't", "nor"}
+INTENSIFIERS = {"very": 1.5, "really": 1.4, "so": 1.3, "extremely": 1.8, "incredibly": 1.7, "totally": 1.5,
+                "completely": 1.5, "quite": 1.2, "slightly": 0.5, "somewhat": 0.6, "little": 0.6, "bit": 0.6}
+# How many following words a negation applies to
+NEGATION_SCOPE = 3
+# VADER's normalization constant: score / sqrt(score^2 + alpha) maps onto (-1, 1)
+NORMALIZATION_ALPHA = 15.0
+
+_WORD = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+# Canned texts by sentiment band, mirroring what the model is asked for
+_JOURNAL_TEXTS = [
+    (-0.5, "The entry sounds calm and hopeful.",
+     "It's wonderful to hear this. Hold on to what helped today."),
+    (-0.1, "The entry sounds mostly positive.",
+     "Thank you for sharing. Small good moments like these add up."),
+    (0.1, "The entry sounds fairly neutral.",
+     "Thank you for sharing. Remember that every step, no matter how small, is part of your journey."),
+    (0.5, "The entry shows some worry or strain.",
+     "It's okay to have hard days. Be gentle with yourself, and reach out if you need support."),
+    (1.01, "The entry shows significant distress.",
+     "You don't have to carry this alone. Please consider talking to your care team or someone you trust."),
+]
+
+
+def sentiment_score(text: str) -> float:
+    """Lexicon sentiment on the app's scale: -1.0 very positive/calm .. 1.0 very negative/distressed."""
+    words = _WORD.findall(text.lower())
+    total = 0.0
+    negate_left = 0
+    boost = 1.0
+    for word in words:
+        if word in NEGATIONS or word.endswith("n't"):
+            negate_left = NEGATION_SCOPE
+            continue
+        if word in INTENSIFIERS:
+            boost *= INTENSIFIERS[word]
+            continue
+        weight = LEXICON.get(word)
+        if weight is not None:
+            if negate_left:
+                # "not happy" is mildly negative, "not worried" mildly positive
+                weight = -weight * 0.75
+            total += weight * boost
+        boost = 1.0
+        negate_left = max(0, negate_left - 1)
+    normalized = total / math.sqrt(total * total + NORMALIZATION_ALPHA)
+    # The lexicon is positive-is-good; the app's scale is the other way round
+    return round(-normalized, 3) + 0.0 # no "-0.0"
+
+
+def analyze_journal(text: str) -> dict:
+    """A provisional journal analysis with the same keys as the model's."""
+    score = sentiment_score(text)
+    for upper, analysis, encouragement in _JOURNAL_TEXTS:
+        if score < upper:
+            break
+    return {"analysis": analysis, "sentiment_score": score, "encouragement": encouragement,
+            "analysis_source": "local"}
+
+
+# --- Symptom triage ---
+# Red flags from the symptom prompt's guidelines: any of these means Severe.
+RED_FLAGS = {
+    "chest pain": r"chest (?:pain|pains|tightness|pressure)|pain in (?:my|the) chest",
+    "difficulty breathing": r"(?:difficulty|trouble|hard|struggling) (?:to )?breath(?:e|ing)|short(?:ness)? of breath"
+                            r"|can(?:no|')t breathe|gasping",
+    "uncontrolled bleeding": r"bleeding (?:that )?(?:won't|will not|doesn't|does not|wont) stop|uncontrolled bleeding"
+                             r"|heavy bleeding|bleeding heavily|soaked (?:through )?(?:the )?(?:bandage|dressing)",
+    "coughing or vomiting blood": r"(?:cough(?:ing|ed)?|vomit(?:ing|ed)?|throw(?:ing)? up) (?:up )?blood",
+    "signs of infection": r"\bpus\b|red streaks?|oozing|foul[- ]smelling",
+    "fainting": r"faint(?:ed|ing)?|passed out|blacked out|unconscious|lost consciousness",
+    "confusion or stroke signs": r"confus(?:ed|ion)|slurred speech|face (?:is )?droop|numb(?:ness)? on one side"
+                                 r"|can't move (?:my )?(?:arm|leg)",
+    "seizure": r"seizure|convuls",
+    "high fever": r"fever (?:of |over |above )?(?:10[2-9]|39\.[5-9]|4[0-2])|(?:10[2-9]|39\.[5-9]|4[0-2])(?:\.\d)? ?(?:degrees?|°|f\b|c\b)",
+    "severe pain": r"(?:severe|unbearable|excruciating|worst) (?:\w+ )?(?:pain|headache)",
+    "self-harm": r"suicid|kill myself|end my life|hurt myself",
+}
+# Only the patient's own words make a symptom Mild; everything else is Moderate
+MILD_CUES = r"\b(?:mild|slight|slightly|minor|a little|a bit|small)\b"
+_NEGATED = re.compile(r"\b(?:no|not|without|denies|never|don't have|do not have)\s+(?:\w+\s+){0,2}$")
+
+_RED_FLAG_PATTERNS = {name: re.compile(pattern) for name, pattern in RED_FLAGS.items()}
+_MILD_PATTERN = re.compile(MILD_CUES)
+
+
+def _matches(pattern: re.Pattern, text: str) -> bool:
+    """True if the pattern occurs anywhere in `text` without a negation just before it ("no chest pain")."""
+    return any(not _NEGATED.search(text[:match.start()]) for match in pattern.finditer(text))
+
+
+def red_flags(description: str) -> List[str]:
+    """The names of the red flags in a symptom description."""
+    text = description.lower()
+    return [name for name, pattern in _RED_FLAG_PATTERNS.items() if _matches(pattern, text)]
+
+
+def triage_symptom(description: str, flags: Optional[List[str]] = None) -> dict:
+    """A provisional symptom triage with the same keys as the model's."""
+    text = description.lower()
+    flags = red_flags(description) if flags is None else flags
+    if flags:
+        severity = "Severe"
+        advice = (f"Your description mentions {', '.join(flags)}. Please seek immediate medical attention "
+                  "or call your local emergency number.")
+    elif _matches(_MILD_PATTERN, text):
+        severity = "Mild"
+        advice = "Rest and keep an eye on it. Let your care team know if it gets worse or does not improve."
+    else:
+        severity = "Moderate"
+        advice = "Keep monitoring this symptom and contact your care team, especially if it worsens or persists."
+    return {"severity": severity, "advice": advice, "red_flags": flags, "analysis_source": "local"}
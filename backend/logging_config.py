@@ -0,0 +1,39 @@
+# app/logging_config.py
+import os
+import sys
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Optional
+
+# LOG_LEVEL=DEBUG also shows the per-update state messages, which are too chatty for production.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging():
+    """
+    Routes all log records through a queue. Request handlers and the event loop only
+    enqueue the record; a background thread does the formatting and the write to
+    stderr, so a slow terminal or log collector never blocks a request.
+    Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(_listener.stop)
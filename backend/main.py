@@ -1,60 +1,263 @@
+import os
+import json
 import asyncio
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import logging
+import threading
+import datetime
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Set, Tuple
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+# Logging goes through a background thread; set it up before anything logs
+from .logging_config import configure_logging
+configure_logging()
 
 # Import all our custom backend modules
-from .database import create_db_and_tables
-from .api import router as api_router
-from .ws_manager import manager
-from .state_manager import patient_state
+from .database import create_db_and_tables, bind_write_loop
+from . import crud, models, timeseries, metrics, analyzer, media
+from .api import router as api_router, get_async_write_db
+from .ws_manager import manager, patient_topic
+from .state_manager import patient_registry, change_notifier, PATIENT_WARM_START
+from .journal_worker import journal_queue
+from .backplane import backplane
+from .score_history import score_history
+from .group_commit import group_commit_writer, GROUP_COMMIT_ENABLED
 from .insight_engine import calculate_progress_score # <-- The new "brain"
 
-# This line creates the database and tables if they don't exist
-create_db_and_tables()
+logger = logging.getLogger(__name__)
 
 # This is the Pydantic model for the data packet we expect from our
 # conceptual companion mobile app (which uses Health Connect / HealthKit).
 class HealthConnectData(BaseModel):
     hrv: int
+    user_id: int = 1
     # You could add more real data points here in the future
     # heart_rate: int
     # sleep_hours: float
 
+# Broadcast tuning. Changes are coalesced for a short window, and every dashboard
+# gets a full packet at a low heartbeat rate even when nothing has changed.
+BROADCAST_COALESCE_SECONDS = float(os.getenv("BROADCAST_COALESCE_MS", "100")) / 1000
+BROADCAST_HEARTBEAT_SECONDS = float(os.getenv("BROADCAST_HEARTBEAT_SECONDS", "30"))
+# Send only the fields that changed. Off by default: the dashboard expects full packets.
+BROADCAST_DELTAS = os.getenv("BROADCAST_DELTAS", "false").lower() in ("1", "true", "yes")
+
+def build_data_packet(current_state: dict, analysis: Optional[dict] = None) -> dict:
+    """Feeds a patient's state into the insight engine and builds the dashboard packet."""
+    if analysis is None:
+        analysis = calculate_progress_score(current_state)
+    return {
+        "progress_score": analysis["progress_score"],
+        "insight": analysis["insight"],
+        # Also pass the raw data points for display on the dashboard
+        "hrv": current_state["hrv"],
+        "avg_sentiment": current_state["sentiment"],
+        "symptom_score": current_state["symptoms"],
+        "clinical_biomarker": current_state["clinical_biomarker"]
+    }
+
+async def _score_patient(user_id: int) -> Tuple[dict, dict]:
+    """Scores one patient's current state. Returns (current_state, analysis)."""
+    # Get the latest state for this patient, rebuilding it off the event loop if needed
+    state = await patient_registry.get_async(user_id)
+    current_state = state.get_current_state()
+    return current_state, calculate_progress_score(current_state)
+
+async def _record_scores(dirty: Set[int]) -> Dict[int, Tuple[dict, dict]]:
+    """
+    Scores every patient whose state changed and keeps the score for the trend
+    history, whether or not a dashboard is watching. Returns the scores by user_id,
+    so the broadcast does not compute them again.
+    """
+    scored = {}
+    for user_id in dirty:
+        try:
+            scored[user_id] = await _score_patient(user_id)
+            await score_history.record_async(user_id, scored[user_id][1])
+        except Exception:
+            logger.exception("Could not score or record the progress score for user %s", user_id)
+    return scored
+
+async def _broadcast_patient(user_id: int, last_sent: Dict[int, dict], full: bool,
+                             scored: Optional[Tuple[dict, dict]] = None):
+    """Sends one patient's dashboard a packet if it differs from the last one. Scores them unless `scored` is given."""
+    current_state, analysis = scored or await _score_patient(user_id)
+    # Compare against what this patient's dashboard last received
+    data_packet = build_data_packet(current_state, analysis)
+    previous = last_sent.get(user_id)
+    last_sent[user_id] = data_packet
+    if full or previous is None:
+        await manager.send_to_user(user_id, data_packet)
+        metrics.LOOP_PACKETS.labels("full").inc()
+    elif data_packet != previous:
+        if BROADCAST_DELTAS:
+            delta = {key: value for key, value in data_packet.items() if previous.get(key) != value}
+            await manager.send_to_user(user_id, {"type": "delta", **delta})
+            metrics.LOOP_PACKETS.labels("delta").inc()
+        else:
+            await manager.send_to_user(user_id, data_packet)
+            metrics.LOOP_PACKETS.labels("full").inc()
+
 # This is the main background task that runs the insight engine
 async def data_processing_loop():
     """
-    The main engine loop. It periodically gets the current holistic patient state,
-    calculates the "Treatment Progress Score", and broadcasts the full
-    analysis to the web dashboard.
+    The main engine loop. It sleeps until a patient's state changes (or the
+    heartbeat is due), re-scores the patients that changed and records their
+    scores, and sends a packet to the dashboards connected to them only when
+    something is different from what those subscribers last received.
     """
+    loop = asyncio.get_running_loop()
+    change_notifier.bind(loop)
+    last_sent: Dict[int, dict] = {}
+    # A newly elected leader refreshes every dashboard as soon as the other workers
+    # have announced what their dashboards follow.
+    first_heartbeat = backplane.announce_seconds if backplane.multi_worker else BROADCAST_HEARTBEAT_SECONDS
+    next_heartbeat = loop.time() + min(first_heartbeat, BROADCAST_HEARTBEAT_SECONDS)
+
     while True:
-        # 1. Get the latest state from our central manager
-        current_state = patient_state.get_current_state()
-        
-        # 2. Feed the state into our insight engine to get the analysis
-        analysis = calculate_progress_score(current_state)
-        
-        # 3. Prepare the rich data packet to send to the frontend dashboard
-        data_packet = {
-            "progress_score": analysis["progress_score"],
-            "insight": analysis["insight"],
-            # Also pass the raw data points for display on the dashboard
-            "hrv": current_state["hrv"],
-            "avg_sentiment": current_state["sentiment"],
-            "symptom_score": current_state["symptoms"],
-            "clinical_biomarker": current_state["clinical_biomarker"]
-        }
-        print(f"DEBUG: Broadcasting data packet: {data_packet}")
-        # 4. Broadcast the new data packet to all connected dashboard clients
-        await manager.broadcast(data_packet)
-        
-        # 5. Wait for 2 seconds before the next cycle
-        await asyncio.sleep(2)
+        # 1. Sleep until something changes or the heartbeat is due
+        wake_at = next_heartbeat
+        changed = await change_notifier.wait(timeout=max(0.0, next_heartbeat - loop.time()))
+        if changed:
+            wake_at = loop.time()
+            if BROADCAST_COALESCE_SECONDS > 0:
+                # Let a burst of updates settle so they go out as one packet
+                wake_at += BROADCAST_COALESCE_SECONDS
+                await asyncio.sleep(BROADCAST_COALESCE_SECONDS)
+        tick_started = loop.time()
+        # A busy event loop shows up here as a late wake-up
+        metrics.LOOP_DRIFT_SECONDS.observe(max(0.0, tick_started - wake_at))
+        dirty, forced = change_notifier.drain()
+        scored = await _record_scores(dirty)
+
+        heartbeat = loop.time() >= next_heartbeat
+        if heartbeat:
+            next_heartbeat = loop.time() + BROADCAST_HEARTBEAT_SECONDS
+
+        # A failure must never end the loop: dashboards would silently stop updating
+        try:
+            # Dashboards may be connected to any worker
+            subscribed = backplane.subscribed_user_ids(manager.subscribed_user_ids())
+        except Exception:
+            logger.exception("Could not list subscribed patients; skipping this broadcast tick")
+            continue
+        targets = subscribed if heartbeat else [user_id for user_id in subscribed if user_id in dirty]
+        for user_id in targets:
+            try:
+                await _broadcast_patient(user_id, last_sent, full=heartbeat or user_id in forced,
+                                         scored=scored.get(user_id))
+            except Exception:
+                # Sent again on the next change or heartbeat
+                last_sent.pop(user_id, None)
+                logger.exception("Could not score or send the dashboard update for user %s", user_id)
+
+        # Forget patients whose dashboards have all disconnected
+        if heartbeat:
+            for user_id in set(last_sent) - set(subscribed):
+                del last_sent[user_id]
+
+        metrics.LOOP_TICK_SECONDS.observe(loop.time() - tick_started)
+
+
+# --- Multi-worker coordination ---
+# Only the worker holding the leader lease scores and broadcasts; see backplane.py.
+_scoring_task: Optional[asyncio.Task] = None
+
+def _on_scoring_task_done(task: asyncio.Task):
+    # The loop catches its own errors, so this is a bug worth shouting about
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("The broadcast loop stopped; dashboards will not update", exc_info=task.exception())
+
+def on_leadership_change(is_leader: bool):
+    global _scoring_task
+    if is_leader:
+        if backplane.multi_worker:
+            # What this worker has in memory only reflects the events it happened to see
+            patient_registry.clear()
+        _scoring_task = asyncio.create_task(data_processing_loop())
+        _scoring_task.add_done_callback(_on_scoring_task_done)
+    elif _scoring_task is not None:
+        _scoring_task.cancel()
+        _scoring_task = None
+
+async def on_backplane_event(event: dict):
+    if event["type"] == "state":
+        await patient_registry.apply_remote_event(event, load=backplane.is_leader)
+    elif event["type"] == "refresh" and backplane.is_leader:
+        change_notifier.mark_dirty(event["user_id"], force=True)
+
+def request_full_packet(user_id: int):
+    """Asks the scoring leader, wherever it runs, to send this patient's dashboards a full packet."""
+    if backplane.is_leader:
+        change_notifier.mark_dirty(user_id, force=True)
+    else:
+        backplane.publish_event({"type": "refresh", "user_id": user_id})
+
+
+# --- Startup and Shutdown ---
+def _on_warm_start_done(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Patient warm start failed; patients load on their first request instead",
+                     exc_info=task.exception())
+    elif not task.cancelled():
+        logger.info("Warm start loaded %d patients.", task.result())
+
+# Nothing here runs at import time, so importing the app (tests, tooling, each
+# worker process) stays fast; see benchmarks/import_budget.py.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create the database and tables if they don't exist
+    await asyncio.to_thread(create_db_and_tables)
+    # Background writers in worker threads send their writes through this loop's single writer
+    bind_write_loop(asyncio.get_running_loop())
+    # Join the other workers. The data processing engine starts on whichever worker is elected leader.
+    backplane.on_event = on_backplane_event
+    backplane.on_leadership = on_leadership_change
+    backplane.local_user_ids = manager.subscribed_user_ids
+    await backplane.start()
+    # Start the workers that analyze journal entries submitted in background mode
+    journal_queue.start()
+    # Share one transaction between concurrent journal and symptom inserts, if configured
+    if GROUP_COMMIT_ENABLED:
+        group_commit_writer.start()
+    # Persist patient state changes, and preload recently active patients without delaying startup
+    patient_registry.start_persistence()
+    score_history.start()
+    # The warm start runs in a worker thread, so stopping it means asking it to stop and waiting
+    warm_start_stop = threading.Event()
+    warm_start_task = None
+    if PATIENT_WARM_START > 0:
+        warm_start_task = asyncio.create_task(
+            asyncio.to_thread(patient_registry.warm_start, PATIENT_WARM_START, warm_start_stop))
+        warm_start_task.add_done_callback(_on_warm_start_done)
+    # Load the Gemini SDK in the background so the first analysis does not pay for it
+    warm_up_task = asyncio.create_task(analyzer.warm_up())
+
+    yield
+
+    warm_up_task.cancel()
+    if warm_start_task is not None:
+        # Before the writers stop: loading a patient may write its first snapshot
+        warm_start_stop.set()
+        await asyncio.gather(warm_start_task, return_exceptions=True)
+    await journal_queue.stop()
+    await group_commit_writer.stop()
+    # Write out buffered state changes and snapshot them, so the next start replays almost nothing
+    await patient_registry.stop_persistence()
+    await score_history.stop()
+    await backplane.stop()
+    bind_write_loop(None)
 
 
 # --- FastAPI App Setup ---
-app = FastAPI(title="CareCompanion API", version="2.0-beta")
+app = FastAPI(title="CareCompanion API", version="2.0-beta", lifespan=lifespan)
+
+# Refuse oversized photo uploads before their body is spooled (added first, so CORS wraps the 413)
+app.add_middleware(media.UploadSizeLimit, paths=("/api/symptom-analysis",))
 
 # Add CORS middleware to allow the frontend to connect
 app.add_middleware(
@@ -63,35 +266,73 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the browser read the journal pagination cursor
+    expose_headers=["X-Next-Cursor"],
 )
 
-@app.on_event("startup")
-async def startup_event():
-    # Start the data processing engine in the background when the server starts
-    asyncio.create_task(data_processing_loop())
-
 # --- API Endpoints ---
 
+# Prometheus scrape target
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # This is the new, primary endpoint for receiving real data from the mobile app
 @app.post("/api/health-connect-data")
-def update_health_data(data: HealthConnectData):
+async def update_health_data(data: HealthConnectData, db: AsyncSession = Depends(get_async_write_db)):
     """
     This endpoint receives real data from the patient's companion mobile app.
     It's the bridge between the wearable's data and our system.
     """
-    patient_state.update_from_mobile_app(data.model_dump())
+    await crud.ingest_timeseries_samples_async(db, data.user_id, [("hrv", datetime.datetime.utcnow(), float(data.hrv))])
+    (await patient_registry.get_async(data.user_id)).update_from_mobile_app(data.model_dump())
     return {"status": "data received and state updated"}
 
+# Batched variant: the phone uploads everything it has buffered in one request
+@app.post("/api/health-connect-data/batch", response_model=models.WearableBatchResponse)
+async def ingest_health_data_batch(batch: models.WearableBatch, db: AsyncSession = Depends(get_async_write_db)):
+    """
+    Stores an array of timestamped samples and updates the rollups in one
+    transaction. A retried upload with the same idempotency_key is acknowledged
+    without being stored again.
+    """
+    samples = [(s.metric, timeseries.to_naive_utc(s.timestamp), s.value) for s in batch.samples]
+    accepted, sample_count = await crud.ingest_timeseries_samples_async(db, batch.user_id, samples, idempotency_key=batch.idempotency_key)
+
+    # The live state only tracks the most recent HRV reading
+    hrv_samples = [sample for sample in samples if sample[0] == "hrv"]
+    if accepted and hrv_samples:
+        latest = max(hrv_samples, key=lambda sample: sample[1])
+        (await patient_registry.get_async(batch.user_id)).update_from_mobile_app({"hrv": latest[2]})
+
+    return models.WearableBatchResponse(status="accepted" if accepted else "duplicate", sample_count=sample_count)
+
 # Include all the other routes from api.py (for journal, symptoms, clinical data)
 app.include_router(api_router, prefix="/api")
 
 # This is the WebSocket that our web dashboard connects to
 @app.websocket("/api/ws/health-data")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, user_id: int = 1):
+    await manager.connect(websocket, user_id)
+    # Make sure the new dashboard gets a full packet right away
+    request_full_packet(user_id)
     try:
         while True:
-            # Keep the connection alive
-            await websocket.receive_text()
+            # Keep the connection alive. Clients may also follow more patients by sending
+            # {"subscribe": <user_id>} or {"unsubscribe": <user_id>}.
+            message = await websocket.receive_text()
+            try:
+                command = json.loads(message)
+            except ValueError:
+                continue
+            if not isinstance(command, dict):
+                continue
+            if isinstance(command.get("subscribe"), int):
+                manager.subscribe(websocket, patient_topic(command["subscribe"]))
+                request_full_packet(command["subscribe"])
+            if isinstance(command.get("unsubscribe"), int):
+                manager.unsubscribe(websocket, patient_topic(command["unsubscribe"]))
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
\ No newline at end of file
@@ -0,0 +1,247 @@
+# app/media.py
+import os
+import uuid
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from fastapi import UploadFile
+from starlette.responses import JSONResponse
+
+# Where uploaded photos live. Files are named by the SHA-256 of their content, so
+# a photo uploaded twice is stored once.
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "./media")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+# The whole upload request: the photo plus the other form fields and multipart framing
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(MAX_UPLOAD_BYTES + 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+# The model does not need a 12-megapixel photo; this bounds the copy we send it.
+MODEL_IMAGE_MAX_PX = int(os.getenv("MODEL_IMAGE_MAX_PX", "1536"))
+THUMBNAIL_PX = int(os.getenv("THUMBNAIL_PX", "256"))
+# Checked from the header before anything is decoded: a small, highly compressible
+# file can still expand to gigabytes of pixels. 50 MP covers current phone cameras.
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+class UnsupportedImageType(Exception):
+    pass
+
+
+# --- Request size guard ---
+class UploadSizeLimit:
+    """
+    ASGI middleware that answers 413 for an upload request over `max_bytes` before
+    the form is parsed. Starlette spools a multipart body to disk before the
+    endpoint runs, so the check in store_upload alone would come after the whole
+    body was received. A declared Content-Length is checked up front; a chunked
+    body is counted as it arrives and cut off once it passes the limit.
+    """
+    def __init__(self, app, paths: Tuple[str, ...], max_bytes: int = MAX_UPLOAD_REQUEST_BYTES):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        too_large = False
+        response_started = False
+
+        async def counting_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    too_large = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if too_large and not response_started:
+                return # the app's answer to the cut-off body (FastAPI makes it a 400); ours goes out instead
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, guarded_send)
+        except Exception:
+            if not too_large or response_started:
+                raise
+        if too_large and not response_started:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        limit_mb = MAX_UPLOAD_BYTES // (1024 * 1024)
+        response = JSONResponse({"detail": f"Photos must be smaller than {limit_mb} MB."}, status_code=413,
+                                headers={"Connection": "close"})
+        await response(scope, receive, send)
+
+
+@dataclass
+class StoredImage:
+    digest: str
+    path: str # Relative to MEDIA_ROOT; this is what gets persisted
+    mime_type: str
+    size: int
+    model_path: str # Bounded-resolution copy sent to the model
+    model_mime_type: str
+    thumbnail_path: Optional[str] # None when the format cannot be decoded here
+
+
+def detect_image_type(header: bytes) -> Optional[Tuple[str, str]]:
+    """Identifies an image from its magic bytes. Returns (mime_type, extension) or None."""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg", "jpg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png", "png"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif", "gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp", "webp"
+    if header[4:8] == b"ftyp" and header[8:12] in (b"heic", b"heix", b"hevc", b"mif1", b"msf1"):
+        return "image/heic", "heic"
+    return None
+
+
+def absolute_path(relative_path: str) -> str:
+    return os.path.join(MEDIA_ROOT, relative_path)
+
+
+def thumbnail_relative_path(digest: str) -> str:
+    return os.path.join(digest[:2], f"{digest}_thumb.jpg")
+
+
+async def store_upload(upload: UploadFile) -> StoredImage:
+    """
+    Copies an upload to content-addressed storage in fixed-size chunks, so a large
+    photo is never held in memory, then builds the model copy and thumbnail.
+    Raises UploadTooLarge (also for more than MAX_IMAGE_PIXELS) or UnsupportedImageType.
+    """
+    tmp_dir = os.path.join(MEDIA_ROOT, "tmp")
+    await asyncio.to_thread(os.makedirs, tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+
+    digest = hashlib.sha256()
+    size = 0
+    image_type = None
+    try:
+        with open(tmp_path, "wb") as tmp_file:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                if image_type is None:
+                    image_type = detect_image_type(chunk[:16])
+                    if image_type is None:
+                        raise UnsupportedImageType("Only JPEG, PNG, GIF, WebP and HEIC photos are supported.")
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadTooLarge(f"Photos must be smaller than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+                digest.update(chunk)
+                await asyncio.to_thread(tmp_file.write, chunk)
+        if image_type is None:
+            raise UnsupportedImageType("The uploaded photo is empty.")
+
+        hex_digest = digest.hexdigest()
+        mime_type, extension = image_type
+        relative_path = os.path.join(hex_digest[:2], f"{hex_digest}.{extension}")
+        await asyncio.to_thread(_move_into_place, tmp_path, absolute_path(relative_path))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # Decoding and resizing are CPU-bound, so they run off the event loop.
+    try:
+        model_path, model_mime_type, thumbnail_path = await asyncio.to_thread(
+            _make_derivatives, relative_path, hex_digest, mime_type
+        )
+    except UploadTooLarge:
+        # Nothing refers to a rejected photo; the same content is rejected again next time
+        await asyncio.to_thread(_remove_if_exists, absolute_path(relative_path))
+        raise
+    return StoredImage(hex_digest, relative_path, mime_type, size, model_path, model_mime_type, thumbnail_path)
+
+
+async def read_model_image(image: StoredImage) -> bytes:
+    """Loads the bounded-resolution copy that goes to the model."""
+    return await asyncio.to_thread(_read_bytes, absolute_path(image.model_path))
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _remove_if_exists(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _move_into_place(tmp_path: str, final_path: str):
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    if os.path.exists(final_path):
+        # Same content was uploaded before; keep the existing file.
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, final_path)
+
+
+def _make_derivatives(relative_path: str, digest: str, mime_type: str) -> Tuple[str, str, Optional[str]]:
+    """
+    Writes a JPEG bounded to MODEL_IMAGE_MAX_PX and a THUMBNAIL_PX thumbnail next to
+    the original. Both are skipped if they already exist. If the format cannot be
+    decoded here (e.g. HEIC without a plugin) the original is used for the model.
+    Raises UploadTooLarge for images over MAX_IMAGE_PIXELS.
+    """
+    # Pillow is only needed when a photo is uploaded, so it is imported on first use.
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    model_path = os.path.join(digest[:2], f"{digest}_model.jpg")
+    thumbnail_path = thumbnail_relative_path(digest)
+    if os.path.exists(absolute_path(model_path)) and os.path.exists(absolute_path(thumbnail_path)):
+        return model_path, "image/jpeg", thumbnail_path
+
+    too_large = UploadTooLarge(f"Photos must be at most {MAX_IMAGE_PIXELS // 1_000_000} megapixels.")
+    try:
+        with Image.open(absolute_path(relative_path)) as original:
+            # Opening only reads the header, so the size is known before any decoding
+            width, height = original.size
+            if width * height > MAX_IMAGE_PIXELS:
+                raise too_large
+            # Reduce before converting: a JPEG is decoded straight at a smaller scale
+            # (draft mode; a no-op for other formats), other formats are decoded once
+            # and shrunk in place, so at most one full-resolution buffer exists
+            original.draft("RGB", (MODEL_IMAGE_MAX_PX, MODEL_IMAGE_MAX_PX))
+            original.thumbnail((MODEL_IMAGE_MAX_PX, MODEL_IMAGE_MAX_PX))
+            image = ImageOps.exif_transpose(original).convert("RGB")
+    except Image.DecompressionBombError:
+        # Pillow's own limit; not an OSError, so it needs its own clause
+        raise too_large
+    except (UnidentifiedImageError, OSError):
+        return relative_path, mime_type, None
+
+    _save_jpeg(image, model_path, quality=85)
+    # The thumbnail comes from the model copy, not from another full-size image
+    image.thumbnail((THUMBNAIL_PX, THUMBNAIL_PX))
+    _save_jpeg(image, thumbnail_path, quality=80)
+    return model_path, "image/jpeg", thumbnail_path
+
+
+def _save_jpeg(image, relative_path: str, quality: int):
+    # Write then rename, so a concurrent upload of the same photo never sees a partial file.
+    final_path = absolute_path(relative_path)
+    tmp_path = f"{final_path}.{uuid.uuid4().hex}.tmp"
+    image.save(tmp_path, "JPEG", quality=quality)
+    os.replace(tmp_path, final_path)
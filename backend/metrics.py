@@ -0,0 +1,120 @@
+# app/metrics.py
+import time
+import functools
+from prometheus_client import Counter, Gauge, Histogram
+
+# Every Prometheus metric the service exports lives here, so /metrics is documented
+# in one place. Gauges that read live values are wired up next to the object they
+# describe (e.g. the socket count in ws_manager.py).
+
+# Buckets in seconds, from sub-millisecond DB calls up to a timed-out model request.
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+MODEL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0)
+
+# --- Analyzer ---
+ANALYZER_LATENCY = Histogram(
+    "care_analyzer_latency_seconds", "Round-trip time of one Gemini call.",
+    ["model", "outcome"], buckets=MODEL_BUCKETS,
+)
+ANALYZER_REQUESTS = Counter(
+    "care_analyzer_requests_total", "Gemini calls by model and outcome (ok, blocked, parse_error, timeout, fallback).",
+    ["model", "outcome"],
+)
+ANALYZER_HEDGES = Counter(
+    "care_analyzer_hedge_total", "Hedged analyses by how they were answered: model (within budget), "
+    "local (model failed) or provisional (local now, model later).",
+    ["model", "outcome"],
+)
+ANALYZER_FIRST_TEXT = Histogram(
+    "care_analyzer_first_text_seconds", "Time from starting a streamed journal analysis to its first encouragement text.",
+    ["source"], buckets=MODEL_BUCKETS,
+)
+
+# --- Model scheduler ---
+QUEUE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MODEL_QUEUE_WAIT = Histogram(
+    "care_model_queue_wait_seconds", "Time a model call waited for admission, by priority class.",
+    ["priority"], buckets=QUEUE_BUCKETS,
+)
+MODEL_SHED = Counter(
+    "care_model_shed_total", "Model calls not made, by priority class and reason "
+    "(user_rate, queue_full, displaced, queue_timeout).",
+    ["priority", "reason"],
+)
+MODEL_RETRIES = Counter("care_model_retries_total", "Model calls retried after a rate-limit error.", ["model"])
+MODEL_QUEUE_DEPTH = Gauge("care_model_queue_depth", "Model calls waiting for admission.")
+MODEL_IN_FLIGHT = Gauge("care_model_in_flight", "Model calls currently running.")
+
+# --- Database ---
+DB_QUERY_LATENCY = Histogram(
+    "care_db_query_seconds", "Time spent in each crud function.",
+    ["function"], buckets=FAST_BUCKETS,
+)
+GROUP_COMMIT_ROWS = Histogram(
+    "care_group_commit_rows", "Rows written per group-commit transaction.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+GROUP_COMMIT_WAIT = Histogram(
+    "care_group_commit_wait_seconds", "Time from handing a row to the group-commit writer until it was committed.",
+    buckets=FAST_BUCKETS,
+)
+GROUP_COMMIT_PENDING = Gauge("care_group_commit_pending", "Rows waiting for the next group commit.")
+EXPORT_ROWS = Counter("care_export_rows_total", "Rows streamed by the bulk export endpoints.", ["dataset", "format"])
+
+# --- Broadcast loop ---
+LOOP_TICK_SECONDS = Histogram(
+    "care_broadcast_tick_seconds", "Time data_processing_loop spends scoring and sending per wake-up.",
+    buckets=FAST_BUCKETS,
+)
+LOOP_DRIFT_SECONDS = Histogram(
+    "care_broadcast_drift_seconds", "How late data_processing_loop woke up compared to when it asked to.",
+    buckets=FAST_BUCKETS,
+)
+LOOP_PACKETS = Counter("care_broadcast_packets_total", "Dashboard packets sent, by kind.", ["kind"])
+
+# --- WebSockets ---
+FANOUT_SECONDS = Histogram(
+    "care_ws_fanout_seconds", "Time to serialize one message and queue it for every subscriber.",
+    buckets=FAST_BUCKETS,
+)
+WS_CONNECTIONS = Gauge("care_ws_connections", "Connected WebSocket clients.")
+WS_SEND_BACKLOG = Gauge("care_ws_send_backlog", "Messages waiting in all WebSocket send queues.")
+WS_SLOW_CONSUMERS = Counter("care_ws_slow_consumer_total", "Slow WebSocket clients, by action taken.", ["action"])
+
+# --- Queues and caches ---
+JOURNAL_QUEUE_DEPTH = Gauge("care_journal_queue_depth", "Journal entries waiting for background analysis.")
+JOURNAL_BATCH_FAILURES = Counter(
+    "care_journal_batch_failures_total", "Failed background journal batches, by what happened next (retried, abandoned).",
+    ["outcome"],
+)
+JOURNAL_RECOVERED = Counter("care_journal_recovered_total", "Unanalyzed journal entries queued again at startup.")
+ACTIVE_PATIENTS = Gauge("care_active_patients", "Patients resident in the in-memory registry.")
+
+# --- Patient state persistence ---
+PATIENT_EVENTS_BUFFERED = Gauge("care_patient_events_buffered", "State changes waiting to be written to patient_events.")
+PATIENT_REBUILD_SECONDS = Histogram(
+    "care_patient_rebuild_seconds", "Time to load one patient from its snapshot and event tail.",
+    buckets=FAST_BUCKETS,
+)
+PATIENT_REBUILD_TAIL = Histogram(
+    "care_patient_rebuild_tail_events", "Events replayed on top of the snapshot when loading a patient.",
+    buckets=(0, 1, 5, 10, 25, 50, 100, 250, 1000),
+)
+
+# --- Score history ---
+SCORE_HISTORY_PATIENTS = Gauge("care_score_history_patients", "Patients with progress-score trend statistics in memory.")
+SCORE_SAMPLES_BUFFERED = Gauge("care_score_samples_buffered", "Score samples waiting to be folded into the rollups.")
+
+
+def timed_query(func):
+    """Records the duration of a crud function in DB_QUERY_LATENCY, labelled by its name."""
+    histogram = DB_QUERY_LATENCY.labels(func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return wrapper
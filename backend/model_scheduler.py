@@ -0,0 +1,287 @@
+# app/model_scheduler.py
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first. "urgent" is a symptom report with a red flag: it skips the
+# per-user limit and displaces anything else when the queue is full.
+PRIORITIES = {"urgent": 0, "symptom": 1, "journal": 2, "background": 3}
+
+# Calls to Gemini in flight at once (the old ANALYZER_MAX_CONCURRENCY semaphore)
+MODEL_MAX_CONCURRENCY = int(os.getenv("ANALYZER_MAX_CONCURRENCY", "16"))
+# Global request rate towards the provider, kept under the project's quota
+MODEL_RATE_PER_SECOND = float(os.getenv("MODEL_RATE_PER_SECOND", "30"))
+MODEL_BURST = float(os.getenv("MODEL_BURST", "30"))
+# Per-patient rate, so one patient (or a stuck client) cannot use up the quota
+MODEL_USER_RATE_PER_MINUTE = float(os.getenv("MODEL_USER_RATE_PER_MINUTE", "12"))
+MODEL_USER_BURST = float(os.getenv("MODEL_USER_BURST", "5"))
+# Bounded queue: beyond this, or after waiting this long, a request is shed and
+# the caller answers from the local triage instead.
+MODEL_QUEUE_MAX = int(os.getenv("MODEL_QUEUE_MAX", "256"))
+MODEL_QUEUE_TIMEOUT_SECONDS = float(os.getenv("MODEL_QUEUE_TIMEOUT_SECONDS", "10"))
+# Retries after a rate-limit (429) answer, with full-jitter exponential backoff
+MODEL_RETRY_ATTEMPTS = int(os.getenv("MODEL_RETRY_ATTEMPTS", "3"))
+MODEL_RETRY_BASE_SECONDS = float(os.getenv("MODEL_RETRY_BASE_MS", "500")) / 1000
+MODEL_RETRY_MAX_SECONDS = float(os.getenv("MODEL_RETRY_MAX_SECONDS", "8"))
+# Per-user buckets remembered at once; the least recently used are forgotten
+MODEL_MAX_TRACKED_USERS = 10000
+
+
+class ModelShed(Exception):
+    """A model call was not made: the queue was full, the wait too long, or the user over their rate."""
+    def __init__(self, reason: str):
+        super().__init__(f"Model call shed ({reason})")
+        self.reason = reason
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """True for the provider's 429 / RESOURCE_EXHAUSTED, without importing the SDK to check."""
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    return type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now: Optional[float] = None) -> bool:
+        if self.rate <= 0:
+            return True # unlimited
+        self._refill(now if now is not None else time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now: Optional[float] = None) -> float:
+        """Seconds until a token is available."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now if now is not None else time.monotonic())
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def drain(self):
+        """Empties the bucket, e.g. after the provider said we are over quota."""
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    future: asyncio.Future = field(compare=False)
+    priority_name: str = field(compare=False)
+    enqueued_at: float = field(compare=False)
+
+
+class ModelScheduler:
+    """
+    Admission control for every Gemini call.
+
+    Requests queue by priority class (FIFO within a class) and are granted a slot
+    when fewer than `max_concurrency` calls are in flight and the global token
+    bucket has a token. Before queueing, a request must also get a token from its
+    patient's bucket. The queue is bounded: when it is full a new request
+    displaces the lowest-priority waiter, if there is one below it, and is shed
+    otherwise. A waiter is also shed after `queue_timeout` seconds. Rate-limit
+    errors from the provider drain the global bucket and are retried with
+    full-jitter backoff, giving the slot back while sleeping.
+    """
+    def __init__(self, max_concurrency: int = MODEL_MAX_CONCURRENCY,
+                 rate: float = MODEL_RATE_PER_SECOND, burst: float = MODEL_BURST,
+                 user_rate_per_minute: float = MODEL_USER_RATE_PER_MINUTE, user_burst: float = MODEL_USER_BURST,
+                 max_queued: int = MODEL_QUEUE_MAX, queue_timeout: float = MODEL_QUEUE_TIMEOUT_SECONDS,
+                 retry_attempts: int = MODEL_RETRY_ATTEMPTS, retry_base: float = MODEL_RETRY_BASE_SECONDS,
+                 retry_max: float = MODEL_RETRY_MAX_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.user_rate = user_rate_per_minute / 60
+        self.user_burst = user_burst
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_attempts = retry_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.bucket = TokenBucket(rate, burst)
+        self._user_buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._heap: List[_Waiter] = []
+        self._queued = 0
+        self._running = 0
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats: Dict[str, int] = {"granted": 0, "shed": 0, "displaced": 0, "retries": 0}
+
+    def queued(self) -> int:
+        return self._queued
+
+    def in_flight(self) -> int:
+        return self._running
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "queued": self._queued, "in_flight": self._running,
+                "global_tokens": round(self.bucket.tokens, 2), "tracked_users": len(self._user_buckets)}
+
+    async def run(self, call: Callable[[], Awaitable], priority: str = "journal",
+                  user_id: Optional[int] = None, model: str = "journal"):
+        """
+        Runs `call()` (a fresh coroutine per attempt) once admitted. Raises ModelShed
+        if it never got a slot; other errors from the call propagate.
+        """
+        self._take_user_token(user_id, priority)
+        attempt = 0
+        while True:
+            await self._acquire(priority)
+            try:
+                return await call()
+            except Exception as e:
+                if not is_rate_limited(e) or attempt + 1 >= self.retry_attempts:
+                    raise
+                # Everyone else is about to hit the same quota, so slow them down too
+                self.bucket.drain()
+            finally:
+                self._release()
+            attempt += 1
+            self.stats["retries"] += 1
+            metrics.MODEL_RETRIES.labels(model).inc()
+            delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+            logger.warning("Gemini %s call was rate limited; retry %d in %.2fs.", model, attempt, delay)
+            await asyncio.sleep(delay)
+
+    # --- Admission ---
+    def _take_user_token(self, user_id: Optional[int], priority: str):
+        if user_id is None or priority == "urgent" or self.user_rate <= 0:
+            return
+        bucket = self._user_buckets.get(user_id)
+        if bucket is None:
+            bucket = self._user_buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+            while len(self._user_buckets) > MODEL_MAX_TRACKED_USERS:
+                self._user_buckets.popitem(last=False)
+        else:
+            self._user_buckets.move_to_end(user_id)
+        if not bucket.try_take():
+            self._shed(priority, "user_rate")
+
+    def _shed(self, priority: str, reason: str):
+        self.stats["shed"] += 1
+        metrics.MODEL_SHED.labels(priority, reason).inc()
+        raise ModelShed(reason)
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # A new event loop (e.g. a test client restart): nothing from the old one can be granted
+            if self._timer is not None:
+                self._timer.cancel()
+            self._loop = loop
+            self._heap = []
+            self._queued = 0
+            self._running = 0
+            self._timer = None
+
+    async def _acquire(self, priority: str):
+        self._bind()
+        enqueued_at = time.monotonic()
+        if not self._heap and self._running < self.max_concurrency and self.bucket.try_take(enqueued_at):
+            self._granted(priority, 0.0)
+            return
+
+        if self._queued >= self.max_queued:
+            self._displace_lowest(priority)
+        waiter = _Waiter(PRIORITIES[priority], next(self._seq), self._loop.create_future(), priority, enqueued_at)
+        heapq.heappush(self._heap, waiter)
+        self._queued += 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self._queued -= 1
+                self._shed(priority, "queue_timeout")
+            # Granted in the same instant the timeout fired; keep the slot
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                # Granted, but the caller went away: hand the slot on
+                self._release()
+            elif not waiter.future.done():
+                waiter.future.cancel()
+                self._queued -= 1
+            raise
+        waiter.future.result() # raises ModelShed if displaced
+
+    def _displace_lowest(self, priority_name: str):
+        """Makes room in a full queue by shedding the lowest-priority, newest waiter below `priority`."""
+        victim = None
+        priority = PRIORITIES[priority_name]
+        for waiter in self._heap:
+            if waiter.future.done():
+                continue
+            if victim is None or (waiter.priority, waiter.seq) > (victim.priority, victim.seq):
+                victim = waiter
+        if victim is None or victim.priority <= priority:
+            self._shed(priority_name, "queue_full")
+        self._queued -= 1
+        self.stats["displaced"] += 1
+        self.stats["shed"] += 1
+        metrics.MODEL_SHED.labels(victim.priority_name, "displaced").inc()
+        victim.future.set_exception(ModelShed("displaced"))
+
+    def _dispatch(self):
+        """Grants waiting requests as long as there are free slots and global tokens."""
+        while self._heap and self._running < self.max_concurrency:
+            waiter = self._heap[0]
+            if waiter.future.done():
+                heapq.heappop(self._heap) # timed out, cancelled or displaced
+                continue
+            now = time.monotonic()
+            if not self.bucket.try_take(now):
+                if self._timer is None:
+                    self._timer = self._loop.call_later(self.bucket.wait_time(now), self._on_timer)
+                return
+            heapq.heappop(self._heap)
+            self._queued -= 1
+            self._granted(waiter.priority_name, now - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _granted(self, priority: str, waited: float):
+        self._running += 1
+        self.stats["granted"] += 1
+        metrics.MODEL_QUEUE_WAIT.labels(priority).observe(waited)
+
+    def _release(self):
+        self._running -= 1
+        if self._heap:
+            self._dispatch()
+
+
+# Create a single global scheduler to be shared across the application
+model_scheduler = ModelScheduler()
+metrics.MODEL_QUEUE_DEPTH.set_function(model_scheduler.queued)
+metrics.MODEL_IN_FLIGHT.set_function(model_scheduler.in_flight)
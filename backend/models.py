@@ -1,6 +1,6 @@
 # app/models.py
 from pydantic import BaseModel, Field
-from typing import Optional, Literal
+from typing import Dict, List, Optional, Literal
 import datetime
 
 # --- Existing Journal Models ---
@@ -8,7 +8,7 @@ class JournalEntryBase(BaseModel):
     content: str
 # ... (rest of journal models are unchanged)
 class JournalEntryCreate(JournalEntryBase):
-    pass
+    user_id: int = 1
 
 class JournalEntryResponse(JournalEntryBase):
     id: int
@@ -16,11 +16,108 @@ class JournalEntryResponse(JournalEntryBase):
     timestamp: datetime.datetime
     ai_analysis: Optional[str] = None
     ai_encouragement: Optional[str] = None
+    # "model", or "local" while the answer is the fast local triage's
+    analysis_source: Optional[str] = None
 
     class Config:
         orm_mode = True
 
+# List views may leave out the (potentially large) content column
+class JournalEntryListItem(JournalEntryResponse):
+    content: Optional[str] = None
+    sentiment_score: Optional[float] = None
+
+# Returned with 202 when a journal entry is stored and analyzed in the background
+class JournalEntryAccepted(BaseModel):
+    id: int
+    user_id: int
+    status: Literal['pending'] = 'pending'
+
 # --- NEW - Symptom Analysis Models ---
 class SymptomAnalysisResponse(BaseModel):
     severity: Literal['Mild', 'Moderate', 'Severe']
-    advice: str
\ No newline at end of file
+    advice: str
+    photo_thumbnail_url: Optional[str] = None
+    # "model", or "local" while the answer is the fast local triage's
+    analysis_source: Optional[str] = None
+    # Identifies the report in a later "symptom_analysis" WebSocket update
+    report_id: Optional[int] = None
+
+# --- Cohort Scoring Models ---
+class CohortScoreRequest(BaseModel):
+    """
+    Either pass `user_ids` to score patients from their live state, or pass the four
+    metric columns directly (all the same length). `what_if` overrides one or more
+    metrics for every row, e.g. {"clinical_biomarker": 2.0}.
+    """
+    user_ids: Optional[List[int]] = None
+    hrv: Optional[List[float]] = None
+    sentiment: Optional[List[float]] = None
+    symptoms: Optional[List[float]] = None
+    clinical_biomarker: Optional[List[float]] = None
+    what_if: Dict[Literal['hrv', 'sentiment', 'symptoms', 'clinical_biomarker'], float] = Field(default_factory=dict)
+
+class CohortScoreResponse(BaseModel):
+    user_ids: Optional[List[int]] = None
+    progress_scores: List[float]
+    insight_buckets: List[int]
+    insights: List[str]
+
+# --- Wearable Time-Series Models ---
+class WearableSample(BaseModel):
+    metric: Literal['hrv', 'heart_rate', 'sleep_hours'] = 'hrv'
+    timestamp: datetime.datetime
+    value: float
+
+class WearableBatch(BaseModel):
+    """A batch of samples from the companion app. Retries must reuse the same idempotency_key."""
+    user_id: int = 1
+    idempotency_key: Optional[str] = Field(default=None, max_length=128)
+    samples: List[WearableSample] = Field(max_length=5000)
+
+class WearableBatchResponse(BaseModel):
+    status: Literal['accepted', 'duplicate']
+    sample_count: int
+
+class RollupPoint(BaseModel):
+    bucket_start: datetime.datetime
+    count: int
+    avg: float
+    min: float
+    max: float
+
+class TimeSeriesResponse(BaseModel):
+    metric: str
+    resolution: str
+    points: List[RollupPoint]
+
+# --- Progress Score History Models ---
+class TrendWindow(BaseModel):
+    points: int
+    mean: Optional[float] = None
+    variance: Optional[float] = None
+    slope_per_day: Optional[float] = None
+
+class ScoreTrend(BaseModel):
+    ewma: Optional[float] = None
+    ewma_halflife_minutes: float
+    windows: Dict[str, TrendWindow]
+
+class ScoreHistoryResponse(TimeSeriesResponse):
+    # Only for progress_score, and only on the worker that scores this patient
+    trend: Optional[ScoreTrend] = None
+
+# --- Daily Summary Models ---
+class SummaryPoint(BaseModel):
+    day: datetime.date # First day of the period (a Monday for weeks)
+    journal_count: int
+    avg_sentiment: Optional[float] = None
+    min_sentiment: Optional[float] = None
+    max_sentiment: Optional[float] = None
+    symptom_count: int
+    symptoms_by_severity: Dict[str, int]
+
+class SummaryResponse(BaseModel):
+    user_id: int
+    period: Literal["day", "week"]
+    points: List[SummaryPoint]
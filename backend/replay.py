@@ -0,0 +1,382 @@
+# app/replay.py
+"""
+Offline replay of patient events through the scoring core, for profiling and
+for checking that optimizations do not change results.
+
+Events (HRV readings, journal sentiment, symptom severities, biomarker levels)
+are fed straight into PatientState.apply_event and calculate_progress_score:
+no HTTP, no database writes, no Gemini. Time is simulated: the clock jumps to
+each event's timestamp, so a week of symptom decay replays in seconds. Each
+event re-scores its patient, as the broadcast loop does, and a simulated
+heartbeat re-scores every patient so decay between events shows up too.
+
+    # Synthetic cohort, as fast as possible
+    python -m backend.replay --synthetic --patients 200 --days 30
+    # A recorded stream: the patient_events table, or an export of it
+    python -m backend.replay --from-db
+    python -m backend.replay --input events.ndjson   # GET /api/export/events?format=ndjson
+    # Write the score series, then check a later run against it
+    python -m backend.replay --synthetic --output baseline.csv
+    python -m backend.replay --synthetic --expect baseline.csv
+
+Prints one JSON report: events/sec, time per stage, garbage collections and,
+with --allocations, tracemalloc figures per stage.
+"""
+import gc
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import datetime
+import heapq
+import tracemalloc
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import timeseries
+from .state_manager import PatientState
+from .insight_engine import calculate_progress_score
+from .score_history import ScoreTracker, COMPONENT_METRICS
+
+# (timestamp, user_id, kind, value, severity), as stored in patient_events
+Event = Tuple[datetime.datetime, int, str, Optional[float], Optional[str]]
+
+STAGES = ("source", "apply", "state", "score", "history", "output")
+SERIES_HEADER = "timestamp,user_id,trigger,progress_score," + ",".join(f"score_{key}" for key in COMPONENT_METRICS)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+# --- Event sources ---
+def read_ndjson(path: str) -> Iterator[Event]:
+    """Events from an NDJSON file with user_id, kind, value, severity and timestamp per line."""
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            timestamp = timeseries.to_naive_utc(datetime.datetime.fromisoformat(record["timestamp"]))
+            yield timestamp, record["user_id"], record["kind"], record.get("value"), record.get("severity")
+
+
+def read_database(batch_size: int = 5000) -> Iterator[Event]:
+    """The patient_events table in log order, read in batches on a server-side cursor."""
+    from . import crud, database
+    query = crud.export_query("events").order_by(None).order_by(database.PatientEvent.id)
+    db = database.SessionLocal()
+    try:
+        for row in db.execute(query.execution_options(yield_per=batch_size)):
+            yield row.timestamp, row.user_id, row.kind, row.value, row.severity
+    finally:
+        db.close()
+
+
+def _synthetic_patient(user_id: int, start: datetime.datetime, days: int, hrv_per_day: int,
+                       journals_per_day: float, symptoms_per_day: float, seed: int) -> Iterator[Event]:
+    """One patient's events in time order, generated a day at a time."""
+    rng = random.Random(seed * 1_000_003 + user_id)
+    hrv = rng.uniform(25, 60)
+    sentiment_bias = rng.uniform(-0.5, 0.5)
+    biomarker = rng.uniform(2, 15)
+    for day in range(days):
+        day_start = start + datetime.timedelta(days=day)
+        events: List[Event] = []
+        for i in range(hrv_per_day):
+            hrv = min(120.0, max(10.0, hrv + rng.gauss(0, 2)))
+            offset = (i + rng.random()) * 86400 / hrv_per_day
+            events.append((day_start + datetime.timedelta(seconds=offset), user_id, "hrv", round(hrv, 1), None))
+        for _ in range(_poisson(rng, journals_per_day)):
+            score = max(-1.0, min(1.0, rng.gauss(sentiment_bias, 0.4)))
+            events.append((day_start + datetime.timedelta(seconds=rng.uniform(0, 86400)), user_id, "sentiment", round(score, 3), None))
+        for _ in range(_poisson(rng, symptoms_per_day)):
+            severity = rng.choices(("Mild", "Moderate", "Severe"), weights=(6, 3, 1))[0]
+            events.append((day_start + datetime.timedelta(seconds=rng.uniform(0, 86400)), user_id, "symptom", None, severity))
+        if day % 7 == 0:
+            biomarker = max(0.5, biomarker * rng.uniform(0.85, 1.05))
+            events.append((day_start + datetime.timedelta(hours=9), user_id, "biomarker", round(biomarker, 2), None))
+        events.sort(key=lambda event: event[0])
+        yield from events
+
+
+def _poisson(rng: random.Random, mean: float) -> int:
+    # Knuth's method; the means here are small
+    limit, count, product = pow(2.718281828459045, -mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def synthetic_events(patients: int, days: int, start: datetime.datetime, hrv_per_day: int = 96,
+                     journals_per_day: float = 1.5, symptoms_per_day: float = 0.4, seed: int = 0) -> Iterator[Event]:
+    """A reproducible cohort, merged into one time-ordered stream without holding it all in memory."""
+    streams = [_synthetic_patient(user_id, start, days, hrv_per_day, journals_per_day, symptoms_per_day, seed)
+               for user_id in range(1, patients + 1)]
+    return heapq.merge(*streams, key=lambda event: (event[0], event[1]))
+
+
+def write_ndjson(events: Iterable[Event], path: str) -> Iterator[Event]:
+    """Passes events through while saving them, so a synthetic stream can be replayed later as a recording."""
+    with open(path, "w") as f:
+        for timestamp, user_id, kind, value, severity in events:
+            f.write(json.dumps({"user_id": user_id, "timestamp": timestamp.isoformat(), "kind": kind,
+                                "value": value, "severity": severity}) + "\n")
+            yield timestamp, user_id, kind, value, severity
+
+
+# --- Replay ---
+class SimulatedClock:
+    """
+    The replay's notion of "now": it jumps to each event's timestamp instead of
+    waiting for it. With `speed` > 0 it is paced at that many simulated seconds per
+    real second (e.g. 1000); with 0 it runs as fast as the CPU allows.
+    """
+    def __init__(self, speed: float = 0.0):
+        self.speed = speed
+        self.now: Optional[datetime.datetime] = None
+        self.start: Optional[datetime.datetime] = None
+        self._wall_start = 0.0
+
+    def advance(self, to: datetime.datetime) -> bool:
+        """Moves the clock forward to `to`. Returns False if `to` is in the simulated past."""
+        if self.now is None:
+            self.now = self.start = to
+            self._wall_start = time.perf_counter()
+            return True
+        if to < self.now:
+            return False
+        self.now = to
+        if self.speed > 0:
+            due = self._wall_start + (to - self.start).total_seconds() / self.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return True
+
+    def elapsed(self) -> float:
+        return (self.now - self.start).total_seconds() if self.now is not None else 0.0
+
+
+class StageTimer:
+    """Accumulates wall time (and optionally net traced memory) per stage of the replay."""
+    def __init__(self, trace_allocations: bool):
+        self.trace = trace_allocations
+        self.ns = dict.fromkeys(STAGES, 0)
+        self.calls = dict.fromkeys(STAGES, 0)
+        self.allocated = dict.fromkeys(STAGES, 0)
+        self._stage: Optional[str] = None
+        self._started = 0
+        self._memory = 0
+
+    def begin(self, stage: str):
+        self._stage = stage
+        if self.trace:
+            self._memory = tracemalloc.get_traced_memory()[0]
+        self._started = time.perf_counter_ns()
+
+    def end(self):
+        elapsed = time.perf_counter_ns() - self._started
+        self.ns[self._stage] += elapsed
+        self.calls[self._stage] += 1
+        if self.trace:
+            self.allocated[self._stage] += tracemalloc.get_traced_memory()[0] - self._memory
+
+    def report(self, total_ns: int) -> dict:
+        stages = {}
+        for stage in STAGES:
+            stages[stage] = {
+                "seconds": self.ns[stage] / 1e9,
+                "share": self.ns[stage] / total_ns if total_ns else 0.0,
+                "calls": self.calls[stage],
+                "ns_per_call": self.ns[stage] / self.calls[stage] if self.calls[stage] else 0.0,
+            }
+            if self.trace:
+                stages[stage]["net_allocated_kb"] = self.allocated[stage] / 1024
+        return stages
+
+
+class Replay:
+    """Feeds an event stream through PatientState and the insight engine and records every score."""
+    def __init__(self, tick_seconds: float = 3600, speed: float = 0.0, trace_allocations: bool = False,
+                 output=None, expect=None):
+        self.tick_seconds = tick_seconds
+        self.clock = SimulatedClock(speed)
+        self.timer = StageTimer(trace_allocations)
+        self.patients: Dict[int, Tuple[PatientState, ScoreTracker]] = {}
+        self.output = output
+        self.expect = expect
+        self.digest = hashlib.sha256()
+        self.events = 0
+        self.scores = 0
+        self.out_of_order = 0
+        self.first_mismatch: Optional[dict] = None
+        self._next_tick: Optional[datetime.datetime] = None
+
+    def run(self, events: Iterable[Event]):
+        timer = self.timer
+        iterator = iter(events)
+        while True:
+            timer.begin("source")
+            event = next(iterator, None)
+            timer.end()
+            if event is None:
+                break
+            timestamp, user_id, kind, value, severity = event
+            if not self.clock.advance(timestamp):
+                self.out_of_order += 1
+            self._run_ticks()
+            entry = self.patients.get(user_id)
+            if entry is None:
+                entry = self.patients[user_id] = (PatientState(user_id), ScoreTracker())
+
+            timer.begin("apply")
+            entry[0].apply_event(kind, value, severity, timestamp)
+            timer.end()
+            self.events += 1
+            self._score(user_id, entry, kind, max(timestamp, self.clock.now))
+
+    def _run_ticks(self):
+        """Re-scores every patient at each heartbeat the clock has passed, so decay shows between events."""
+        if self.tick_seconds <= 0:
+            return
+        now = self.clock.now
+        if self._next_tick is None:
+            # Ticks fall on multiples of tick_seconds, like wall-clock heartbeats
+            elapsed = (now - _EPOCH).total_seconds()
+            self._next_tick = _EPOCH + datetime.timedelta(seconds=(elapsed // self.tick_seconds + 1) * self.tick_seconds)
+            return
+        while self._next_tick <= now:
+            for user_id, entry in self.patients.items():
+                self._score(user_id, entry, "tick", self._next_tick)
+            self._next_tick += datetime.timedelta(seconds=self.tick_seconds)
+
+    def _score(self, user_id: int, entry: Tuple[PatientState, ScoreTracker], trigger: str, now: datetime.datetime):
+        timer = self.timer
+        state, tracker = entry
+        timer.begin("state")
+        current_state = state.get_current_state(now)
+        timer.end()
+
+        timer.begin("score")
+        analysis = calculate_progress_score(current_state)
+        timer.end()
+
+        timer.begin("history")
+        components = analysis["components"]
+        values = (analysis["progress_score"], *(components[key] for key in COMPONENT_METRICS))
+        tracker.record((now - _EPOCH).total_seconds(), values)
+        timer.end()
+
+        timer.begin("output")
+        # repr() round-trips floats exactly, so two runs match only if every score is bit-identical
+        line = f"{now.isoformat()},{user_id},{trigger}," + ",".join(map(repr, values))
+        self.digest.update(line.encode())
+        self.digest.update(b"\n")
+        if self.output is not None:
+            self.output.write(line + "\n")
+        if self.expect is not None and self.first_mismatch is None:
+            expected = self.expect.readline().rstrip("\n")
+            if expected != line:
+                self.first_mismatch = {"score": self.scores + 1, "expected": expected or None, "actual": line}
+        timer.end()
+        self.scores += 1
+
+    def check_expect_exhausted(self):
+        """A shorter series than expected is a mismatch too."""
+        if self.expect is not None and not self.expect.closed and self.first_mismatch is None:
+            extra = self.expect.readline().rstrip("\n")
+            if extra:
+                self.first_mismatch = {"score": self.scores + 1, "expected": extra, "actual": None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--synthetic", action="store_true", help="generate a reproducible cohort")
+    source.add_argument("--input", help="replay an NDJSON event file")
+    source.add_argument("--from-db", action="store_true", help="replay the patient_events table (DATABASE_URL)")
+    parser.add_argument("--patients", type=int, default=100)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--hrv-per-day", type=int, default=96)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start", default="2025-01-01T00:00:00", help="first simulated day of a synthetic cohort")
+    parser.add_argument("--save-events", help="also write the replayed events to this NDJSON file")
+    parser.add_argument("--tick-seconds", type=float, default=3600,
+                        help="simulated heartbeat that re-scores every patient (0 = only on events)")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="simulated seconds per real second, e.g. 1000 (0 = as fast as possible)")
+    parser.add_argument("--allocations", action="store_true", help="trace allocations per stage (much slower)")
+    parser.add_argument("--output", help="write the score series to this CSV file")
+    parser.add_argument("--expect", help="compare the score series against this CSV file; exit 1 on any difference")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        events = synthetic_events(args.patients, args.days, datetime.datetime.fromisoformat(args.start),
+                                  hrv_per_day=args.hrv_per_day, seed=args.seed)
+    elif args.input:
+        events = read_ndjson(args.input)
+    else:
+        events = read_database()
+    if args.save_events:
+        events = write_ndjson(events, args.save_events)
+
+    output = open(args.output, "w") if args.output else None
+    expect = open(args.expect) if args.expect else None
+    if output is not None:
+        output.write(SERIES_HEADER + "\n")
+    if expect is not None and expect.readline().rstrip("\n") != SERIES_HEADER:
+        sys.exit(f"{args.expect} is not a replay score series")
+
+    replay = Replay(tick_seconds=args.tick_seconds, speed=args.speed, trace_allocations=args.allocations,
+                    output=output, expect=expect)
+    if args.allocations:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+    collections_before = sum(stat["collections"] for stat in gc.get_stats())
+    started = time.perf_counter_ns()
+    try:
+        replay.run(events)
+    finally:
+        total_ns = time.perf_counter_ns() - started
+        replay.check_expect_exhausted()
+        for f in (output, expect):
+            if f is not None:
+                f.close()
+
+    report = {
+        "benchmark": "replay",
+        "events": replay.events,
+        "patients": len(replay.patients),
+        "scores": replay.scores,
+        "out_of_order_events": replay.out_of_order,
+        "wall_seconds": total_ns / 1e9,
+        "events_per_second": replay.events / (total_ns / 1e9) if total_ns else 0.0,
+        "scores_per_second": replay.scores / (total_ns / 1e9) if total_ns else 0.0,
+        "simulated_seconds": replay.clock.elapsed(),
+        "simulated_speedup": replay.clock.elapsed() / (total_ns / 1e9) if total_ns else 0.0,
+        "stages": replay.timer.report(total_ns),
+        "gc_collections": sum(stat["collections"] for stat in gc.get_stats()) - collections_before,
+        "series_sha256": replay.digest.hexdigest(),
+    }
+    if args.allocations:
+        current, peak = tracemalloc.get_traced_memory()
+        growth = tracemalloc.take_snapshot().compare_to(before, "lineno")
+        tracemalloc.stop()
+        report["allocations"] = {
+            "current_kb": current / 1024,
+            "peak_kb": peak / 1024,
+            "top_growth": [{"line": str(stat.traceback[0]), "kb": stat.size_diff / 1024, "blocks": stat.count_diff}
+                           for stat in growth[:10]],
+        }
+    if args.expect:
+        report["matches_expected"] = replay.first_mismatch is None
+        if replay.first_mismatch is not None:
+            report["first_mismatch"] = replay.first_mismatch
+    print(json.dumps(report, indent=2))
+    if args.expect and replay.first_mismatch is not None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+# app/score_history.py
+import os
+import math
+import asyncio
+import logging
+import datetime
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from . import crud, database, metrics, timeseries
+
+logger = logging.getLogger(__name__)
+
+# The progress score and the four pillar scores it is built from, as stored in the
+# rollup table. Component keys are the ones calculate_progress_score returns.
+SCORE_METRICS = ("progress_score", "score_hrv", "score_sentiment", "score_symptoms", "score_clinical")
+COMPONENT_METRICS = {"hrv": "score_hrv", "sentiment": "score_sentiment",
+                     "symptoms": "score_symptoms", "clinical": "score_clinical"}
+
+# Recent scoring ticks kept in memory per patient, for the resolution=raw series.
+SCORE_HISTORY_RING_SIZE = int(os.getenv("SCORE_HISTORY_RING_SIZE", "360"))
+SCORE_EWMA_HALFLIFE_SECONDS = float(os.getenv("SCORE_EWMA_HALFLIFE_MINUTES", "60")) * 60
+# Scores are written to the rollups in one transaction per interval, not one per tick.
+SCORE_HISTORY_FLUSH_SECONDS = float(os.getenv("SCORE_HISTORY_FLUSH_SECONDS", "10"))
+# Patients whose trend statistics are held in memory; the least recently scored go first.
+SCORE_HISTORY_MAX_PATIENTS = int(os.getenv("SCORE_HISTORY_MAX_PATIENTS", "5000"))
+
+# (name, window length, step) in seconds. A window holds one averaged point per
+# step, so its memory is fixed no matter how often the patient is scored.
+TREND_WINDOWS = (("24h", 86400, 300), ("7d", 7 * 86400, 3600))
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _to_seconds(timestamp: datetime.datetime) -> float:
+    return (timestamp - _EPOCH).total_seconds()
+
+def _from_seconds(seconds: float) -> datetime.datetime:
+    return _EPOCH + datetime.timedelta(seconds=seconds)
+
+
+class RingBuffer:
+    """Fixed-capacity FIFO of equal-width float rows in one preallocated array. Push and pop are O(1)."""
+    def __init__(self, capacity: int, width: int):
+        self.capacity = capacity
+        self.width = width
+        self._data = array("d", bytes(8 * capacity * width))
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _row(self, slot: int) -> tuple:
+        offset = slot * self.width
+        return tuple(self._data[offset:offset + self.width])
+
+    def push(self, row) -> Optional[tuple]:
+        """Appends a row. If the buffer was full, the oldest row is overwritten and returned."""
+        evicted = None
+        if self._size == self.capacity:
+            evicted = self.pop_oldest()
+        offset = (self._start + self._size) % self.capacity * self.width
+        self._data[offset:offset + self.width] = array("d", row)
+        self._size += 1
+        return evicted
+
+    def oldest(self) -> tuple:
+        return self._row(self._start)
+
+    def pop_oldest(self) -> tuple:
+        row = self._row(self._start)
+        self._start = (self._start + 1) % self.capacity
+        self._size -= 1
+        return row
+
+    def rows(self) -> List[tuple]:
+        """All rows, oldest first."""
+        return [self._row((self._start + i) % self.capacity) for i in range(self._size)]
+
+
+class WindowStats:
+    """
+    Mean, variance and least-squares slope of a value over a sliding time window.
+
+    Observations are averaged per `step`; each finished step enters the window as
+    one point at its midpoint, and points older than `span` leave it. Both moves
+    update running moments with Welford's add/remove formulas, so a tick is O(1)
+    and no sums of large squares are kept to lose precision.
+    """
+    def __init__(self, span: float, step: float):
+        self.span = span
+        self.step = step
+        self._points = RingBuffer(int(span // step) + 1, 2)
+        self._open_start: Optional[float] = None
+        self._open_count = 0
+        self._open_sum = 0.0
+        self.n = 0
+        self._mean_t = 0.0
+        self._mean_x = 0.0
+        self._m2_t = 0.0
+        self._m2_x = 0.0
+        self._c_tx = 0.0
+
+    def observe(self, t: float, x: float):
+        start = t // self.step * self.step
+        if self._open_start is not None and start != self._open_start:
+            self._close_step()
+        if self._open_start is None:
+            self._open_start = start
+        self._open_count += 1
+        self._open_sum += x
+        self._expire(t)
+
+    def load_point(self, t: float, x: float):
+        """Adds an already averaged point, oldest first (used when rebuilding from the rollups)."""
+        self._push(t, x)
+
+    def _close_step(self):
+        self._push(self._open_start + self.step / 2, self._open_sum / self._open_count)
+        self._open_start = None
+        self._open_count = 0
+        self._open_sum = 0.0
+
+    def _push(self, t: float, x: float):
+        evicted = self._points.push((t, x))
+        if evicted is not None:
+            self._remove(*evicted)
+        self._add(t, x)
+
+    def _expire(self, now: float):
+        while self._points and self._points.oldest()[0] <= now - self.span:
+            self._remove(*self._points.pop_oldest())
+
+    def _add(self, t: float, x: float):
+        self.n += 1
+        dt = t - self._mean_t
+        self._mean_t += dt / self.n
+        dx = x - self._mean_x
+        self._mean_x += dx / self.n
+        self._m2_t += dt * (t - self._mean_t)
+        self._m2_x += dx * (x - self._mean_x)
+        self._c_tx += dt * (x - self._mean_x)
+
+    def _remove(self, t: float, x: float):
+        if self.n <= 1:
+            self.n = 0
+            self._mean_t = self._mean_x = self._m2_t = self._m2_x = self._c_tx = 0.0
+            return
+        # The exact inverse of _add
+        mean_t, mean_x = self._mean_t, self._mean_x
+        self.n -= 1
+        self._mean_t = mean_t + (mean_t - t) / self.n
+        self._mean_x = mean_x + (mean_x - x) / self.n
+        self._m2_t = max(0.0, self._m2_t - (t - self._mean_t) * (t - mean_t))
+        self._m2_x = max(0.0, self._m2_x - (x - self._mean_x) * (x - mean_x))
+        self._c_tx -= (t - self._mean_t) * (x - mean_x)
+
+    def summary(self) -> dict:
+        """Statistics over the finished steps in the window. The slope is in score points per day."""
+        if self.n == 0:
+            return {"points": 0, "mean": None, "variance": None, "slope_per_day": None}
+        slope = self._c_tx / self._m2_t * 86400 if self._m2_t > 0 else None
+        return {"points": self.n, "mean": self._mean_x, "variance": self._m2_x / self.n, "slope_per_day": slope}
+
+
+class ScoreTracker:
+    """One patient's recent scoring ticks plus the trend statistics of their progress score."""
+    def __init__(self):
+        # Each row is (timestamp, progress_score, score_hrv, score_sentiment, score_symptoms, score_clinical)
+        self.ticks = RingBuffer(SCORE_HISTORY_RING_SIZE, 1 + len(SCORE_METRICS))
+        self.windows = {name: WindowStats(span, step) for name, span, step in TREND_WINDOWS}
+        self.ewma: Optional[float] = None
+        self._ewma_t: Optional[float] = None
+
+    def record(self, t: float, values: tuple):
+        self.ticks.push((t, *values))
+        self._update_ewma(t, values[0])
+        for window in self.windows.values():
+            window.observe(t, values[0])
+
+    def _update_ewma(self, t: float, score: float):
+        # Time-aware smoothing: a reading's weight depends on how long since the last
+        # one, so bursts of ticks do not drag the average around.
+        if self.ewma is None:
+            self.ewma = score
+        else:
+            alpha = 1 - math.pow(0.5, max(0.0, t - self._ewma_t) / SCORE_EWMA_HALFLIFE_SECONDS)
+            self.ewma += alpha * (score - self.ewma)
+        self._ewma_t = t
+
+    def series(self, metric: str) -> List[Tuple[datetime.datetime, float]]:
+        column = 1 + SCORE_METRICS.index(metric)
+        return [(_from_seconds(row[0]), row[column]) for row in self.ticks.rows()]
+
+    def trend(self) -> dict:
+        return {
+            "ewma": self.ewma,
+            "ewma_halflife_minutes": SCORE_EWMA_HALFLIFE_SECONDS / 60,
+            "windows": {name: window.summary() for name, window in self.windows.items()},
+        }
+
+
+class ScoreHistory:
+    """
+    Keeps what data_processing_loop computes instead of throwing it away.
+
+    In memory, each scored patient has a ScoreTracker. For the long run, every
+    score and component is folded into the time-series rollups (metric names in
+    SCORE_METRICS) at 1-minute, 1-hour and 1-day resolution, so history queries
+    read pre-aggregated buckets and never raw ticks. A tracker evicted or lost in
+    a restart is rebuilt from those rollups the next time its patient is scored.
+    """
+    def __init__(self, max_patients: int = SCORE_HISTORY_MAX_PATIENTS,
+                 flush_interval: float = SCORE_HISTORY_FLUSH_SECONDS):
+        self.max_patients = max_patients
+        self.flush_interval = flush_interval
+        self._trackers: "OrderedDict[int, ScoreTracker]" = OrderedDict()
+        # (user_id, metric, timestamp, value) waiting for the next flush
+        self._pending: List[Tuple[int, str, datetime.datetime, float]] = []
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._trackers)
+
+    def buffered(self) -> int:
+        return len(self._pending)
+
+    async def record_async(self, user_id: int, analysis: dict, timestamp: Optional[datetime.datetime] = None):
+        """Records one calculate_progress_score result. The first call for a patient loads their history off the event loop."""
+        tracker = self._trackers.get(user_id)
+        if tracker is None:
+            tracker = await asyncio.to_thread(self._load, user_id)
+            self._trackers[user_id] = tracker
+            while len(self._trackers) > self.max_patients:
+                self._trackers.popitem(last=False)
+        else:
+            self._trackers.move_to_end(user_id)
+
+        timestamp = timestamp or datetime.datetime.utcnow()
+        components = analysis["components"]
+        values = (analysis["progress_score"], *(components[key] for key in COMPONENT_METRICS))
+        tracker.record(_to_seconds(timestamp), values)
+        with self._pending_lock:
+            self._pending.extend((user_id, metric, timestamp, value) for metric, value in zip(SCORE_METRICS, values))
+
+    def get_tracker(self, user_id: int) -> Optional[ScoreTracker]:
+        return self._trackers.get(user_id)
+
+    def _load(self, user_id: int, now: Optional[datetime.datetime] = None) -> ScoreTracker:
+        """Rebuilds a tracker's EWMA and trend windows from the persisted rollups."""
+        tracker = ScoreTracker()
+        now = now or datetime.datetime.utcnow()
+        db = database.SessionLocal()
+        try:
+            for name, span, step in TREND_WINDOWS:
+                # The finest rollup that divides the step evenly
+                resolution = "1h" if step % 3600 == 0 else "1m"
+                seconds = timeseries.RESOLUTIONS[resolution]
+                # Start on a step boundary so the oldest step is read whole
+                since = _from_seconds((_to_seconds(now) - span) // step * step)
+                rows = crud.get_timeseries_rollups(db, user_id, "progress_score", resolution, since, now)
+                window = tracker.windows[name]
+                # Merge the rollup buckets into window steps; the step still in progress is left open
+                steps: "OrderedDict[float, list]" = OrderedDict()
+                for row in rows:
+                    t = _to_seconds(row.bucket_start)
+                    start = t // step * step
+                    totals = steps.setdefault(start, [0, 0.0])
+                    totals[0] += row.count
+                    totals[1] += row.sum
+                    if name == TREND_WINDOWS[0][0]:
+                        # The EWMA replays the finest series, one point per rollup bucket
+                        tracker._update_ewma(t + seconds / 2, row.sum / row.count)
+                current = _to_seconds(now) // step * step
+                for start, (count, total) in steps.items():
+                    if start != current:
+                        window.load_point(start + step / 2, total / count)
+                window._expire(_to_seconds(now))
+        except Exception:
+            logger.exception("Could not load score history for user %s; starting empty", user_id)
+        finally:
+            db.close()
+        return tracker
+
+    def flush(self) -> int:
+        """Folds everything buffered into the rollups in one transaction. Blocking; returns the number of samples."""
+        with self._write_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            by_user: Dict[int, list] = {}
+            for user_id, metric, timestamp, value in batch:
+                by_user.setdefault(user_id, []).append((metric, timestamp, value))
+            try:
+                database.run_write(crud.merge_timeseries_rollups, {user_id: timeseries.aggregate(samples)
+                                                                   for user_id, samples in by_user.items()})
+            except Exception:
+                with self._pending_lock:
+                    self._pending[:0] = batch
+                raise
+        return len(batch)
+
+    def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stops the background flush and writes whatever is still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if not self._pending:
+                continue
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception:
+                logger.exception("Could not write score history; will retry")
+
+
+# Create a single global score history to be shared across the application
+score_history = ScoreHistory()
+metrics.SCORE_HISTORY_PATIENTS.set_function(lambda: len(score_history))
+metrics.SCORE_SAMPLES_BUFFERED.set_function(score_history.buffered)
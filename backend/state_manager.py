@@ -1,86 +1,563 @@
-from typing import List
+import os
+import time
+import json
+import asyncio
+import logging
+import itertools
+import threading
 import datetime
+from collections import OrderedDict, deque
+from typing import List, Optional, Tuple
 # We need to import the database model to use it as a type hint,
 # which helps with code completion and error checking.
 from .database import SymptomReport
+from . import crud, database, metrics
+from .event_log import event_log
+from .backplane import backplane
 
-class PatientState:
-    """Manages a holistic view of the patient's real-time health data."""
+logger = logging.getLogger(__name__)
+
+class ChangeNotifier:
+    """
+    Collects the ids of patients whose state changed and wakes the broadcast loop.
+    Safe to call from the threadpool that runs sync endpoints.
+    """
     def __init__(self):
+        self._dirty = set()
+        self._forced = set()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """Attaches the notifier to the event loop running the broadcast loop."""
+        self._loop = loop
+        self._event = asyncio.Event()
+        # Changes made before binding (e.g. before this worker became leader) still count
+        with self._lock:
+            if self._dirty:
+                self._event.set()
+
+    def mark_dirty(self, user_id: int, force: bool = False):
+        """Flags a patient for re-scoring. `force` sends a full packet even if nothing changed."""
+        with self._lock:
+            self._dirty.add(user_id)
+            if force:
+                self._forced.add(user_id)
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self, timeout: float) -> bool:
+        """Waits until some patient is marked dirty or `timeout` passes. Returns True on a change."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._event.clear()
+
+    def drain(self) -> Tuple[set, set]:
+        """Returns and clears the (dirty, forced) patient id sets."""
+        with self._lock:
+            dirty, forced = self._dirty, self._forced
+            self._dirty, self._forced = set(), set()
+        return dirty, forced
+
+
+# Create a single global notifier shared by the state and the broadcast loop
+change_notifier = ChangeNotifier()
+
+
+# Define the weight for each severity level
+SEVERITY_WEIGHTS = {"Mild": 1.0, "Moderate": 2.5, "Severe": 5.0}
+SYMPTOM_WINDOW_DAYS = 7
+
+# A patient is snapshotted once this many events have been logged since their last
+# snapshot, checked every interval. Loading a patient replays at most roughly this many.
+PATIENT_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("PATIENT_SNAPSHOT_INTERVAL_SECONDS", "60"))
+PATIENT_SNAPSHOT_MIN_EVENTS = int(os.getenv("PATIENT_SNAPSHOT_MIN_EVENTS", "50"))
+# How many recently active patients to load at startup, before their first request
+PATIENT_WARM_START = int(os.getenv("PATIENT_WARM_START", "100"))
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+_WINDOW_US = SYMPTOM_WINDOW_DAYS * 86400 * 1_000_000
+# Weights are kept as integer half-units (Mild=2, Moderate=5, Severe=10) so the
+# running sums below are exact and never drift as reports are added and expired.
+_HALF_WEIGHTS = {severity: int(weight * 2) for severity, weight in SEVERITY_WEIGHTS.items()}
+
+def _to_us(timestamp: datetime.datetime) -> int:
+    return (timestamp - _EPOCH) // _ONE_MICROSECOND
+
+_event_sequence = itertools.count(1)
+
+def _event_key() -> Optional[str]:
+    """Identifies one state change across workers. Only needed when there are several."""
+    return f"{backplane.worker_id}:{next(_event_sequence)}" if backplane.multi_worker else None
+
+
+class SymptomScoreAggregator:
+    """
+    Maintains the 7-day linearly decayed symptom severity score incrementally.
+
+    Each report contributes weight * (window - age) / window while it is inside the
+    window. Summed over all live reports that is
+        (window * sum(w) - now * sum(w) + sum(w * t)) / window
+    so keeping sum(w) and sum(w * t) lets us add a report and evaluate the score in
+    constant time. Reports that age out are dropped from the left of a time-ordered
+    queue, which is amortized constant time as well.
+
+    The sums are integers, so score() is the exact decayed score rounded once to a
+    float. The old per-report loop rounded at every step, so the two can differ in
+    the last bits (around 1e-15) but never by more; bit-for-bit equality with that
+    loop would mean repeating its float operations in its order, i.e. the rescan
+    this class replaces. Expiry is permanent, so score() expects `now` not to go back.
+    """
+    __slots__ = ("_reports", "_weight_sum", "_weighted_time_sum")
+
+    def __init__(self):
+        self._reports = deque()  # (timestamp_us, half_weight), oldest first
+        self._weight_sum = 0
+        self._weighted_time_sum = 0
+
+    def add(self, severity: str, timestamp: datetime.datetime):
+        """Adds one symptom report. Unknown severities carry no weight, as before."""
+        weight = _HALF_WEIGHTS.get(severity, 0)
+        if not weight:
+            return
+        t = _to_us(timestamp)
+        if not self._reports or t >= self._reports[-1][0]:
+            self._reports.append((t, weight))
+        else:
+            # Out-of-order reports are rare; keep the queue sorted so expiry stays correct.
+            index = next(i for i, (existing, _) in enumerate(self._reports) if existing > t)
+            self._reports.insert(index, (t, weight))
+        self._weight_sum += weight
+        self._weighted_time_sum += weight * t
+
+    def remove(self, severity: str, timestamp: datetime.datetime):
+        """Takes back one report added with the same severity and timestamp, if it is still in the window."""
+        weight = _HALF_WEIGHTS.get(severity, 0)
+        t = _to_us(timestamp)
+        try:
+            self._reports.remove((t, weight))
+        except ValueError:
+            return
+        self._weight_sum -= weight
+        self._weighted_time_sum -= weight * t
+
+    def rebuild(self, reports):
+        """Full rebuild from a list of SymptomReport rows, used at startup or after eviction."""
+        self._reports.clear()
+        self._weight_sum = 0
+        self._weighted_time_sum = 0
+        for report in sorted(reports, key=lambda r: r.timestamp):
+            self.add(report.severity, report.timestamp)
+
+    def dump(self) -> List[List[int]]:
+        """The live reports as [timestamp_us, half_weight] pairs, oldest first, for a snapshot."""
+        self._expire(_to_us(datetime.datetime.utcnow()))
+        return [[t, weight] for t, weight in self._reports]
+
+    def load(self, reports: List[List[int]]):
+        """Restores the reports written by dump()."""
+        self._reports = deque((t, weight) for t, weight in reports)
+        self._weight_sum = sum(weight for _, weight in self._reports)
+        self._weighted_time_sum = sum(weight * t for t, weight in self._reports)
+
+    def _expire(self, now_us: int):
+        # A report exactly `window` old contributes zero, so it can be expired too.
+        cutoff = now_us - _WINDOW_US
+        while self._reports and self._reports[0][0] <= cutoff:
+            t, weight = self._reports.popleft()
+            self._weight_sum -= weight
+            self._weighted_time_sum -= weight * t
+
+    def score(self, now: Optional[datetime.datetime] = None) -> float:
+        """Returns the decayed score at `now` (default: the current UTC time), capped at 10."""
+        now_us = _to_us(now or datetime.datetime.utcnow())
+        self._expire(now_us)
+        numerator = (_WINDOW_US - now_us) * self._weight_sum + self._weighted_time_sum
+        # We cap the score at 10 to keep it normalized for the insight engine.
+        return min(10.0, numerator / (2 * _WINDOW_US))
+
+    def __len__(self) -> int:
+        return len(self._reports)
+
+
+class PatientState:
+    """Manages a holistic view of one patient's real-time health data."""
+    # Slots keep each record small: tens of thousands of these can be resident at once.
+    __slots__ = ("user_id", "hrv", "avg_sentiment", "symptoms", "clinical_biomarker", "loaded_from")
+
+    def __init__(self, user_id: int = 1):
+        self.user_id = user_id
+
         # Wearable Data
         self.hrv = 40.0  # Default Heart Rate Variability
-        
+
         # Journal Data
         self.avg_sentiment = 0.0 # A moving average of recent journal sentiment
-        
-        # Symptom Data - This is now calculated dynamically from history
-        self.symptom_severity_score = 0.0 
-        
+
+        # Symptom Data - A running aggregate of the last 7 days of reports
+        self.symptoms = SymptomScoreAggregator()
+
         # Clinical Data (Manually entered by user/clinician)
         self.clinical_biomarker = 10.0 # e.g., CEA level. Lower is better.
-        
-        print("PatientState manager initialized for predictive analysis.")
+
+        # (snapshot's last_event_id, keys of the logged events replayed on top of it)
+        # when loaded from the database; see PatientRegistry.apply_remote_event
+        self.loaded_from: Tuple[int, frozenset] = (0, frozenset())
+
+    @property
+    def symptom_severity_score(self) -> float:
+        return self.symptoms.score()
+
+    def apply_event(self, kind: str, value: Optional[float], severity: Optional[str], timestamp: datetime.datetime):
+        """
+        Applies one state change. Live updates and replay from the event log both
+        come through here, so a rebuilt patient ends up exactly where the live one was.
+        """
+        if kind == "hrv":
+            self.hrv = value
+        elif kind == "sentiment":
+            # A moving average of the last 5 sentiment scores for stability
+            self.avg_sentiment = ((self.avg_sentiment * 4) + value) / 5
+        elif kind == "biomarker":
+            self.clinical_biomarker = value
+        elif kind == "symptom":
+            self.symptoms.add(severity, timestamp)
+        elif kind == "sentiment_revision":
+            # Already scaled by revise_journal_sentiment
+            self.avg_sentiment += value
+        elif kind == "symptom_retraction":
+            self.symptoms.remove(severity, timestamp)
+
+    def _record(self, kind: str, value: Optional[float] = None, severity: Optional[str] = None,
+                timestamp: Optional[datetime.datetime] = None):
+        timestamp = timestamp or datetime.datetime.utcnow()
+        event_key = _event_key()
+        self.apply_event(kind, value, severity, timestamp)
+        event_log.append(self.user_id, kind, value, severity, timestamp, event_key)
+        # Other workers apply the same change; a no-op in a single process
+        backplane.publish_event({"type": "state", "user_id": self.user_id, "kind": kind, "value": value,
+                                 "severity": severity, "timestamp": timestamp.isoformat(), "key": event_key})
+        change_notifier.mark_dirty(self.user_id)
 
     def update_from_mobile_app(self, data: dict):
         """Receives real data packet from the conceptual companion app."""
-        self.hrv = data.get('hrv', self.hrv)
-        print(f"State updated from mobile app: HRV={self.hrv}")
+        if data.get('hrv') is None: return
+        self._record("hrv", value=data['hrv'])
+        logger.debug("State updated from mobile app for user %s: HRV=%s", self.user_id, self.hrv)
 
     def update_from_journal(self, new_score: float):
         """Updates the average sentiment from a new journal entry."""
         if new_score is None: return
-        # A moving average of the last 5 sentiment scores for stability
-        self.avg_sentiment = ((self.avg_sentiment * 4) + new_score) / 5
-        print(f"Sentiment updated from journal. New average: {self.avg_sentiment:.2f}")
+        self._record("sentiment", value=new_score)
+        logger.debug("Sentiment updated from journal for user %s. New average: %.2f", self.user_id, self.avg_sentiment)
+
+    def revise_journal_sentiment(self, provisional: float, final: float):
+        """
+        Swaps a provisional (local triage) sentiment score for the model's. The moving
+        average gave the provisional score a weight of 1/5, so that share is corrected;
+        if other entries arrived in between, its true weight is a little smaller.
+        """
+        if provisional is None or final is None or provisional == final: return
+        self._record("sentiment_revision", value=(final - provisional) / 5)
 
     def update_clinical_biomarker(self, level: float):
         """Updates the clinical biomarker level from manual entry."""
-        self.clinical_biomarker = level
-        print(f"Clinical biomarker updated. New level: {self.clinical_biomarker:.2f}")
+        self._record("biomarker", value=level)
+        logger.debug("Clinical biomarker updated for user %s. New level: %.2f", self.user_id, self.clinical_biomarker)
+
+    def add_symptom_report(self, severity: str, timestamp: datetime.datetime):
+        """Folds one new symptom report into the running score in constant time."""
+        self._record("symptom", severity=severity, timestamp=timestamp)
+
+    def revise_symptom_report(self, old_severity: str, new_severity: str, timestamp: datetime.datetime):
+        """Re-rates a report already folded into the score, e.g. when the model overrides the local triage."""
+        if old_severity == new_severity: return
+        self._record("symptom_retraction", severity=old_severity, timestamp=timestamp)
+        self._record("symptom", severity=new_severity, timestamp=timestamp)
 
-    # --- THIS IS THE NEW, INTELLIGENT FUNCTION ---
     def recalculate_symptom_score(self, recent_symptoms: List[SymptomReport]):
         """
-        Calculates a weighted severity score based on a list of recent symptoms.
+        Rebuilds the weighted severity score from a list of recent symptoms.
         More recent and more severe symptoms have a higher impact on the score.
         """
-        print("--- DEBUG: Recalculating symptom score based on history ---")
-        new_score = 0.0
-        
-        # Define the weight for each severity level
-        severity_weights = {"Mild": 1.0, "Moderate": 2.5, "Severe": 5.0}
-        
-        for symptom in recent_symptoms:
-            # Calculate how many days old the symptom report is
-            days_old = (datetime.datetime.utcnow() - symptom.timestamp).total_seconds() / 86400
-            
-            # Apply a decay factor: a symptom from today has full weight (1.0),
-            # one from 7 days ago has very little weight (0.0).
-            decay = max(0, (7.0 - days_old) / 7.0) # Linear decay over 7 days
-            
-            # Get the base severity weight from our dictionary
-            base_weight = severity_weights.get(symptom.severity, 0.0)
-            
-            # The final score for this symptom is its severity weighted by how recent it is.
-            new_score += base_weight * decay
-            print(f"DEBUG: Symptom '{symptom.severity}' ({days_old:.1f} days old) added {base_weight * decay:.2f} to score.")
-
-        # We cap the score at 10 to keep it normalized for the insight engine.
-        self.symptom_severity_score = min(10.0, new_score)
-        print(f"--- DEBUG: New calculated symptom score: {self.symptom_severity_score:.2f} ---")
-
+        self.symptoms.rebuild(recent_symptoms)
+        change_notifier.mark_dirty(self.user_id)
 
-    def get_current_state(self) -> dict:
+    def get_current_state(self, now: Optional[datetime.datetime] = None) -> dict:
         """
-        Gets the latest state. We no longer need to decay the symptom score here
-        as it's now dynamically calculated based on a full history.
+        Gets the latest state. The symptom score is evaluated at `now`, so it keeps
+        decaying between reports.
         """
         return {
             "hrv": self.hrv,
             "sentiment": self.avg_sentiment,
-            "symptoms": self.symptom_severity_score,
+            "symptoms": self.symptoms.score(now),
             "clinical_biomarker": self.clinical_biomarker
         }
 
-# Create a single global instance to be shared across the application
-patient_state = PatientState()
\ No newline at end of file
+    def to_snapshot(self) -> dict:
+        return {
+            "hrv": self.hrv,
+            "avg_sentiment": self.avg_sentiment,
+            "clinical_biomarker": self.clinical_biomarker,
+            "symptoms": self.symptoms.dump(),
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: database.PatientSnapshot) -> "PatientState":
+        state = cls(snapshot.user_id)
+        state.hrv = snapshot.hrv
+        state.avg_sentiment = snapshot.avg_sentiment
+        state.clinical_biomarker = snapshot.clinical_biomarker
+        state.symptoms.load(json.loads(snapshot.symptoms))
+        return state
+
+
+class PatientRegistry:
+    """
+    Holds one PatientState per user_id, keeping only the most recently used
+    patients in memory. When the registry is full the least recently used
+    patient is evicted; the next access loads it from its latest snapshot plus
+    the events logged after it.
+    """
+    def __init__(self, max_active: int = 5000, snapshot_interval: float = PATIENT_SNAPSHOT_INTERVAL_SECONDS,
+                 snapshot_min_events: int = PATIENT_SNAPSHOT_MIN_EVENTS):
+        self.max_active = max_active
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_min_events = snapshot_min_events
+        self._patients: "OrderedDict[int, PatientState]" = OrderedDict()
+        # Sync endpoints run in a threadpool, so access must be serialized.
+        self._lock = threading.RLock()
+        self._snapshot_task: Optional[asyncio.Task] = None
+        logger.info("PatientRegistry initialized (max %d active patients).", self.max_active)
+
+    def get(self, user_id: int) -> PatientState:
+        """Returns the state for a patient, rebuilding it if it is not resident."""
+        with self._lock:
+            state = self._patients.get(user_id)
+            if state is not None:
+                self._patients.move_to_end(user_id)
+                return state
+
+        # Rebuild outside the lock so a slow query does not stall other patients.
+        state = self._rebuild(user_id)
+
+        with self._lock:
+            # Another thread may have rebuilt the same patient in the meantime.
+            existing = self._patients.get(user_id)
+            if existing is not None:
+                self._patients.move_to_end(user_id)
+                return existing
+            self._patients[user_id] = state
+            while len(self._patients) > self.max_active:
+                self._evict_oldest()
+            return state
+
+    async def get_async(self, user_id: int) -> PatientState:
+        """Like get(), but rebuilds a non-resident patient in a worker thread instead of on the event loop."""
+        state = self.get_resident(user_id)
+        if state is None:
+            state = await asyncio.to_thread(self.get, user_id)
+        return state
+
+    def get_resident(self, user_id: int) -> Optional[PatientState]:
+        """Returns the state for a patient only if it is already in memory (never touches the database)."""
+        with self._lock:
+            state = self._patients.get(user_id)
+            if state is not None:
+                self._patients.move_to_end(user_id)
+            return state
+
+    def active_user_ids(self) -> List[int]:
+        with self._lock:
+            return list(self._patients.keys())
+
+    def __len__(self) -> int:
+        return len(self._patients)
+
+    def clear(self):
+        """Drops every resident patient, so each is reloaded from the database on next use."""
+        with self._lock:
+            self._patients.clear()
+
+    async def apply_remote_event(self, event: dict, load: bool):
+        """
+        Applies a state change made on another worker. With `load` the patient is loaded
+        if needed (the scoring leader); otherwise only a resident copy is kept current.
+        """
+        user_id = event["user_id"]
+        state = self.get_resident(user_id)
+        if state is None:
+            if not load:
+                return
+            state = await asyncio.to_thread(self.get, user_id)
+            # The sender may have flushed the event before the patient was loaded from the log
+            if event.get("key") and await asyncio.to_thread(self._has_replayed, state, event["key"]):
+                change_notifier.mark_dirty(user_id)
+                return
+        state.apply_event(event["kind"], event["value"], event["severity"],
+                          datetime.datetime.fromisoformat(event["timestamp"]))
+        change_notifier.mark_dirty(user_id)
+
+    @staticmethod
+    def _has_replayed(state: PatientState, event_key: str) -> bool:
+        """
+        Whether a patient loaded from the database already includes the logged event
+        `event_key`: it was in the replayed tail, or folded into the snapshot it started
+        from. An event written after the tail was read is in neither, and still applies.
+        """
+        snapshot_event_id, replayed_keys = state.loaded_from
+        if event_key in replayed_keys:
+            return True
+        if not snapshot_event_id:
+            return False
+        db = database.SessionLocal()
+        try:
+            event_id = crud.get_patient_event_id(db, state.user_id, event_key)
+        finally:
+            db.close()
+        return event_id is not None and event_id <= snapshot_event_id
+
+    def _evict_oldest(self):
+        # Every change is already in the event log, so nothing needs saving here.
+        self._patients.popitem(last=False)
+
+    def _rebuild(self, user_id: int) -> PatientState:
+        """Loads a patient from their latest snapshot and replays only the events after it."""
+        started = time.perf_counter()
+        db = database.SessionLocal()
+        try:
+            snapshot = crud.get_patient_snapshot(db, user_id)
+            after_id = snapshot.last_event_id if snapshot is not None else 0
+            stored, pending = event_log.read_tail(db, user_id, after_id)
+            if snapshot is not None:
+                state = PatientState.from_snapshot(snapshot)
+            elif stored or pending:
+                state = PatientState(user_id)
+            else:
+                # Nothing logged yet: start from the journal and symptom tables
+                return self._bootstrap_from_history(db, user_id)
+
+            for event in stored:
+                state.apply_event(event.kind, event.value, event.severity, event.timestamp)
+            for _, kind, value, severity, timestamp, _ in pending:
+                state.apply_event(kind, value, severity, timestamp)
+            state.loaded_from = (after_id, frozenset(event.event_key for event in stored if event.event_key))
+            if len(stored) >= self.snapshot_min_events:
+                event_log.note_unsnapshotted(user_id, len(stored))
+        finally:
+            db.close()
+        metrics.PATIENT_REBUILD_TAIL.observe(len(stored) + len(pending))
+        metrics.PATIENT_REBUILD_SECONDS.observe(time.perf_counter() - started)
+        return state
+
+    def _bootstrap_from_history(self, db, user_id: int) -> PatientState:
+        """
+        Builds a patient that has no snapshot or events yet from the journal and symptom
+        tables, and stores the result as their first snapshot so it is only done once.
+        """
+        state = PatientState(user_id)
+        # Replaying the moving average over the newest entries reproduces it closely:
+        # an entry 50 updates back contributes less than 0.002% of the average.
+        scores = crud.get_recent_sentiment_scores(db, user_id=user_id, limit=50)
+        avg_sentiment = 0.0
+        for score in scores:
+            avg_sentiment = ((avg_sentiment * 4) + score) / 5
+        state.avg_sentiment = avg_sentiment
+        recent_symptoms = crud.get_recent_symptoms(db, user_id=user_id, days=7)
+        if recent_symptoms:
+            state.symptoms.rebuild(recent_symptoms)
+        if scores or recent_symptoms:
+            database.run_write(crud.save_patient_snapshot, user_id, last_event_id=0, **state.to_snapshot())
+        return state
+
+    def compact(self, user_id: int) -> bool:
+        """
+        Folds a patient's logged events into a new snapshot. Works from the database
+        alone, so it is correct whether or not the patient is resident. Blocking.
+        """
+        return database.run_write(self._compact, user_id)
+
+    @staticmethod
+    def _compact(db, user_id: int) -> bool:
+        snapshot = crud.get_patient_snapshot(db, user_id)
+        state = PatientState.from_snapshot(snapshot) if snapshot is not None else PatientState(user_id)
+        events = crud.get_patient_events_after(db, user_id, snapshot.last_event_id if snapshot is not None else 0)
+        if not events:
+            return False
+        for event in events:
+            state.apply_event(event.kind, event.value, event.severity, event.timestamp)
+        return crud.save_patient_snapshot(db, user_id, last_event_id=events[-1].id, **state.to_snapshot())
+
+    def compact_pending(self, min_events: Optional[int] = None) -> int:
+        """Snapshots every patient with enough new events. Blocking; returns how many were written."""
+        written = 0
+        threshold = self.snapshot_min_events if min_events is None else min_events
+        for user_id in event_log.take_snapshot_candidates(threshold):
+            try:
+                written += self.compact(user_id)
+            except Exception:
+                logger.exception("Could not snapshot patient %s", user_id)
+                event_log.note_unsnapshotted(user_id, threshold)
+        return written
+
+    def warm_start(self, limit: int, stop: Optional[threading.Event] = None) -> int:
+        """
+        Loads the most recently active patients ahead of their first request. Blocking.
+        Returns early once `stop` is set. Returns how many patients were loaded.
+        """
+        db = database.SessionLocal()
+        try:
+            user_ids = crud.get_recently_snapshotted_user_ids(db, limit)
+        finally:
+            db.close()
+        loaded = 0
+        for user_id in user_ids:
+            if stop is not None and stop.is_set():
+                break
+            self.get(user_id)
+            loaded += 1
+        return loaded
+
+    def start_persistence(self):
+        """Starts writing state changes to the event log and taking periodic snapshots."""
+        event_log.start()
+        self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+
+    async def stop_persistence(self):
+        """Flushes the event log, then snapshots everything that changed, so the next start replays little."""
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            await asyncio.gather(self._snapshot_task, return_exceptions=True)
+            self._snapshot_task = None
+        await event_log.stop()
+        await asyncio.to_thread(self.compact_pending, 1)
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                written = await asyncio.to_thread(self.compact_pending)
+                if written:
+                    logger.info("Wrote %d patient snapshots.", written)
+            except Exception:
+                logger.exception("Patient snapshot pass failed")
+
+
+# Create a single global registry to be shared across the application
+patient_registry = PatientRegistry(max_active=int(os.getenv("MAX_ACTIVE_PATIENTS", "5000")))
+metrics.ACTIVE_PATIENTS.set_function(lambda: len(patient_registry))
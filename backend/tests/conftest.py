@@ -0,0 +1,10 @@
+# backend/tests/conftest.py
+"""Points the app at a throwaway SQLite file before any backend module creates its engines."""
+import os
+import tempfile
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="care_tests_"), "test.db")
+
+from backend import database # noqa: E402  (the engines read DATABASE_URL on import)
+
+database.create_db_and_tables()
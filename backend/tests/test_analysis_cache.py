@@ -0,0 +1,102 @@
+# backend/tests/test_analysis_cache.py
+"""Request coalescing in AnalysisCache, in particular what a cancelled caller does to the others."""
+import asyncio
+import uuid
+
+import pytest
+
+from backend.analysis_cache import AnalysisCache
+
+
+def unique_key() -> str:
+    # The persistent tier is shared by every test, so never reuse a key.
+    return uuid.uuid4().hex
+
+
+def test_concurrent_callers_share_one_computation():
+    async def run():
+        cache = AnalysisCache()
+        key, calls = unique_key(), []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"answer": 42}, True
+
+        results = await asyncio.gather(*(cache.get_or_compute_status(key, "journal", compute) for _ in range(5)))
+        assert results == [({"answer": 42}, True)] * 5
+        assert len(calls) == 1
+        assert cache.get_stats()["coalesced"] == 4
+        assert cache.get_stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_cancelling_the_first_caller_does_not_fail_the_others():
+    async def run():
+        cache = AnalysisCache()
+        key, started, release = unique_key(), asyncio.Event(), asyncio.Event()
+
+        async def compute():
+            started.set()
+            await release.wait()
+            return {"answer": "model"}, True
+
+        first = asyncio.create_task(cache.get_or_compute_status(key, "journal", compute))
+        await started.wait()
+        waiters = [asyncio.create_task(cache.get_or_compute_status(key, "journal", compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        release.set()
+        assert await asyncio.gather(*waiters) == [({"answer": "model"}, True)] * 3
+        # The answer was cached even though the caller that started it had gone
+        assert await cache.lookup(key) == {"answer": "model"}
+
+    asyncio.run(run())
+
+
+def test_computation_finishes_when_every_caller_is_cancelled():
+    async def run():
+        cache = AnalysisCache()
+        key, release = unique_key(), asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            return {"answer": "late"}, True
+
+        caller = asyncio.create_task(cache.get_or_compute_status(key, "journal", compute))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        assert cache.get_stats()["in_flight"] == 1
+
+        release.set()
+        for _ in range(100):
+            if not cache.get_stats()["in_flight"]:
+                break
+            await asyncio.sleep(0.01)
+        assert await cache.lookup(key) == {"answer": "late"}
+
+    asyncio.run(run())
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    async def run():
+        cache = AnalysisCache()
+        key = unique_key()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("model down")
+
+        results = await asyncio.gather(*(cache.get_or_compute_status(key, "journal", compute) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert cache.get_stats()["in_flight"] == 0
+        assert await cache.lookup(key) is None
+
+    asyncio.run(run())
@@ -0,0 +1,302 @@
+# backend/tests/test_backplane.py
+"""
+The backplane's lease and pub/sub contracts, run against the in-process implementation
+always and against Redis when one is reachable (REDIS_URL, default localhost:6379).
+"""
+import os
+import uuid
+import asyncio
+import datetime
+import random
+
+import pytest
+
+from backend import backplane as backplane_module
+from backend.backplane import (Backplane, InProcessPubSub, InProcessStateStore, RedisPubSub,
+                               RedisStateStore)
+from backend.event_log import event_log
+from backend.state_manager import PatientRegistry
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+LEASE_MS = 300
+
+
+def _redis_available() -> bool:
+    try:
+        import redis
+    except ImportError:
+        return False
+    try:
+        client = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=0.5)
+        try:
+            return bool(client.ping())
+        finally:
+            client.close()
+    except Exception:
+        return False
+
+
+REDIS_AVAILABLE = _redis_available()
+
+
+class InProcessFactory:
+    """One shared store and pub/sub, as every 'worker' lives in this process."""
+    multi_worker = False
+
+    def __init__(self):
+        self._store, self._pubsub = InProcessStateStore(), InProcessPubSub()
+
+    def store(self):
+        return self._store
+
+    def pubsub(self):
+        return self._pubsub
+
+
+class RedisFactory:
+    """A separate connection per call, like separate worker processes."""
+    multi_worker = True
+
+    def store(self):
+        import redis.asyncio as redis
+        return RedisStateStore(redis.from_url(REDIS_URL, decode_responses=True))
+
+    def pubsub(self):
+        import redis.asyncio as redis
+        return RedisPubSub(redis.from_url(REDIS_URL, decode_responses=True))
+
+
+@pytest.fixture(params=["inprocess", pytest.param("redis", marks=pytest.mark.skipif(
+    not REDIS_AVAILABLE, reason=f"no Redis server at {REDIS_URL}"))])
+def factory(request):
+    return InProcessFactory() if request.param == "inprocess" else RedisFactory()
+
+
+@pytest.fixture
+def leader_key(monkeypatch):
+    # A key of our own, so a shared Redis (or another test) never sees our lease
+    key = f"care:test:leader:{uuid.uuid4().hex}"
+    monkeypatch.setattr(backplane_module, "LEADER_KEY", key)
+    return key
+
+
+async def wait_for(condition, timeout: float = 3.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+# --- Leases ---
+
+def test_lease_acquire_renew_and_steal_after_expiry(factory):
+    async def run():
+        key = f"care:test:lease:{uuid.uuid4().hex}"
+        a, b = factory.store(), factory.store()
+        try:
+            assert await a.set_if_absent(key, "a", LEASE_MS)
+            assert not await b.set_if_absent(key, "b", LEASE_MS)
+            assert await a.get(key) == "a"
+
+            # Only the owner can renew or release
+            assert await a.renew_if_owner(key, "a", LEASE_MS)
+            assert not await b.renew_if_owner(key, "b", LEASE_MS)
+            assert not await b.delete_if_owner(key, "b")
+            await asyncio.sleep(LEASE_MS / 2000)
+            assert await a.renew_if_owner(key, "a", LEASE_MS)
+            await asyncio.sleep(LEASE_MS / 2000)
+            assert not await b.set_if_absent(key, "b", LEASE_MS) # renewed, so still held
+
+            # Once it lapses, another worker takes it and the old owner cannot touch it
+            await asyncio.sleep(LEASE_MS * 1.5 / 1000)
+            assert await b.set_if_absent(key, "b", LEASE_MS)
+            assert not await a.renew_if_owner(key, "a", LEASE_MS)
+            assert not await a.delete_if_owner(key, "a")
+            assert await a.get(key) == "b"
+            assert await b.delete_if_owner(key, "b")
+            assert await a.get(key) is None
+        finally:
+            await a.close()
+            if b is not a:
+                await b.close()
+
+    asyncio.run(run())
+
+
+def test_one_leader_and_handover_on_stop(factory, leader_key):
+    async def run():
+        changes = []
+        workers = [Backplane(factory.store(), factory.pubsub(), worker_id=name, lease_ms=LEASE_MS)
+                   for name in ("w1", "w2")]
+        for worker in workers:
+            worker.on_leadership = lambda held, name=worker.worker_id: changes.append((name, held))
+            await worker.start()
+        try:
+            await wait_for(lambda: any(worker.is_leader for worker in workers))
+            await asyncio.sleep(LEASE_MS / 1000)
+            leaders = [worker for worker in workers if worker.is_leader]
+            assert len(leaders) == 1
+            leader, follower = leaders[0], next(worker for worker in workers if not worker.is_leader)
+
+            await leader.stop()
+            workers.remove(leader)
+            assert not leader.is_leader
+            await wait_for(lambda: follower.is_leader, timeout=LEASE_MS * 3 / 1000)
+            assert changes[-1] == (follower.worker_id, True)
+        finally:
+            for worker in workers:
+                await worker.stop()
+
+    asyncio.run(run())
+
+
+# --- Pub/sub ---
+
+def test_publish_reaches_another_subscriber(factory):
+    async def run():
+        channel = f"care:test:topic:{uuid.uuid4().hex}"
+        sender, receiver = factory.pubsub(), factory.pubsub()
+        received = []
+        try:
+            await receiver.subscribe(channel, received.append)
+            await asyncio.sleep(0.05) # let the subscription reach the server
+            await sender.publish(channel, "hello")
+            await wait_for(lambda: received)
+            assert received == ["hello"]
+
+            await receiver.unsubscribe(channel)
+            await asyncio.sleep(0.05)
+            await sender.publish(channel, "gone")
+            await asyncio.sleep(0.1)
+            assert received == ["hello"]
+        finally:
+            await sender.close()
+            if receiver is not sender:
+                await receiver.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(not REDIS_AVAILABLE, reason=f"no Redis server at {REDIS_URL}")
+def test_events_and_subscriptions_cross_workers(leader_key):
+    async def run():
+        factory = RedisFactory()
+        a = Backplane(factory.store(), factory.pubsub(), worker_id=f"a-{uuid.uuid4().hex[:6]}",
+                      lease_ms=LEASE_MS, announce_seconds=60)
+        b = Backplane(factory.store(), factory.pubsub(), worker_id=f"b-{uuid.uuid4().hex[:6]}",
+                      lease_ms=LEASE_MS, announce_seconds=60)
+        seen_by = {"a": [], "b": []}
+
+        async def on_a(event):
+            seen_by["a"].append(event)
+
+        async def on_b(event):
+            seen_by["b"].append(event)
+
+        a.on_event, b.on_event = on_a, on_b
+        user_id = random.randrange(1_000_000, 2_000_000)
+        a.local_user_ids = lambda: [user_id]
+        await a.start()
+        await b.start()
+        try:
+            assert a.multi_worker and b.multi_worker
+            await asyncio.sleep(0.1)
+
+            # A state event reaches the other worker, not its sender
+            a.publish_event({"type": "state", "user_id": user_id, "kind": "hrv", "value": 41.0})
+            await wait_for(lambda: seen_by["b"])
+            assert seen_by["b"][0]["user_id"] == user_id and seen_by["b"][0]["origin"] == a.worker_id
+            assert seen_by["a"] == []
+
+            # A dashboard subscription on a is announced to b straight away
+            topic = f"care:test:patient:{user_id}"
+            dashboard = []
+            a.watch(topic, dashboard.append)
+            await wait_for(lambda: user_id in b.subscribed_user_ids([]))
+
+            # ...and a broadcast published on b reaches a's dashboard
+            await asyncio.sleep(0.05)
+            await b.publish(topic, "packet")
+            await wait_for(lambda: dashboard)
+            assert dashboard == ["packet"]
+        finally:
+            await a.stop()
+            await b.stop()
+
+    asyncio.run(run())
+
+
+def test_in_process_backplane_is_a_single_leader():
+    async def run():
+        worker = Backplane(InProcessStateStore(), InProcessPubSub(), lease_ms=LEASE_MS)
+        delivered = []
+        await worker.start()
+        try:
+            assert not worker.multi_worker
+            await wait_for(lambda: worker.is_leader)
+            worker.watch("care:patient:1", delivered.append)
+            await asyncio.sleep(0)
+            await worker.publish("care:patient:1", "packet")
+            assert delivered == ["packet"]
+            worker.publish_event({"type": "state"}) # a no-op with one worker
+            assert worker.subscribed_user_ids([3]) == [3]
+        finally:
+            await worker.stop()
+
+    asyncio.run(run())
+
+
+# --- Remote events on a freshly loaded patient ---
+
+@pytest.fixture
+def sent_events(monkeypatch):
+    """Pretends to be one of several workers and captures the events it would publish."""
+    from backend.backplane import backplane
+    sent = []
+    monkeypatch.setattr(backplane, "multi_worker", True)
+    monkeypatch.setattr(backplane, "publish_event", sent.append)
+    return sent
+
+
+@pytest.mark.parametrize("compact", [False, True], ids=["in the tail", "in the snapshot"])
+def test_remote_event_already_in_the_log_is_not_applied_twice(sent_events, compact):
+    async def run():
+        user_id = random.randrange(2_000_000, 3_000_000)
+        sender = PatientRegistry()
+        state = sender.get(user_id)
+        for _ in range(3):
+            state.add_symptom_report("Severe", datetime.datetime.utcnow())
+        event_log.flush()
+        if compact:
+            sender.compact(user_id)
+
+        # The leader loads the patient from the log, which already has the last event
+        leader = PatientRegistry()
+        await leader.apply_remote_event(sent_events[-1], load=True)
+        assert len(leader.get_resident(user_id).symptoms) == 3
+
+    asyncio.run(run())
+
+
+def test_remote_event_not_yet_logged_is_applied(sent_events):
+    async def run():
+        user_id = random.randrange(3_000_000, 4_000_000)
+        sender = PatientRegistry()
+        sender.get(user_id).add_symptom_report("Mild", datetime.datetime.utcnow())
+        event_log.flush()
+        sender.compact(user_id)
+        sender.get(user_id).add_symptom_report("Severe", datetime.datetime.utcnow())
+        # The second event is still in the sender's buffer, which another worker cannot see
+        with event_log._buffer_lock:
+            unflushed = [event for event in event_log._buffer if event[0] == user_id]
+            event_log._buffer = [event for event in event_log._buffer if event[0] != user_id]
+
+        leader = PatientRegistry()
+        await leader.apply_remote_event(sent_events[-1], load=True)
+        assert len(leader.get_resident(user_id).symptoms) == 2
+        with event_log._buffer_lock:
+            event_log._buffer[:0] = unflushed
+        event_log.flush()
+
+    asyncio.run(run())
@@ -0,0 +1,83 @@
+# backend/tests/test_broadcast_loop.py
+"""The broadcast loop records every changed patient's score, watched by a dashboard or not."""
+import asyncio
+
+import pytest
+
+from backend import main
+from backend.score_history import SCORE_METRICS, ScoreHistory
+from backend.state_manager import change_notifier
+
+UNWATCHED = 7400
+WATCHED = 7401
+
+
+@pytest.fixture
+def loop_env(monkeypatch):
+    history = ScoreHistory()
+    sent = []
+    scored = []
+
+    async def send_to_user(user_id, message):
+        sent.append(user_id)
+
+    original = main.calculate_progress_score
+
+    def calculate(state):
+        scored.append(state)
+        return original(state)
+
+    monkeypatch.setattr(main, "score_history", history)
+    monkeypatch.setattr(main, "BROADCAST_COALESCE_SECONDS", 0)
+    monkeypatch.setattr(main.manager, "send_to_user", send_to_user)
+    monkeypatch.setattr(main.manager, "subscribed_user_ids", lambda: [WATCHED])
+    monkeypatch.setattr(main, "calculate_progress_score", calculate)
+    # The notifier is process-wide; leave it unbound for the tests that follow
+    monkeypatch.setattr(change_notifier, "_loop", None)
+    monkeypatch.setattr(change_notifier, "_event", None)
+    change_notifier.drain()
+    return history, sent, scored
+
+
+async def run_loop_until(condition):
+    task = asyncio.create_task(main.data_processing_loop())
+    try:
+        for _ in range(500):
+            await asyncio.sleep(0.01)
+            if condition():
+                return
+        raise AssertionError("the broadcast loop did not get there")
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def test_changed_patients_are_recorded_without_a_dashboard(loop_env):
+    history, sent, scored = loop_env
+
+    async def scenario():
+        change_notifier.mark_dirty(UNWATCHED)
+        change_notifier.mark_dirty(WATCHED)
+        await run_loop_until(lambda: WATCHED in sent and history.get_tracker(UNWATCHED) is not None)
+
+    asyncio.run(scenario())
+    assert len(history.get_tracker(UNWATCHED).ticks) == 1
+    assert len(history.get_tracker(WATCHED).ticks) == 1
+    # Only the watched patient gets a packet, and it reuses the recorded score
+    assert sent == [WATCHED]
+    assert len(scored) == 2
+    assert history.buffered() == 2 * len(SCORE_METRICS)
+
+
+def test_heartbeat_sends_without_recording(loop_env, monkeypatch):
+    history, sent, scored = loop_env
+    monkeypatch.setattr(main, "BROADCAST_HEARTBEAT_SECONDS", 0.05)
+
+    async def scenario():
+        await run_loop_until(lambda: len(sent) >= 2)
+
+    asyncio.run(scenario())
+    assert set(sent) == {WATCHED}
+    # Nothing changed, so there is no new score to keep
+    assert history.get_tracker(WATCHED) is None
+    assert history.buffered() == 0
@@ -0,0 +1,110 @@
+# backend/tests/test_group_commit.py
+"""GroupCommitWriter when one row of a group cannot be written."""
+import asyncio
+import uuid
+
+from sqlalchemy.exc import IntegrityError
+
+from backend import crud, database, models
+from backend.group_commit import GroupCommitWriter
+
+
+def make_journal(content):
+    row = crud.build_journal_entry(models.JournalEntryCreate(content="placeholder", user_id=7),
+                                   {"analysis": "ok", "sentiment_score": 0.25, "analysis_source": "local"})
+    row.content = content # None breaks the NOT NULL constraint
+    return row
+
+
+def make_symptom(description):
+    return crud.build_symptom_report(description, {"severity": "Mild", "analysis_source": "local"}, user_id=7)
+
+
+async def write_group(writer, rows):
+    """Hands every row to `writer` concurrently, so they share a group, and returns what each caller got."""
+    writer.start()
+    try:
+        return await asyncio.gather(*(writer.add(row) for row in rows), return_exceptions=True)
+    finally:
+        await writer.stop()
+
+
+def stored(model, column, marker) -> dict:
+    """{content: id} of the rows whose `column` starts with `marker`."""
+    db = database.SessionLocal()
+    try:
+        query = db.query(model).filter(getattr(model, column).like(f"{marker}%"))
+        return {getattr(row, column): row.id for row in query}
+    finally:
+        db.close()
+
+
+def group_with_one_bad_row(marker):
+    return [make_journal(f"{marker} first"), make_journal(None), make_journal(f"{marker} second"),
+            make_symptom(f"{marker} rash"), make_journal(f"{marker} third")]
+
+
+def assert_only_bad_row_failed(marker, results):
+    assert isinstance(results[1], IntegrityError)
+    assert not any(isinstance(result, BaseException) for i, result in enumerate(results) if i != 1)
+    # Every good row is stored exactly once, under the id its caller was given
+    assert stored(database.JournalEntry, "content", marker) == {
+        f"{marker} first": results[0].id, f"{marker} second": results[2].id, f"{marker} third": results[4].id}
+    assert stored(database.SymptomReport, "description", marker) == {f"{marker} rash": results[3].id}
+
+
+def test_one_bad_row_only_fails_its_own_caller():
+    marker = uuid.uuid4().hex
+    writer = GroupCommitWriter(window=0.05)
+    results = asyncio.run(write_group(writer, group_with_one_bad_row(marker)))
+    assert_only_bad_row_failed(marker, results)
+
+
+class InterruptedWriter(GroupCommitWriter):
+    """
+    Leaves the ids of the failed group's INSERTs on its rows, and lets another writer
+    commit rows under exactly those ids before the rows are retried one by one.
+    """
+    def __init__(self, marker):
+        super().__init__(window=0.05)
+        self.marker = marker
+        self.groups = 0
+
+    async def _insert(self, rows: list):
+        if len(rows) == 1:
+            return await super()._insert(rows)
+        self.groups += 1
+        next_id = self._next_journal_id()
+        try:
+            await super()._insert(rows)
+        finally:
+            stale = [row for row in rows if isinstance(row, database.JournalEntry)]
+            for offset, row in enumerate(stale):
+                row.id = next_id + offset
+            db = database.SessionLocal()
+            try:
+                db.add_all(database.JournalEntry(id=row.id, user_id=8, content=f"{self.marker} {row.id}")
+                           for row in stale)
+                db.commit()
+            finally:
+                db.close()
+
+    @staticmethod
+    def _next_journal_id() -> int:
+        db = database.SessionLocal()
+        try:
+            return (db.query(database.JournalEntry.id).order_by(database.JournalEntry.id.desc()).limit(1).scalar() or 0) + 1
+        finally:
+            db.close()
+
+
+def test_retried_rows_get_new_ids_after_the_group_fails():
+    marker, other_marker = uuid.uuid4().hex, uuid.uuid4().hex
+    writer = InterruptedWriter(other_marker)
+    results = asyncio.run(write_group(writer, group_with_one_bad_row(marker)))
+    assert writer.groups == 1
+    # The other worker's rows kept their ids; ours went in after them
+    others = stored(database.JournalEntry, "content", other_marker)
+    assert len(others) == 4
+    assert min(results[i].id for i in (0, 2, 4)) > max(others.values())
+    assert_only_bad_row_failed(marker, results)
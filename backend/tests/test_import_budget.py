@@ -0,0 +1,40 @@
+# backend/tests/test_import_budget.py
+"""
+Importing the app must not load the heavy SDKs it only needs on first use, and must
+stay well inside the startup budget. benchmarks/import_budget.py has the full report.
+"""
+import os
+import statistics
+
+import pytest
+
+from backend.benchmarks.import_budget import LAZY_MODULES, measure_once
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Generous on purpose: CI machines are slower and noisier than a laptop. The lazy-module
+# check is the exact one; this only catches a regression of whole seconds.
+TEST_BUDGET_MS = 3 * float(os.getenv("IMPORT_BUDGET_MS", "1500"))
+
+
+@pytest.fixture(scope="module")
+def import_runs(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("import")
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{workdir / 'import.db'}"
+    env["MEDIA_ROOT"] = str(workdir / "media")
+    env["LOG_LEVEL"] = "WARNING"
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    measure_once("backend.main", env) # warms the file cache and writes bytecode
+    return [measure_once("backend.main", env) for _ in range(3)]
+
+
+@pytest.mark.parametrize("module", LAZY_MODULES)
+def test_importing_the_app_does_not_load(import_runs, module):
+    assert all(module not in run["loaded"] for run in import_runs)
+    assert all(not any(name == module or name.startswith(module + ".") for name in run["cumulative_us"])
+               for run in import_runs)
+
+
+def test_import_stays_within_budget(import_runs):
+    median_ms = statistics.median(run["import_ms"] for run in import_runs)
+    assert median_ms <= TEST_BUDGET_MS, f"importing backend.main took {median_ms:.0f} ms"
@@ -0,0 +1,71 @@
+# backend/tests/test_insight_engine.py
+"""calculate_progress_scores against calculate_progress_score, row by row."""
+import math
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from backend.insight_engine import INSIGHTS, calculate_progress_score, calculate_progress_scores
+
+COLUMNS = ("hrv", "sentiment", "symptoms", "clinical_biomarker")
+# Edge values for every column: zero, negative, tiny, huge, infinite and NaN
+SPECIAL = [0.0, -0.0, -1.0, 1e-300, 2.5, 50.0, 1e300, math.inf, -math.inf, math.nan]
+
+
+def assert_rows_match(rows):
+    """Scores `rows` both ways. A None value means the key is absent from the scalar call."""
+    vectorized = calculate_progress_scores(*([row[name] for row in rows] for name in COLUMNS))
+    for i, row in enumerate(rows):
+        scalar = calculate_progress_score({name: value for name, value in row.items() if value is not None})
+        score = vectorized["progress_score"][i]
+        assert score == scalar["progress_score"], (row, score, scalar["progress_score"])
+        assert INSIGHTS[vectorized["insight_bucket"][i]] == scalar["insight"], row
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_rows_match_the_scalar_function(seed):
+    rng = random.Random(seed)
+    rows = [{"hrv": rng.uniform(0, 150), "sentiment": rng.uniform(-1, 1), "symptoms": rng.uniform(0, 10),
+             "clinical_biomarker": rng.uniform(-1, 20)} for _ in range(2000)]
+    assert_rows_match(rows)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_special_values_match_the_scalar_function(seed):
+    rng = random.Random(seed)
+    rows = [{name: rng.choice(SPECIAL + [rng.uniform(-100, 100)]) for name in COLUMNS} for _ in range(2000)]
+    assert_rows_match(rows)
+
+
+@pytest.mark.parametrize("name", COLUMNS)
+@pytest.mark.parametrize("value", [math.nan, None], ids=["nan", "none"])
+def test_nan_and_none_in_each_column(name, value):
+    row = {"hrv": 42.0, "sentiment": -0.3, "symptoms": 3.0, "clinical_biomarker": 4.0, name: value}
+    assert_rows_match([row])
+    result = calculate_progress_scores(*([row[column]] for column in COLUMNS))
+    assert not np.isnan(result["progress_score"]).any()
+
+
+@pytest.mark.parametrize("threshold, symptoms", [(85.0, 6.0), (65.0, 14.0), (40.0, 24.0)])
+def test_insight_thresholds(threshold, symptoms):
+    # hrv 50, sentiment -1 and biomarker 2.5 give 75 points; symptoms move the score onto the threshold
+    row = {"hrv": 50.0, "sentiment": -1.0, "symptoms": symptoms, "clinical_biomarker": 2.5}
+    assert calculate_progress_score(row)["progress_score"] == threshold
+    just_above = dict(row, symptoms=symptoms - 1e-9)
+    just_below = dict(row, symptoms=symptoms + 1e-9)
+    assert_rows_match([row, just_above, just_below])
+    buckets = calculate_progress_scores(*([r[name] for r in (row, just_above, just_below)] for name in COLUMNS))["insight_bucket"]
+    # A score exactly on a threshold falls into the lower bucket
+    assert list(buckets) == [buckets[0], buckets[0] - 1, buckets[0]]
+
+
+def test_accepts_numpy_columns():
+    rng = np.random.default_rng(3)
+    columns = [rng.uniform(10, 100, 500), rng.uniform(-1, 1, 500), rng.uniform(0, 10, 500), rng.uniform(0, 15, 500)]
+    result = calculate_progress_scores(*columns)
+    for i in range(500):
+        scalar = calculate_progress_score({name: float(column[i]) for name, column in zip(COLUMNS, columns)})
+        assert result["progress_score"][i] == scalar["progress_score"]
+        assert INSIGHTS[result["insight_bucket"][i]] == scalar["insight"]
@@ -0,0 +1,126 @@
+# backend/tests/test_journal_pagination.py
+"""Keyset pagination of the journal listing on (timestamp, id)."""
+import base64
+import datetime
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend import api, crud, database
+
+USER_ID = 7100
+OTHER_USER_ID = 7101
+BASE_TIME = datetime.datetime(2026, 3, 1, 8, 0, 0)
+
+
+@pytest.fixture(scope="module")
+def entry_ids():
+    """Seventeen entries for one user, most sharing a timestamp with another, plus one for someone else."""
+    # Three timestamps repeated, inserted out of order, so only the id breaks ties
+    offsets = [2, 0, 1, 2, 2, 0, 1, 1, 2, 0, 0, 1, 2, 1, 0, 2, 3]
+    db = database.SessionLocal()
+    try:
+        entries = [database.JournalEntry(user_id=USER_ID, timestamp=BASE_TIME + datetime.timedelta(minutes=offset),
+                                         content=f"entry {n}", ai_analysis="done")
+                   for n, offset in enumerate(offsets)]
+        entries.append(database.JournalEntry(user_id=OTHER_USER_ID, timestamp=BASE_TIME, content="other",
+                                             ai_analysis="done"))
+        db.add_all(entries)
+        db.commit()
+        expected = sorted(((e.timestamp, e.id) for e in entries if e.user_id == USER_ID), reverse=True)
+        return [entry_id for _, entry_id in expected]
+    finally:
+        db.close()
+
+
+def read_all_pages(limit: int, include_content: bool = True):
+    pages = []
+    cursor = None
+    db = database.SessionLocal()
+    try:
+        while True:
+            rows, cursor = crud.list_journal_entries(db, USER_ID, limit=limit, cursor=cursor,
+                                                     include_content=include_content)
+            pages.append([row.id for row in rows])
+            if cursor is None:
+                return pages
+            assert len(pages) < 50, "pagination did not terminate"
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 5, 16, 17, 50])
+def test_pages_follow_timestamp_then_id_without_gaps_or_repeats(entry_ids, limit):
+    pages = read_all_pages(limit)
+    assert [entry_id for page in pages for entry_id in page] == entry_ids
+    assert all(len(page) == limit for page in pages[:-1])
+
+
+@pytest.mark.parametrize("limit", [1, 17])
+def test_last_page_has_no_cursor_and_is_not_empty(entry_ids, limit):
+    # 17 entries: with limit 1 and 17 the last page is exactly full
+    pages = read_all_pages(limit)
+    assert len(pages) == len(entry_ids) // limit
+    assert pages[-1] and pages[-1][-1] == entry_ids[-1]
+
+
+def test_summary_pages_match_full_pages(entry_ids):
+    assert read_all_pages(4, include_content=False) == read_all_pages(4)
+
+
+def test_cursor_round_trip():
+    timestamp = datetime.datetime(2026, 3, 1, 8, 2, 0, 123456)
+    assert crud.decode_cursor(crud.encode_cursor(timestamp, 42)) == (timestamp, 42)
+
+
+BAD_CURSORS = [
+    "not a cursor!",
+    base64.urlsafe_b64encode(b"no separator").decode(),
+    base64.urlsafe_b64encode(b"2026-03-01T08:00:00|not-an-id").decode(),
+    base64.urlsafe_b64encode(b"yesterday|12").decode(),
+    base64.urlsafe_b64encode(b"2026-03-01T08:00:00|1|2").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe|1").decode(),
+]
+
+
+@pytest.mark.parametrize("cursor", BAD_CURSORS)
+def test_bad_cursor_is_rejected(entry_ids, cursor):
+    with pytest.raises(ValueError):
+        crud.decode_cursor(cursor)
+    db = database.SessionLocal()
+    try:
+        with pytest.raises(ValueError):
+            crud.list_journal_entries(db, USER_ID, limit=5, cursor=cursor)
+    finally:
+        db.close()
+
+
+@pytest.fixture(scope="module")
+def client():
+    app = FastAPI()
+    app.include_router(api.router, prefix="/api")
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def test_api_pages_through_the_cursor_header(entry_ids, client):
+    seen = []
+    params = {"user_id": USER_ID, "limit": 5, "fields": "summary"}
+    while True:
+        response = client.get("/api/journal", params=params)
+        assert response.status_code == 200
+        body = response.json()
+        assert all("content" not in item for item in body)
+        seen.extend(item["id"] for item in body)
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        params["cursor"] = cursor
+    assert seen == entry_ids
+
+
+def test_api_rejects_a_bad_cursor(entry_ids, client):
+    response = client.get("/api/journal", params={"user_id": USER_ID, "cursor": BAD_CURSORS[2]})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor."
@@ -0,0 +1,66 @@
+# backend/tests/test_journal_worker.py
+"""A batch written by the journal worker leaves no entry pending, whatever the model answered."""
+import asyncio
+import datetime
+
+import pytest
+
+from backend import analyzer, crud, database, journal_worker
+from backend.journal_worker import JournalAnalysisQueue, PendingJournalEntry
+
+USER_ID = 7200
+
+
+def store_pending(content: str) -> int:
+    db = database.SessionLocal()
+    try:
+        entry = database.JournalEntry(user_id=USER_ID, content=content)
+        db.add(entry)
+        db.commit()
+        return entry.id
+    finally:
+        db.close()
+
+
+def read_entry(entry_id: int):
+    db = database.SessionLocal()
+    try:
+        return db.get(database.JournalEntry, entry_id)
+    finally:
+        db.close()
+
+
+def pending_ids() -> set:
+    db = database.SessionLocal()
+    try:
+        before = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        return {entry_id for entry_id, _, _ in crud.get_pending_journal_entries(db, before, 0, 10000)}
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("answer", [
+    {"sentiment_score": 0.2, "encouragement": "Keep going.", "analysis_source": "model"},
+    {"analysis": None, "sentiment_score": 0.2, "encouragement": "Keep going.", "analysis_source": "model"},
+    {"analysis": "", "sentiment_score": 0.2, "encouragement": "Keep going.", "analysis_source": "model"},
+])
+def test_model_answer_without_analysis_gets_the_fallback(monkeypatch, answer):
+    async def analyze(text, user_id=None, priority="journal"):
+        return dict(answer)
+
+    monkeypatch.setattr(analyzer, "analyze_journal_entry_async", analyze)
+    entry_id = store_pending("A quiet day.")
+    assert entry_id in pending_ids()
+
+    asyncio.run(JournalAnalysisQueue()._process([PendingJournalEntry(entry_id, USER_ID, "A quiet day.")]))
+
+    entry = read_entry(entry_id)
+    assert entry.ai_analysis == analyzer.JOURNAL_FALLBACK["analysis"]
+    assert entry.ai_encouragement == "Keep going."
+    assert entry.sentiment_score == 0.2
+    assert entry_id not in pending_ids()
+
+
+def test_model_analysis_is_kept():
+    result = {"analysis": "Calm and hopeful.", "sentiment_score": -0.6}
+    assert journal_worker._with_analysis(result) is result
@@ -0,0 +1,154 @@
+# backend/tests/test_local_triage.py
+"""Red flags, negation and mild cues of the local symptom triage, and how the model's answer is reconciled with it."""
+import json
+
+import pytest
+
+from backend import analyzer, local_triage
+
+# (description, expected red flag)
+RED_FLAG_CASES = [
+    ("I have chest pain since this morning", "chest pain"),
+    ("there is a pain in my chest", "chest pain"),
+    ("Chest tightness when I climb stairs", "chest pain"),
+    ("I have trouble breathing", "difficulty breathing"),
+    ("shortness of breath at night", "difficulty breathing"),
+    ("I can't breathe properly", "difficulty breathing"),
+    ("the wound has bleeding that won't stop", "uncontrolled bleeding"),
+    ("heavy bleeding from the incision", "uncontrolled bleeding"),
+    ("blood soaked through the bandage", "uncontrolled bleeding"),
+    ("coughing up blood", "coughing or vomiting blood"),
+    ("I vomited blood last night", "coughing or vomiting blood"),
+    ("there is pus around the stitches", "signs of infection"),
+    ("red streaks near the incision", "signs of infection"),
+    ("a foul-smelling discharge", "signs of infection"),
+    ("I fainted in the kitchen", "fainting"),
+    ("passed out for a minute", "fainting"),
+    ("I feel confused and dizzy", "confusion or stroke signs"),
+    ("my husband noticed slurred speech", "confusion or stroke signs"),
+    ("I had a seizure", "seizure"),
+    ("convulsions this afternoon", "seizure"),
+    ("fever of 103 since yesterday", "high fever"),
+    ("temperature is 39.8 c", "high fever"),
+    ("severe back pain", "severe pain"),
+    ("the worst headache of my life", "severe pain"),
+    ("I keep thinking about suicide", "self-harm"),
+    ("I want to hurt myself", "self-harm"),
+]
+
+
+@pytest.mark.parametrize("description, flag", RED_FLAG_CASES)
+def test_each_red_flag_makes_the_symptom_severe(description, flag):
+    assert local_triage.red_flags(description) == [flag]
+    result = local_triage.triage_symptom(description)
+    assert result["severity"] == "Severe"
+    assert result["red_flags"] == [flag]
+    assert flag in result["advice"]
+
+
+def test_every_red_flag_has_a_case():
+    assert {flag for _, flag in RED_FLAG_CASES} == set(local_triage.RED_FLAGS)
+
+
+# (description, expected severity, expected red flags)
+TRIAGE_CASES = [
+    # Negated red flags
+    ("no chest pain today", "Moderate", []),
+    ("Denies chest pain", "Moderate", []),
+    ("I don't have any chest pain", "Moderate", []),
+    ("I have not fainted", "Moderate", []),
+    ("without a fever of 103", "Moderate", []),
+    # A negation only covers the phrase it is in front of
+    ("no chest pain, but I fainted", "Severe", ["fainting"]),
+    ("I have chest pain, no fever", "Severe", ["chest pain"]),
+    ("no pain at first, then chest pain", "Severe", ["chest pain"]),
+    ("denies chest pain or shortness of breath", "Severe", ["difficulty breathing"]),
+    # Mild only on the patient's own words
+    ("a mild rash on my arm", "Mild", []),
+    ("slight swelling around the knee", "Mild", []),
+    ("a little sore after the walk", "Mild", []),
+    ("no chest pain, just a minor headache", "Mild", []),
+    ("not mild at all, it keeps throbbing", "Moderate", []),
+    # A red flag outranks a mild cue
+    ("a mild cough, but I coughed up blood", "Severe", ["coughing or vomiting blood"]),
+    # Anything else is Moderate
+    ("my knee hurts", "Moderate", []),
+    ("fever of 100", "Moderate", []),
+    ("", "Moderate", []),
+]
+
+
+@pytest.mark.parametrize("description, severity, flags", TRIAGE_CASES)
+def test_triage_severity(description, severity, flags):
+    result = local_triage.triage_symptom(description)
+    assert result["severity"] == severity
+    assert result["red_flags"] == flags
+    assert result["analysis_source"] == "local"
+
+
+def test_triage_uses_given_flags():
+    result = local_triage.triage_symptom("a mild rash", flags=["fainting"])
+    assert result["severity"] == "Severe"
+    assert result["red_flags"] == ["fainting"]
+
+
+@pytest.mark.parametrize("text, lower, upper", [
+    ("I feel calm and hopeful today", -1.0, -0.5),
+    ("Today was an ordinary day", -0.1, 0.1),
+    ("I am so anxious and exhausted, everything hurts", 0.5, 1.0),
+    ("I am not worried", -1.0, -0.1),
+    ("I am not happy", 0.1, 1.0),
+])
+def test_journal_sentiment_bands(text, lower, upper):
+    score = local_triage.sentiment_score(text)
+    assert lower <= score <= upper
+    assert local_triage.analyze_journal(text)["sentiment_score"] == score
+
+
+# --- Reconciling with the model ---
+@pytest.mark.parametrize("model_severity, keeps_model", [
+    ("Severe", True),
+    ("Moderate", False),
+    ("Mild", False),
+    (None, False),
+])
+def test_reconcile_keeps_severe_for_red_flags(model_severity, keeps_model):
+    provisional = local_triage.triage_symptom("crushing chest pain")
+    model_result = {"severity": model_severity, "advice": "model advice"}
+    reconciled = analyzer._reconcile_symptom(model_result, provisional)
+    assert reconciled == (model_result if keeps_model else None)
+
+
+@pytest.mark.parametrize("model_severity", ["Mild", "Moderate", "Severe"])
+def test_reconcile_trusts_the_model_without_red_flags(model_severity):
+    provisional = local_triage.triage_symptom("a mild rash")
+    model_result = {"severity": model_severity, "advice": "model advice"}
+    assert analyzer._reconcile_symptom(model_result, provisional) is model_result
+
+
+class FakeResponse:
+    def __init__(self, payload: dict):
+        self.text = json.dumps(payload)
+        self.parts = [self.text]
+
+
+class FakeSymptomModel:
+    def __init__(self, severity: str):
+        self.severity = severity
+
+    def generate_content(self, contents, safety_settings=None):
+        return FakeResponse({"severity": self.severity, "advice": "Rest at home."})
+
+
+@pytest.mark.parametrize("description, model_severity, expected", [
+    ("I have chest pain", "Mild", "Severe"),
+    ("I have chest pain", "Severe", "Severe"),
+    ("no chest pain, a mild rash", "Mild", "Mild"),
+    ("my knee hurts", "Mild", "Mild"),
+])
+def test_symptom_analysis_never_downgrades_a_red_flag(monkeypatch, description, model_severity, expected):
+    monkeypatch.setattr(analyzer, "_get_models", lambda: (None, FakeSymptomModel(model_severity)))
+    result = analyzer.analyze_symptom_with_image(description)
+    assert result["severity"] == expected
+    if expected != model_severity:
+        assert result["analysis_source"] == "local"
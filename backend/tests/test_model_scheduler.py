@@ -0,0 +1,254 @@
+# backend/tests/test_model_scheduler.py
+"""Admission order, shedding, per-user limits and 429 retries of the model scheduler."""
+import asyncio
+
+import pytest
+
+from backend import model_scheduler as scheduler_module
+from backend.model_scheduler import ModelScheduler, ModelShed
+
+
+class FakeClock:
+    """Stands in for the scheduler's `time` module, so token buckets refill only when told to."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(scheduler_module, "time", fake)
+    return fake
+
+
+def make_scheduler(**overrides) -> ModelScheduler:
+    """A scheduler with no global or per-user rate unless a test asks for one."""
+    options = dict(max_concurrency=1, rate=0, burst=1, user_rate_per_minute=0, user_burst=1,
+                   max_queued=16, queue_timeout=5.0, retry_attempts=3, retry_base=0.01, retry_max=1.0)
+    options.update(overrides)
+    return ModelScheduler(**options)
+
+
+class FakeModel:
+    """A model call that blocks until released and records the order calls started in."""
+    def __init__(self):
+        self.started = []
+        self.release = asyncio.Event()
+
+    def call(self, name: str):
+        async def run():
+            self.started.append(name)
+            await self.release.wait()
+            return name
+        return run
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+# --- Priority ---
+def test_waiters_are_granted_by_priority_then_arrival(clock):
+    async def scenario():
+        scheduler = make_scheduler()
+        model = FakeModel()
+        holder = asyncio.create_task(scheduler.run(model.call("holder"), priority="journal"))
+        await settle()
+        order = [("background", "bg-1"), ("journal", "journal-1"), ("symptom", "symptom-1"),
+                 ("background", "bg-2"), ("urgent", "urgent-1"), ("journal", "journal-2")]
+        waiting = []
+        for priority, name in order:
+            waiting.append(asyncio.create_task(scheduler.run(model.call(name), priority=priority)))
+            await settle()
+        assert scheduler.queued() == len(order)
+        assert model.started == ["holder"]
+
+        model.release.set()
+        results = await asyncio.gather(holder, *waiting)
+        assert results == ["holder"] + [name for _, name in order]
+        return model.started, scheduler.get_stats()
+
+    started, stats = asyncio.run(scenario())
+    assert started == ["holder", "urgent-1", "symptom-1", "journal-1", "journal-2", "bg-1", "bg-2"]
+    assert stats["granted"] == 7
+    assert stats["queued"] == 0 and stats["in_flight"] == 0
+
+
+# --- Shedding ---
+def test_waiter_is_shed_after_queue_timeout(clock):
+    async def scenario():
+        scheduler = make_scheduler(queue_timeout=0.05)
+        model = FakeModel()
+        holder = asyncio.create_task(scheduler.run(model.call("holder")))
+        await settle()
+        with pytest.raises(ModelShed) as shed:
+            await scheduler.run(model.call("late"), priority="symptom")
+        assert shed.value.reason == "queue_timeout"
+        assert scheduler.queued() == 0
+        model.release.set()
+        await holder
+        return model.started, scheduler.get_stats()
+
+    started, stats = asyncio.run(scenario())
+    assert started == ["holder"]
+    assert stats["shed"] == 1 and stats["in_flight"] == 0
+
+
+def test_full_queue_displaces_the_lowest_priority_waiter(clock):
+    async def scenario():
+        scheduler = make_scheduler(max_queued=2)
+        model = FakeModel()
+        holder = asyncio.create_task(scheduler.run(model.call("holder")))
+        await settle()
+        old_bg = asyncio.create_task(scheduler.run(model.call("bg-old"), priority="background"))
+        await settle()
+        new_bg = asyncio.create_task(scheduler.run(model.call("bg-new"), priority="background"))
+        await settle()
+
+        # Full: a symptom pushes out the newest of the lowest-priority waiters
+        symptom = asyncio.create_task(scheduler.run(model.call("symptom"), priority="symptom"))
+        await settle()
+        with pytest.raises(ModelShed) as displaced:
+            await new_bg
+        assert displaced.value.reason == "displaced"
+
+        # Still full, and nothing below a background request to push out
+        with pytest.raises(ModelShed) as full:
+            await scheduler.run(model.call("bg-rejected"), priority="background")
+        assert full.value.reason == "queue_full"
+
+        model.release.set()
+        assert await asyncio.gather(holder, symptom, old_bg) == ["holder", "symptom", "bg-old"]
+        return model.started, scheduler.get_stats()
+
+    started, stats = asyncio.run(scenario())
+    assert started == ["holder", "symptom", "bg-old"]
+    assert stats["displaced"] == 1
+    assert stats["shed"] == 2
+    assert stats["queued"] == 0 and stats["in_flight"] == 0
+
+
+# --- Per-user limit ---
+def test_per_user_bucket_limits_one_patient_only(clock):
+    async def scenario():
+        scheduler = make_scheduler(max_concurrency=4, user_rate_per_minute=60, user_burst=2)
+
+        async def answer():
+            return "ok"
+
+        assert await scheduler.run(answer, user_id=1) == "ok"
+        assert await scheduler.run(answer, user_id=1) == "ok"
+        with pytest.raises(ModelShed) as shed:
+            await scheduler.run(answer, user_id=1)
+        assert shed.value.reason == "user_rate"
+
+        # Other patients, urgent reports and calls without a patient are not limited by it
+        assert await scheduler.run(answer, user_id=2) == "ok"
+        assert await scheduler.run(answer, user_id=1, priority="urgent") == "ok"
+        assert await scheduler.run(answer) == "ok"
+
+        # One token a second comes back
+        clock.advance(1.0)
+        assert await scheduler.run(answer, user_id=1) == "ok"
+        with pytest.raises(ModelShed):
+            await scheduler.run(answer, user_id=1)
+        return scheduler.get_stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["shed"] == 2
+    assert stats["tracked_users"] == 2
+
+
+def test_global_bucket_holds_waiters_until_refilled(clock):
+    async def scenario():
+        scheduler = make_scheduler(max_concurrency=4, rate=1, burst=1)
+        model = FakeModel()
+        model.release.set()
+        assert await scheduler.run(model.call("first")) == "first"
+
+        second = asyncio.create_task(scheduler.run(model.call("second")))
+        await settle()
+        assert model.started == ["first"] and scheduler.queued() == 1
+
+        clock.advance(1.0)
+        scheduler._on_timer()
+        assert await second == "second"
+        return model.started
+
+    assert asyncio.run(scenario()) == ["first", "second"]
+
+
+# --- Rate-limit retries ---
+class RateLimited(Exception):
+    code = 429
+
+
+def test_rate_limited_calls_retry_with_full_jitter(clock, monkeypatch):
+    bounds = []
+
+    def uniform(low, high):
+        bounds.append((low, high))
+        return 0.0
+
+    monkeypatch.setattr(scheduler_module.random, "uniform", uniform)
+
+    async def scenario():
+        scheduler = make_scheduler(retry_attempts=4, retry_base=0.5, retry_max=1.5)
+        attempts = []
+
+        async def flaky():
+            attempts.append(len(attempts))
+            if len(attempts) < 3:
+                raise RateLimited()
+            return "answer"
+
+        assert await scheduler.run(flaky) == "answer"
+        assert len(attempts) == 3
+
+        async def always_limited():
+            raise RateLimited()
+
+        with pytest.raises(RateLimited):
+            await scheduler.run(always_limited)
+
+        async def broken():
+            raise ValueError("not a rate limit")
+
+        with pytest.raises(ValueError):
+            await scheduler.run(broken)
+        return scheduler.get_stats()
+
+    stats = asyncio.run(scenario())
+    # Backoff doubles from the base and is capped at retry_max
+    assert bounds == [(0, 1.0), (0, 1.5), (0, 1.0), (0, 1.5), (0, 1.5)]
+    assert stats["retries"] == 5
+    assert stats["in_flight"] == 0
+
+
+# --- Event loop changes ---
+def test_new_event_loop_cancels_the_old_timer(clock):
+    scheduler = make_scheduler(rate=1, burst=1, queue_timeout=0.01)
+
+    async def answer():
+        return "ok"
+
+    async def hold_a_timer():
+        await scheduler.run(answer)
+        with pytest.raises(ModelShed):
+            await scheduler.run(answer)
+        return scheduler._timer
+
+    old_timer = asyncio.run(hold_a_timer())
+    assert old_timer is not None and not old_timer.cancelled()
+
+    clock.advance(1.0)
+    assert asyncio.run(scheduler.run(answer)) == "ok"
+    assert old_timer.cancelled()
+    assert scheduler._timer is None
@@ -0,0 +1,95 @@
+# backend/tests/test_replay.py
+"""
+The replay's score series for a small seeded cohort, against a committed golden
+series. If a change is meant to alter scores, regenerate it with
+
+    python -m backend.replay --synthetic --patients 3 --days 2 --hrv-per-day 12 --seed 7 \
+        --output backend/tests/data/replay_golden.csv
+"""
+import io
+import os
+import sys
+import json
+import datetime
+
+from backend import replay
+from backend.replay import SERIES_HEADER, Replay, synthetic_events
+
+GOLDEN = os.path.join(os.path.dirname(__file__), "data", "replay_golden.csv")
+COHORT = ["--synthetic", "--patients", "3", "--days", "2", "--hrv-per-day", "12", "--seed", "7"]
+
+
+def cohort():
+    return synthetic_events(3, 2, datetime.datetime(2025, 1, 1), hrv_per_day=12, seed=7)
+
+
+def run_cli(monkeypatch, capsys, *args) -> dict:
+    monkeypatch.setattr(sys, "argv", ["replay", *COHORT, *args])
+    code = 0
+    try:
+        replay.main()
+    except SystemExit as e:
+        code = e.code
+    report = json.loads(capsys.readouterr().out)
+    report["exit_code"] = code
+    return report
+
+
+def test_series_matches_the_golden_file():
+    with open(GOLDEN) as expect:
+        assert expect.readline().rstrip("\n") == SERIES_HEADER
+        run = Replay(expect=expect)
+        run.run(cohort())
+        run.check_expect_exhausted()
+    assert run.first_mismatch is None, run.first_mismatch
+    # Every kind of event, plus the heartbeat, shows up in the series
+    with open(GOLDEN) as f:
+        triggers = {line.split(",")[2] for line in list(f)[1:]}
+    assert triggers == {"hrv", "sentiment", "symptom", "biomarker", "tick"}
+
+
+def test_two_runs_are_identical():
+    first, second = io.StringIO(), io.StringIO()
+    for output in (first, second):
+        Replay(output=output).run(cohort())
+    assert first.getvalue() == second.getvalue() != ""
+
+
+def test_expect_passes_on_the_golden_file(monkeypatch, capsys):
+    report = run_cli(monkeypatch, capsys, "--expect", GOLDEN)
+    assert report["matches_expected"] is True
+    assert report["exit_code"] == 0
+
+
+def test_expect_fails_on_a_changed_score(monkeypatch, capsys, tmp_path):
+    with open(GOLDEN) as f:
+        lines = f.readlines()
+    fields = lines[40].rstrip("\n").split(",")
+    fields[3] = repr(float(fields[3]) + 1e-9) # one score off in the last digits
+    lines[40] = ",".join(fields) + "\n"
+    changed = tmp_path / "changed.csv"
+    changed.write_text("".join(lines))
+
+    report = run_cli(monkeypatch, capsys, "--expect", str(changed))
+    assert report["exit_code"] == 1
+    assert report["matches_expected"] is False
+    assert report["first_mismatch"]["score"] == 40
+
+
+def test_expect_fails_on_a_shorter_series(monkeypatch, capsys, tmp_path):
+    longer = tmp_path / "longer.csv"
+    with open(GOLDEN) as f:
+        longer.write_text(f.read() + "2025-01-03T00:00:00,1,tick,50.0,50.0,50.0,50.0,50.0\n")
+    report = run_cli(monkeypatch, capsys, "--expect", str(longer))
+    assert report["exit_code"] == 1
+    assert report["first_mismatch"]["actual"] is None
+
+
+def test_output_then_expect_round_trips(monkeypatch, capsys, tmp_path):
+    series = tmp_path / "series.csv"
+    written = run_cli(monkeypatch, capsys, "--output", str(series))
+    checked = run_cli(monkeypatch, capsys, "--expect", str(series))
+    assert checked["matches_expected"] is True
+    assert checked["series_sha256"] == written["series_sha256"]
+    with open(GOLDEN) as f:
+        assert series.read_text() == f.read()
@@ -0,0 +1,105 @@
+# backend/tests/test_single_writer.py
+"""The background sync writers share the async writer connection while the app's loop is bound."""
+import asyncio
+import datetime
+import random
+
+import pytest
+from sqlalchemy import event, func
+
+from backend import crud, database, models
+from backend.event_log import PatientEventLog
+from backend.score_history import ScoreHistory
+from backend.state_manager import PatientRegistry
+
+WRITES = ("INSERT", "UPDATE", "DELETE")
+
+
+@pytest.fixture
+def sync_engine_writes():
+    """Every write statement the sync engine executes during the test."""
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(WRITES):
+            seen.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", record)
+    yield seen
+    event.remove(database.engine, "before_cursor_execute", record)
+
+
+def count(model, *criteria) -> int:
+    db = database.SessionLocal()
+    try:
+        return db.query(func.count()).select_from(model).filter(*criteria).scalar()
+    finally:
+        db.close()
+
+
+def test_concurrent_sync_and_async_writes_use_one_writer(sync_engine_writes):
+    user_ids = random.Random(11).sample(range(100_000, 200_000), 6)
+    events, history, registry = PatientEventLog(), ScoreHistory(), PatientRegistry()
+    started = datetime.datetime.utcnow()
+
+    def event_writer(user_id):
+        for i in range(40):
+            events.append(user_id, "hrv", float(i))
+            events.flush()
+        registry.compact(user_id)
+
+    def score_writer(user_id):
+        for i in range(40):
+            with history._pending_lock:
+                history._pending.append((user_id, "progress_score", started, float(i)))
+            history.flush()
+
+    async def journal_writer(user_id):
+        for _ in range(40):
+            async with database.AsyncWriteSessionLocal() as db:
+                await crud.create_journal_entry_async(db, models.JournalEntryCreate(content="x", user_id=user_id),
+                                                      {"sentiment_score": 0.5})
+
+    async def run():
+        database.bind_write_loop(asyncio.get_running_loop())
+        try:
+            await asyncio.gather(*(asyncio.to_thread(event_writer, u) for u in user_ids[:2]),
+                                 *(asyncio.to_thread(score_writer, u) for u in user_ids[2:4]),
+                                 *(journal_writer(u) for u in user_ids[4:]))
+        finally:
+            database.bind_write_loop(None)
+
+    asyncio.run(run())
+
+    assert sync_engine_writes == []
+    for user_id in user_ids[:2]:
+        assert count(database.PatientEvent, database.PatientEvent.user_id == user_id) == 40
+        assert count(database.PatientSnapshot, database.PatientSnapshot.user_id == user_id) == 1
+    for user_id in user_ids[2:4]:
+        rollup = database.TimeSeriesRollup
+        db = database.SessionLocal()
+        try:
+            assert db.query(rollup.count).filter(rollup.user_id == user_id, rollup.resolution == "1m").scalar() == 40
+        finally:
+            db.close()
+    for user_id in user_ids[4:]:
+        assert count(database.JournalEntry, database.JournalEntry.user_id == user_id) == 40
+
+
+def test_run_write_refuses_to_block_the_loop():
+    async def run():
+        database.bind_write_loop(asyncio.get_running_loop())
+        try:
+            with pytest.raises(RuntimeError):
+                database.run_write(crud.append_patient_events, [])
+        finally:
+            database.bind_write_loop(None)
+
+    asyncio.run(run())
+
+
+def test_run_write_without_a_loop_uses_a_plain_session():
+    user_id = random.Random(12).randrange(200_000, 300_000)
+    rows = database.run_write(crud.append_patient_events, [(user_id, "hrv", 40.0, None, datetime.datetime.utcnow(), None)])
+    assert len(rows) == 1
+    assert count(database.PatientEvent, database.PatientEvent.user_id == user_id) == 1
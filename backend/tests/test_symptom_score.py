@@ -0,0 +1,128 @@
+# backend/tests/test_symptom_score.py
+"""
+SymptomScoreAggregator against the loop it replaced. The aggregator is exact up to
+one final rounding, so it must equal the exactly computed score bit for bit, and
+the old float loop to within its own rounding error.
+"""
+import random
+import datetime
+from dataclasses import dataclass
+from fractions import Fraction
+
+import pytest
+
+from backend.state_manager import SEVERITY_WEIGHTS, SymptomScoreAggregator, _to_us
+
+NOW = datetime.datetime(2024, 3, 10, 12, 0, 0)
+SEVERITIES = ["Mild", "Moderate", "Severe", "Unknown"]
+# Score times for each case, oldest first: the aggregator's expiry only moves forward
+OFFSETS = [datetime.timedelta(0), datetime.timedelta(hours=5, microseconds=7),
+           datetime.timedelta(days=2, seconds=13), datetime.timedelta(days=6, hours=23),
+           datetime.timedelta(days=7), datetime.timedelta(days=9)]
+# The old loop rounds at every step; this is orders of magnitude above that error
+LEGACY_TOLERANCE = 1e-12
+
+
+@dataclass
+class Report:
+    severity: str
+    timestamp: datetime.datetime
+
+
+def legacy_score(reports, now: datetime.datetime) -> float:
+    """PatientState.recalculate_symptom_score before the aggregator, with `now` passed in."""
+    severity_weights = {"Mild": 1.0, "Moderate": 2.5, "Severe": 5.0}
+    new_score = 0.0
+    for symptom in reports:
+        days_old = (now - symptom.timestamp).total_seconds() / 86400
+        decay = max(0, (7.0 - days_old) / 7.0)
+        base_weight = severity_weights.get(symptom.severity, 0.0)
+        new_score += base_weight * decay
+    return min(10.0, new_score)
+
+
+def exact_score(reports, now: datetime.datetime) -> float:
+    """The same formula in exact arithmetic, rounded once at the end."""
+    window = 7 * 86400 * 1_000_000
+    total = Fraction(0)
+    for report in reports:
+        age = _to_us(now) - _to_us(report.timestamp)
+        decay = max(Fraction(0), Fraction(window - age, window))
+        total += Fraction(SEVERITY_WEIGHTS.get(report.severity, 0.0)) * decay
+    return min(10.0, float(total))
+
+
+def random_reports(rng: random.Random, count: int):
+    return [Report(rng.choice(SEVERITIES),
+                   NOW - datetime.timedelta(microseconds=rng.randrange(9 * 86400 * 1_000_000)))
+            for _ in range(count)]
+
+
+def assert_matches(aggregator: SymptomScoreAggregator, reports):
+    for offset in OFFSETS:
+        now = NOW + offset
+        score = aggregator.score(now)
+        assert score == exact_score(reports, now)
+        assert score == pytest.approx(legacy_score(reports, now), abs=LEGACY_TOLERANCE)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_add_matches_original_loop(seed):
+    rng = random.Random(seed)
+    reports = sorted(random_reports(rng, rng.randrange(0, 12)), key=lambda r: r.timestamp)
+    aggregator = SymptomScoreAggregator()
+    for report in reports:
+        aggregator.add(report.severity, report.timestamp)
+    assert_matches(aggregator, reports)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_rebuild_matches_original_loop(seed):
+    rng = random.Random(seed)
+    reports = random_reports(rng, rng.randrange(0, 12))
+    aggregator = SymptomScoreAggregator()
+    aggregator.add("Severe", NOW) # replaced by the rebuild
+    aggregator.rebuild(reports)
+    assert_matches(aggregator, reports)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_out_of_order_adds_match_original_loop(seed):
+    rng = random.Random(seed)
+    reports = random_reports(rng, rng.randrange(2, 12))
+    aggregator = SymptomScoreAggregator()
+    for report in reports: # unsorted
+        aggregator.add(report.severity, report.timestamp)
+    in_order = SymptomScoreAggregator()
+    in_order.rebuild(reports)
+    assert aggregator.score(NOW) == in_order.score(NOW)
+    assert_matches(aggregator, reports)
+
+
+def test_reports_expire_after_seven_days():
+    aggregator = SymptomScoreAggregator()
+    reports = [Report("Severe", NOW - datetime.timedelta(days=7)),
+               Report("Moderate", NOW - datetime.timedelta(days=7, microseconds=-1)),
+               Report("Mild", NOW - datetime.timedelta(days=1))]
+    for report in reports:
+        aggregator.add(report.severity, report.timestamp)
+
+    # Exactly seven days old contributes nothing and is dropped
+    assert aggregator.score(NOW) == exact_score(reports, NOW) == pytest.approx(legacy_score(reports, NOW))
+    assert len(aggregator) == 2
+    later = NOW + datetime.timedelta(days=6)
+    assert aggregator.score(later) == exact_score(reports, later) == pytest.approx(legacy_score(reports, later))
+    assert len(aggregator) == 0
+    assert aggregator.score(later) == legacy_score(reports, later) == 0.0
+
+
+def test_score_is_capped_at_ten():
+    reports = [Report("Severe", NOW - datetime.timedelta(hours=i)) for i in range(5)]
+    aggregator = SymptomScoreAggregator()
+    aggregator.rebuild(reports)
+    assert aggregator.score(NOW) == legacy_score(reports, NOW) == 10.0
+    # Once enough of them have decayed, the cap no longer applies
+    later = NOW + datetime.timedelta(days=5)
+    assert aggregator.score(later) < 10.0
+    assert aggregator.score(later) == exact_score(reports, later)
+    assert aggregator.score(later) == pytest.approx(legacy_score(reports, later), abs=LEGACY_TOLERANCE)
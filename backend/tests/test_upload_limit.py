@@ -0,0 +1,88 @@
+# backend/tests/test_upload_limit.py
+"""Oversized uploads are refused with 413 before the multipart body is parsed."""
+from typing import Optional
+
+import pytest
+from fastapi import FastAPI, File, Form, UploadFile
+from fastapi.testclient import TestClient
+
+from backend import media
+
+LIMIT = 4096
+
+
+@pytest.fixture
+def upload_app():
+    app = FastAPI()
+    app.add_middleware(media.UploadSizeLimit, paths=("/upload",), max_bytes=LIMIT)
+    app.state.calls = 0
+
+    @app.post("/upload")
+    async def upload(description: str = Form(...), photo: Optional[UploadFile] = File(None)):
+        app.state.calls += 1
+        return {"size": len(await photo.read()) if photo else 0}
+
+    @app.post("/other")
+    async def other(photo: UploadFile = File(...)):
+        return {"size": len(await photo.read())}
+
+    return app
+
+
+def multipart(photo_bytes: int) -> tuple:
+    boundary = "limit-test-boundary"
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"description\"\r\n\r\nrash\r\n"
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"photo\"; filename=\"p.jpg\"\r\n"
+            f"Content-Type: image/jpeg\r\n\r\n").encode() + b"\xff" * photo_bytes + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def chunked(body: bytes, size: int = 1024):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def test_small_upload_passes(upload_app):
+    body, headers = multipart(1000)
+    response = TestClient(upload_app).post("/upload", content=body, headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"size": 1000}
+
+
+def test_declared_length_over_the_limit_is_refused_up_front(upload_app):
+    body, headers = multipart(LIMIT)
+    response = TestClient(upload_app).post("/upload", content=body, headers=headers)
+    assert response.status_code == 413
+    assert "smaller than" in response.json()["detail"]
+    assert upload_app.state.calls == 0
+
+
+def test_chunked_body_over_the_limit_is_cut_off(upload_app):
+    body, headers = multipart(LIMIT * 4)
+    response = TestClient(upload_app).post("/upload", content=chunked(body), headers=headers)
+    assert response.status_code == 413
+    assert upload_app.state.calls == 0
+
+
+def test_chunked_body_under_the_limit_passes(upload_app):
+    body, headers = multipart(1000)
+    response = TestClient(upload_app).post("/upload", content=chunked(body, 100), headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"size": 1000}
+
+
+def test_other_paths_are_not_limited(upload_app):
+    body, headers = multipart(LIMIT * 2)
+    response = TestClient(upload_app).post("/other", content=body, headers=headers)
+    assert response.status_code == 200
+
+
+def test_symptom_endpoint_is_guarded_behind_cors():
+    from backend.main import app
+
+    body, headers = multipart(0)
+    headers.update({"Content-Length": str(media.MAX_UPLOAD_REQUEST_BYTES + 1), "Origin": "http://localhost:3000"})
+    # Only the declared length is looked at; nothing is read, analyzed or stored
+    response = TestClient(app).post("/api/symptom-analysis", content=body, headers=headers)
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"]
@@ -0,0 +1,50 @@
+# backend/tests/test_warm_start.py
+"""The warm start preloads recently active patients and stops early when asked to."""
+import threading
+
+import pytest
+
+from backend import crud, database
+from backend.state_manager import PatientRegistry
+
+USER_IDS = [7300, 7301, 7302, 7303]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def snapshots():
+    db = database.SessionLocal()
+    try:
+        for user_id in USER_IDS:
+            crud.save_patient_snapshot(db, user_id, last_event_id=1, hrv=55.0, avg_sentiment=0.0,
+                                       clinical_biomarker=10.0, symptoms=[])
+    finally:
+        db.close()
+
+
+def test_warm_start_loads_the_recent_patients():
+    registry = PatientRegistry()
+    assert registry.warm_start(len(USER_IDS)) == len(USER_IDS)
+    assert len(registry) == len(USER_IDS)
+
+
+def test_warm_start_does_nothing_once_stopped():
+    registry = PatientRegistry()
+    stop = threading.Event()
+    stop.set()
+    assert registry.warm_start(len(USER_IDS), stop) == 0
+    assert len(registry) == 0
+
+
+def test_warm_start_stops_between_patients():
+    registry = PatientRegistry()
+    stop = threading.Event()
+    load = registry.get
+
+    def get_then_stop(user_id):
+        state = load(user_id)
+        stop.set()
+        return state
+
+    registry.get = get_then_stop
+    assert registry.warm_start(len(USER_IDS), stop) == 1
+    assert len(registry) == 1
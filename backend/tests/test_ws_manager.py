@@ -0,0 +1,147 @@
+# backend/tests/test_ws_manager.py
+"""Per-connection send queues: a slow dashboard is conflated or dropped without holding up the others."""
+import asyncio
+import json
+
+import pytest
+
+from backend import ws_manager as ws_module
+from backend.backplane import create_backplane
+from backend.ws_manager import ConnectionManager, patient_topic
+
+
+class FakeWebSocket:
+    """Records what was sent. A slow one blocks in send_text until `unblock` is set."""
+    def __init__(self, name: str, slow: bool = False):
+        self.client = name
+        self.sent = []
+        self.closed = False
+        self.unblock = asyncio.Event()
+        if not slow:
+            self.unblock.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, payload: str):
+        await self.unblock.wait()
+        self.sent.append(json.loads(payload)["seq"])
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def local_backplane(monkeypatch):
+    """A fresh in-process backplane, so each test starts with no subscriptions."""
+    monkeypatch.setattr(ws_module, "backplane", create_backplane(""))
+    monkeypatch.setattr(ws_module, "WS_SEND_QUEUE_SIZE", 3)
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+async def connect_pair(manager: ConnectionManager):
+    fast, slow = FakeWebSocket("fast"), FakeWebSocket("slow", slow=True)
+    await manager.connect(fast, user_id=1)
+    await manager.connect(slow, user_id=1)
+    await settle()
+    return fast, slow
+
+
+async def publish_many(manager: ConnectionManager, count: int):
+    """Publishes seq 0..count-1, letting the senders run in between; the slow one stays stuck on seq 0."""
+    for seq in range(count):
+        assert manager.publish(patient_topic(1), {"seq": seq}) == 2
+        await settle()
+
+
+def test_conflate_keeps_the_latest_packet_for_a_slow_client(monkeypatch):
+    monkeypatch.setattr(ws_module, "WS_SLOW_CONSUMER_POLICY", "conflate")
+
+    async def scenario():
+        manager = ConnectionManager()
+        fast, slow = await connect_pair(manager)
+        await publish_many(manager, 10)
+        await settle()
+        assert fast.sent == list(range(10))
+        # The slow client holds one message in send_text and a bounded backlog
+        assert manager.send_backlog() <= 3
+        slow.unblock.set()
+        await settle()
+        assert manager.connection_count() == 2
+        client = manager._clients[slow]
+        manager.disconnect(fast)
+        manager.disconnect(slow)
+        return slow, client.conflations
+
+    slow, conflations = asyncio.run(scenario())
+    # Stuck on 0 while 1..3 queued; 4 and then 7 found the queue full and replaced the backlog
+    assert slow.sent == [0, 7, 8, 9]
+    assert conflations == 2
+    assert not slow.closed
+
+
+def test_drop_evicts_a_slow_client(monkeypatch):
+    monkeypatch.setattr(ws_module, "WS_SLOW_CONSUMER_POLICY", "drop")
+
+    async def scenario():
+        manager = ConnectionManager()
+        fast, slow = await connect_pair(manager)
+        await publish_many(manager, 4)
+        await settle()
+        # 1..3 filled the slow client's queue, so the next message drops it; the fast one is not affected
+        assert manager.publish(patient_topic(1), {"seq": 4}) == 1
+        await settle()
+        assert manager.connection_count() == 1
+        assert manager._topics[patient_topic(1)] == {fast}
+        slow.unblock.set()
+        await settle()
+        manager.disconnect(fast)
+        return fast, slow
+
+    fast, slow = asyncio.run(scenario())
+    assert fast.sent == [0, 1, 2, 3, 4]
+    assert slow.closed
+    assert slow.sent == []
+
+
+def test_stalled_send_times_out_and_disconnects(monkeypatch):
+    monkeypatch.setattr(ws_module, "WS_SEND_TIMEOUT_SECONDS", 0.05)
+
+    async def scenario():
+        manager = ConnectionManager()
+        fast, slow = await connect_pair(manager)
+        await publish_many(manager, 1)
+        await asyncio.sleep(0.2)
+        assert manager.connection_count() == 1
+        assert patient_topic(1) in manager._topics
+        manager.disconnect(fast)
+        await settle()
+        assert manager._topics == {}
+        return fast, slow
+
+    fast, slow = asyncio.run(scenario())
+    assert fast.sent == [0]
+    assert slow.closed
+
+
+def test_send_to_user_reaches_only_that_patients_dashboards():
+    async def scenario():
+        manager = ConnectionManager()
+        first, second = FakeWebSocket("first"), FakeWebSocket("second")
+        await manager.connect(first, user_id=1)
+        await manager.connect(second, user_id=2)
+        await settle()
+        await manager.send_to_user(2, {"seq": 7})
+        await manager.broadcast({"seq": 8})
+        await settle()
+        manager.disconnect(first)
+        manager.disconnect(second)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.sent == [8]
+    assert second.sent == [7, 8]
@@ -0,0 +1,54 @@
+# app/timeseries.py
+import datetime
+from typing import Dict, Iterable, Tuple
+
+# The metrics the companion app may send, and the rollup resolutions we maintain.
+METRICS = ("hrv", "heart_rate", "sleep_hours")
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+RollupKey = Tuple[str, str, datetime.datetime] # (metric, resolution, bucket_start)
+
+
+def to_naive_utc(timestamp: datetime.datetime) -> datetime.datetime:
+    """The database stores naive UTC timestamps, like the rest of the app."""
+    if timestamp.tzinfo is not None:
+        return timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def bucket_start(timestamp: datetime.datetime, resolution: str) -> datetime.datetime:
+    """Truncates a naive UTC timestamp to the start of its bucket."""
+    seconds = RESOLUTIONS[resolution]
+    offset = int((timestamp - _EPOCH).total_seconds()) // seconds * seconds
+    return _EPOCH + datetime.timedelta(seconds=offset)
+
+
+def aggregate(samples: Iterable[Tuple[str, datetime.datetime, float]]) -> Dict[RollupKey, dict]:
+    """
+    Folds (metric, timestamp, value) samples into count/sum/min/max per bucket for
+    every resolution, ready to be merged into the rollup table.
+    """
+    rollups: Dict[RollupKey, dict] = {}
+    for metric, timestamp, value in samples:
+        for resolution in RESOLUTIONS:
+            key = (metric, resolution, bucket_start(timestamp, resolution))
+            bucket = rollups.get(key)
+            if bucket is None:
+                rollups[key] = {"count": 1, "sum": value, "min": value, "max": value}
+            else:
+                bucket["count"] += 1
+                bucket["sum"] += value
+                bucket["min"] = min(bucket["min"], value)
+                bucket["max"] = max(bucket["max"], value)
+    return rollups
+
+
+def choose_resolution(start: datetime.datetime, end: datetime.datetime, max_points: int = 1000) -> str:
+    """Picks the finest resolution that keeps a range query under `max_points` buckets."""
+    span = (end - start).total_seconds()
+    for resolution, seconds in RESOLUTIONS.items():
+        if span / seconds <= max_points:
+            return resolution
+    return "1d"
@@ -1,38 +1,186 @@
 # app/ws_manager.py
+import os
+import time
 import asyncio
 import json
-from typing import List
+import logging
+from typing import Dict, List, Optional, Set
 from fastapi import WebSocket
 
+from . import metrics
+from .backplane import backplane
+
+logger = logging.getLogger(__name__)
+
+# Each connection gets its own bounded outbox. A client that cannot keep up either
+# has its backlog replaced by the newest message ("conflate") or is dropped ("drop").
+# Either way, a client whose send stalls past the timeout is disconnected.
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "16"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "5"))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "conflate")
+
+
+def patient_topic(user_id: int) -> str:
+    """The topic a dashboard subscribes to in order to follow one patient."""
+    return f"patient:{user_id}"
+
+
+class _Client:
+    """One connected socket, its outbox, and the task that drains it."""
+    __slots__ = ("websocket", "topics", "queue", "sender", "conflations")
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.topics: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.sender: Optional[asyncio.Task] = None
+        self.conflations = 0
+
+
 class ConnectionManager:
-    """Manages active WebSocket connections."""
+    """
+    Manages active WebSocket connections and their topic subscriptions.
+
+    Messages are serialized once per publish and handed to each subscriber's
+    bounded queue without awaiting, so a slow client never delays the others.
+    Patient messages travel through the backplane, so a dashboard receives them
+    no matter which worker it is connected to.
+    """
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self._clients: Dict[WebSocket, _Client] = {}
+        self._topics: Dict[str, Set[WebSocket]] = {}
 
-    async def connect(self, websocket: WebSocket):
-        """Accepts a new WebSocket connection."""
+    async def connect(self, websocket: WebSocket, user_id: Optional[int] = 1):
+        """Accepts a new WebSocket connection, subscribed to one patient's updates."""
         await websocket.accept()
-        self.active_connections.append(websocket)
-        print(f"New connection: {websocket.client}. Total: {len(self.active_connections)}")
+        client = _Client(websocket)
+        self._clients[websocket] = client
+        client.sender = asyncio.create_task(self._drain(client))
+        if user_id is not None:
+            self.subscribe(websocket, patient_topic(user_id))
+        logger.info("New connection: %s (user %s). Total: %d", websocket.client, user_id, len(self._clients))
 
     def disconnect(self, websocket: WebSocket):
-        """Removes a WebSocket connection."""
-        self.active_connections.remove(websocket)
-        print(f"Connection closed: {websocket.client}. Total: {len(self.active_connections)}")
+        """Removes a WebSocket connection. Safe to call more than once for the same socket."""
+        client = self._clients.pop(websocket, None)
+        if client is None:
+            return
+        for topic in client.topics:
+            self._remove_subscriber(topic, websocket)
+        if client.sender is not None and client.sender is not asyncio.current_task():
+            client.sender.cancel()
+        logger.info("Connection closed: %s. Total: %d", websocket.client, len(self._clients))
+
+    def subscribe(self, websocket: WebSocket, topic: str):
+        client = self._clients.get(websocket)
+        if client is None:
+            return
+        client.topics.add(topic)
+        subscribers = self._topics.get(topic)
+        if subscribers is None:
+            subscribers = self._topics[topic] = set()
+            subscribers.add(websocket)
+            # First dashboard for this topic on this worker: start receiving it
+            backplane.watch(topic, lambda payload, topic=topic: self.deliver(topic, payload))
+        else:
+            subscribers.add(websocket)
+
+    def unsubscribe(self, websocket: WebSocket, topic: str):
+        client = self._clients.get(websocket)
+        if client is None:
+            return
+        client.topics.discard(topic)
+        self._remove_subscriber(topic, websocket)
+
+    def _remove_subscriber(self, topic: str, websocket: WebSocket):
+        subscribers = self._topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(websocket)
+            if not subscribers:
+                del self._topics[topic]
+                backplane.unwatch(topic)
+
+    def connection_count(self) -> int:
+        return len(self._clients)
+
+    def send_backlog(self) -> int:
+        """Total messages queued but not yet sent, across all clients."""
+        return sum(client.queue.qsize() for client in self._clients.values())
+
+    def subscribed_user_ids(self) -> List[int]:
+        """Returns the patients that currently have at least one dashboard subscribed."""
+        return [int(topic.split(":", 1)[1]) for topic in self._topics if topic.startswith("patient:")]
+
+    def publish(self, topic: str, message: dict) -> int:
+        """Queues a message for every subscriber of `topic` on this worker only."""
+        return self.deliver(topic, json.dumps(message, separators=(",", ":")))
+
+    def deliver(self, topic: str, payload: str) -> int:
+        """Queues an already-serialized message for this worker's subscribers of `topic`. Returns how many."""
+        subscribers = self._topics.get(topic)
+        if not subscribers:
+            return 0
+        started = time.perf_counter()
+        for websocket in list(subscribers):
+            self._offer(self._clients[websocket], payload)
+        metrics.FANOUT_SECONDS.observe(time.perf_counter() - started)
+        return len(subscribers)
+
+    async def send_to_user(self, user_id: int, message: dict):
+        """Sends a JSON message to every client subscribed to one patient, on any worker."""
+        # The ASGI text frame takes a str, so this is the one and only serialization.
+        await backplane.publish(patient_topic(user_id), json.dumps(message, separators=(",", ":")))
 
     async def broadcast(self, message: dict):
-        """Sends a JSON message to all connected clients."""
-        disconnected_clients = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except Exception:
-                # If sending fails, the client has likely disconnected.
-                disconnected_clients.append(connection)
-        
-        # Clean up dead connections
-        for client in disconnected_clients:
-            self.disconnect(client)
+        """Sends a JSON message to all clients connected to this worker."""
+        payload = json.dumps(message, separators=(",", ":"))
+        for client in list(self._clients.values()):
+            self._offer(client, payload)
+
+    def _offer(self, client: _Client, payload: str):
+        try:
+            client.queue.put_nowait(payload)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if WS_SLOW_CONSUMER_POLICY == "conflate":
+            # Throw away the backlog and keep only the newest message.
+            while not client.queue.empty():
+                client.queue.get_nowait()
+            client.queue.put_nowait(payload)
+            client.conflations += 1
+            metrics.WS_SLOW_CONSUMERS.labels("conflated").inc()
+        else:
+            metrics.WS_SLOW_CONSUMERS.labels("dropped").inc()
+            logger.warning("Dropping slow WebSocket consumer: %s", client.websocket.client)
+            self._evict(client)
+
+    def _evict(self, client: _Client):
+        self.disconnect(client.websocket)
+        asyncio.create_task(self._close_quietly(client.websocket))
+
+    async def _drain(self, client: _Client):
+        """Sends queued payloads to one client, in order, until it disconnects."""
+        try:
+            while True:
+                payload = await client.queue.get()
+                await asyncio.wait_for(client.websocket.send_text(payload), WS_SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # If sending fails or stalls, the client has likely disconnected.
+            self.disconnect(client.websocket)
+            await self._close_quietly(client.websocket)
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
 
 # Create a single instance of the manager to be used across the app
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
+metrics.WS_CONNECTIONS.set_function(manager.connection_count)
+metrics.WS_SEND_BACKLOG.set_function(manager.send_backlog)
@@ -23,6 +23,8 @@ export const ReflectionJournal: React.FC = () => {
   const [isLoading, setIsLoading] = useState(true); // Start true to show loading message
   const [isSaving, setIsSaving] = useState(false); // A separate state for the save button
   const [error, setError] = useState('');
+  // The encouragement as the model writes it, shown until the saved entry arrives
+  const [streamingFeedback, setStreamingFeedback] = useState('');
 
   // This hook fetches all past journal entries when the page first loads
   useEffect(() => {
@@ -48,22 +50,45 @@ export const ReflectionJournal: React.FC = () => {
 
     setIsSaving(true);
     setError('');
+    setStreamingFeedback('');
     try {
-      const response = await fetch(API_URL, {
+      // The stream endpoint sends server-sent events: "encouragement" pieces while the
+      // AI writes, then the saved entry as "result" (or "error")
+      const response = await fetch(`${API_URL}/stream`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ content: newEntry }),
       });
-      if (!response.ok) throw new Error('Failed to save your entry.');
-      const savedEntry = await response.json();
-      
+      if (!response.ok || !response.body) throw new Error('Failed to save your entry.');
+
+      const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+      let buffer = '';
+      let savedEntry: JournalEntry | null = null;
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value;
+        let end;
+        while ((end = buffer.indexOf('\n\n')) >= 0) {
+          const message = buffer.slice(0, end);
+          buffer = buffer.slice(end + 2);
+          const event = message.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(message.match(/^data: (.*)$/m)?.[1] ?? '{}');
+          if (event === 'encouragement') setStreamingFeedback(previous => previous + data.text);
+          else if (event === 'result') savedEntry = data;
+          else if (event === 'error') throw new Error(data.detail);
+        }
+      }
+      if (!savedEntry) throw new Error('Failed to save your entry.');
+
       // Add the new entry to the top of the list in our UI
-      setEntries([savedEntry, ...entries]);
+      setEntries(previous => [savedEntry!, ...previous]);
       setNewEntry(''); // Clear the input box for the next entry
     } catch (err: any) {
       setError(err.message);
     } finally {
       setIsSaving(false);
+      setStreamingFeedback('');
     }
   };
 
@@ -94,6 +119,11 @@ export const ReflectionJournal: React.FC = () => {
               {isSaving ? 'Saving...' : 'Save My Thoughts'}
             </button>
           </div>
+          {isSaving && streamingFeedback && (
+            <div className="mt-4 p-3 bg-secondary/10 rounded-md">
+              <p className="text-sm font-semibold text-secondary">{streamingFeedback}</p>
+            </div>
+          )}
           {error && <div className="mt-4 p-3 bg-red-100 text-accent rounded-md"><p>{error}</p></div>}
         </form>
       </div>